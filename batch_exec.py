@@ -0,0 +1,126 @@
+"""Run one command on many hosts at once and stream the output back.
+
+BatchRunner executes on pooled connections with at most `concurrency` hosts in
+flight. Everything it produces goes into a queue.Queue as plain tuples, so the
+Tk side only has to drain the queue from an after() loop:
+
+    ("start", key)
+    ("line", key, "stdout" | "stderr", text)
+    ("done", key, exit_status or None, runtime_seconds, error or None)
+    ("finished",)
+"""
+import codecs
+import queue
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CONCURRENCY = 10
+READ_SIZE = 32768
+POLL_INTERVAL = 0.05
+
+
+class LineSplitter:
+    """Bytes in, complete lines out; the UTF-8 decoder keeps split multibyte characters intact"""
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.partial = ""
+
+    def feed(self, data):
+        text = self.partial + self.decoder.decode(data)
+        lines = text.split('\n')
+        self.partial = lines.pop()
+        return [l.rstrip('\r') for l in lines]
+
+    def flush(self):
+        text = self.partial + self.decoder.decode(b'', final=True)
+        self.partial = ""
+        return [text.rstrip('\r')] if text else []
+
+
+class BatchRunner:
+    def __init__(self, targets, command, concurrency=DEFAULT_CONCURRENCY, timeout=None):
+        """targets: [(key, client)] where client has get_transport() (SSHClient or pool Lease)"""
+        self.targets = list(targets)
+        self.command = command
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.events = queue.Queue()
+        self.cancelled = False
+        self.channels = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True, name="batch-exec").start()
+        return self
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            for key, client in self.targets:
+                pool.submit(self.run_one, key, client)
+        self.events.put(("finished",))
+
+    def cancel(self):
+        self.cancelled = True
+        with self.lock:
+            channels = list(self.channels)
+        for ch in channels:
+            try:
+                ch.close()
+            except Exception:
+                pass
+
+    def run_one(self, key, client):
+        if self.cancelled:
+            self.events.put(("done", key, None, 0.0, "已取消"))
+            return
+        self.events.put(("start", key))
+        start = time.monotonic()
+        channel = None
+        try:
+            transport = client.get_transport()
+            if not transport or not transport.is_active():
+                raise OSError("连接已断开")
+            channel = transport.open_session()
+            with self.lock:
+                self.channels.add(channel)
+            channel.exec_command(self.command)
+            status = self.pump(key, channel, start)
+            self.events.put(("done", key, status, time.monotonic() - start, None))
+        except Exception as e:
+            self.events.put(("done", key, None, time.monotonic() - start, str(e) or type(e).__name__))
+        finally:
+            if channel is not None:
+                with self.lock:
+                    self.channels.discard(channel)
+                channel.close()
+
+    def pump(self, key, channel, start):
+        streams = {
+            'stdout': (channel.recv_ready, channel.recv, LineSplitter()),
+            'stderr': (channel.recv_stderr_ready, channel.recv_stderr, LineSplitter()),
+        }
+        while True:
+            got = False
+            for name, (ready, recv, splitter) in streams.items():
+                while ready():
+                    data = recv(READ_SIZE)
+                    if not data:
+                        break
+                    got = True
+                    for line in splitter.feed(data):
+                        self.events.put(("line", key, name, line))
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            if self.cancelled or channel.closed:
+                raise OSError("已取消" if self.cancelled else "通道已关闭")
+            if self.timeout and time.monotonic() - start > self.timeout:
+                raise TimeoutError(f"超时 ({self.timeout}s)")
+            if not got:
+                # The channel's fileno wakes us on stdout; stderr is picked up within POLL_INTERVAL
+                select.select([channel], [], [], POLL_INTERVAL)
+        for name, (_, _, splitter) in streams.items():
+            for line in splitter.flush():
+                self.events.put(("line", key, name, line))
+        return channel.recv_exit_status()
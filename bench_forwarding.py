@@ -0,0 +1,501 @@
+"""Port-forwarding benchmarks against an in-process paramiko server stand-in.
+
+Traffic goes client -> forwarder -> SSH -> stand-in server -> local echo service
+and back, for each connection count x payload size.
+
+    python bench_forwarding.py local --conns 1 10 100 --size 65536 1048576
+    python bench_forwarding.py all --read-size 16384 --transports 2 --output bench_output.txt
+"""
+import argparse
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+
+import paramiko
+
+from forwarding import (ForwardingEngine, PortForwarder, RemoteForwarder, SocksForwarder, TransportGroup,
+                        DEFAULT_READ_SIZE, percentile)
+from transport_tuning import nodelay_transport, set_nodelay
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+
+
+def pump(sock, channel):
+    """Relay one stand-in connection until both sides are done (server side, thread per conn)"""
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ, 'sock')
+    sel.register(channel, selectors.EVENT_READ, 'chan')
+    open_sides = 2
+    try:
+        while open_sides:
+            for key, _ in sel.select():
+                if key.data == 'sock':
+                    data = sock.recv(65536)
+                    if data:
+                        channel.sendall(data)
+                    else:
+                        channel.shutdown_write()
+                        sel.unregister(sock)
+                        open_sides -= 1
+                else:
+                    data = channel.recv(65536)
+                    if data:
+                        sock.sendall(data)
+                    else:
+                        sock.shutdown(socket.SHUT_WR)
+                        sel.unregister(channel)
+                        open_sides -= 1
+    except (OSError, EOFError):
+        pass
+    finally:
+        sel.close()
+        channel.close()
+        sock.close()
+
+
+def spawn(target, *args):
+    t = threading.Thread(target=target, args=args, daemon=True, name="standin")
+    t.start()
+    return t
+
+
+class StandInInterface(paramiko.ServerInterface):
+    def __init__(self, server, transport):
+        self.server = server
+        self.transport = transport
+        self.destinations = {}
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (BENCH_USER, BENCH_PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_port_forward_request(self, address, port):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind(("127.0.0.1", port))
+        except OSError:
+            # Deny like sshd does; raising here would tear the transport down
+            listener.close()
+            return False
+        listener.listen(socket.SOMAXCONN)
+        listener.settimeout(1)
+        port = listener.getsockname()[1]
+        self.server.remote_listeners[port] = listener
+        spawn(self.server.accept_forwarded, self.transport, listener, address, port)
+        return port
+
+    def cancel_port_forward_request(self, address, port):
+        listener = self.server.remote_listeners.pop(port, None)
+        if listener:
+            listener.close()
+
+
+class StandInServer:
+    """Minimal SSH server on localhost: password auth, direct-tcpip and tcpip-forward"""
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(socket.SOMAXCONN)
+        self.port = self.listener.getsockname()[1]
+        self.remote_listeners = {}
+        self.transports = []
+        spawn(self.serve)
+
+    def serve(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            set_nodelay(transport)
+            # Offer zlib so compression profiles can be measured; clients that don't ask get none
+            transport.use_compression(True)
+            transport.add_server_key(self.host_key)
+            interface = StandInInterface(self, transport)
+            try:
+                transport.start_server(server=interface)
+            except (paramiko.SSHException, EOFError):
+                continue
+            self.transports.append(transport)
+            spawn(self.accept_channels, transport, interface)
+
+    def accept_channels(self, transport, interface):
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            dest = interface.destinations.pop(channel.get_id(), None)
+            if dest is None:
+                continue
+            try:
+                sock = socket.create_connection(dest)
+            except OSError:
+                channel.close()
+                continue
+            # Like sshd: a tunnel to another SSH server would otherwise stall its handshake on Nagle
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            spawn(pump, sock, channel)
+
+    def accept_forwarded(self, transport, listener, address, port):
+        while transport.is_active():
+            try:
+                sock, origin = listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            sock.settimeout(None)
+            try:
+                channel = transport.open_forwarded_tcpip_channel(origin, (address, port))
+            except Exception:
+                sock.close()
+                continue
+            spawn(pump, sock, channel)
+        # The session is gone, free the port like sshd would
+        if self.remote_listeners.get(port) is listener:
+            del self.remote_listeners[port]
+        listener.close()
+
+    def connect(self, profile=None):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect("127.0.0.1", port=self.port, username=BENCH_USER, password=BENCH_PASSWORD,
+                       look_for_keys=False, allow_agent=False,
+                       **((profile and profile.connect_kwargs()) or {'transport_factory': nodelay_transport}))
+        set_nodelay(client.get_transport())
+        return client
+
+    def close(self):
+        self.listener.close()
+        for listener in list(self.remote_listeners.values()):
+            listener.close()
+        for transport in self.transports:
+            transport.close()
+
+
+class EchoService:
+    """Single-threaded local echo server, the target of every benchmark"""
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(socket.SOMAXCONN)
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.listener, selectors.EVENT_READ, None)
+        self.pending = {}
+        spawn(self.run)
+
+    def run(self):
+        while True:
+            for key, mask in self.sel.select():
+                if key.data is None:
+                    try:
+                        conn, _ = self.listener.accept()
+                    except OSError:
+                        continue
+                    conn.setblocking(False)
+                    self.pending[conn] = b''
+                    self.sel.register(conn, selectors.EVENT_READ, 'conn')
+                    continue
+                conn = key.fileobj
+                try:
+                    if mask & selectors.EVENT_READ and not self.pending[conn]:
+                        data = conn.recv(65536)
+                        if not data:
+                            self.sel.unregister(conn)
+                            del self.pending[conn]
+                            conn.close()
+                            continue
+                        self.pending[conn] = data
+                    if self.pending[conn]:
+                        sent = conn.send(self.pending[conn])
+                        self.pending[conn] = self.pending[conn][sent:]
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError:
+                    self.sel.unregister(conn)
+                    self.pending.pop(conn, None)
+                    conn.close()
+                    continue
+                self.sel.modify(conn, selectors.EVENT_WRITE if self.pending[conn] else selectors.EVENT_READ, 'conn')
+
+
+def socks_connect(sock, port):
+    sock.sendall(b'\x05\x01\x00')
+    sock.recv(2)
+    sock.sendall(b'\x05\x01\x00\x01' + socket.inet_aton("127.0.0.1") + struct.pack('>H', port))
+    reply = b''
+    while len(reply) < 10:
+        chunk = sock.recv(10 - len(reply))
+        if not chunk:
+            raise OSError("SOCKS proxy closed the connection")
+        reply += chunk
+    if reply[1] != 0:
+        raise OSError(f"SOCKS connect failed: {reply[1]}")
+
+
+def echo_roundtrip(port, payload, socks_target=None):
+    """Send payload through port and read the echo back; returns (ok, connect_s, total_s)"""
+    start = time.perf_counter()
+    sock = socket.create_connection(("127.0.0.1", port))
+    if socks_target:
+        socks_connect(sock, socks_target)
+    connected = time.perf_counter()
+
+    def writer():
+        try:
+            sock.sendall(payload)
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+    t = threading.Thread(target=writer, daemon=True)
+    t.start()
+    received = 0
+    view = memoryview(bytearray(65536))
+    ok = True
+    while True:
+        n = sock.recv_into(view)
+        if not n:
+            break
+        if bytes(view[:n]) != payload[received:received + n]:
+            ok = False
+        received += n
+    t.join()
+    sock.close()
+    return ok and received == len(payload), connected - start, time.perf_counter() - start
+
+
+class ResourceSampler:
+    """Peak forwarding-side threads and Python heap while a run is in progress"""
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_threads = 0
+        self.running = False
+
+    @staticmethod
+    def forwarding_threads():
+        # Stand-in server and load-driver threads are harness, not the code under test
+        return sum(1 for t in threading.enumerate() if t.name not in ("standin", "driver"))
+
+    def sample(self):
+        while self.running:
+            self.peak_threads = max(self.peak_threads, self.forwarding_threads())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        tracemalloc.reset_peak()
+        self.heap_start = tracemalloc.get_traced_memory()[0]
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True, name="driver")
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        self.peak_heap = tracemalloc.get_traced_memory()[1] - self.heap_start
+
+
+def rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def run_clients(port, conns, size, socks_target=None, payload=None):
+    if payload is None:
+        payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    results = [None] * conns
+    threads = []
+    with ResourceSampler() as sampler:
+        start = time.perf_counter()
+        for i in range(conns):
+            def drive(i=i):
+                try:
+                    results[i] = echo_roundtrip(port, payload, socks_target)
+                except OSError:
+                    results[i] = None
+            t = threading.Thread(target=drive, daemon=True, name="driver")
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    done = [r for r in results if r]
+    latencies = [r[2] for r in done]
+    connects = [r[1] for r in done]
+    return {
+        'conns': conns,
+        'size': size,
+        'ok': sum(1 for r in done if r[0]),
+        'elapsed': elapsed,
+        'mb_s': 2 * size * len(done) / elapsed / 1024 / 1024,   # both directions
+        'conn_s': len(done) / elapsed,
+        'connect_p50_ms': percentile(connects, 50) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'threads': sampler.peak_threads,
+        'heap_mb': sampler.peak_heap / 1024 / 1024,
+    }
+
+
+COLUMNS = [
+    ("mode", "<8", "{}"), ("conns", ">6", "{}"), ("bytes", ">9", "{}"), ("ok", ">5", "{}"),
+    ("MB/s", ">8", "{:.1f}"), ("conn/s", ">8", "{:.1f}"), ("conn ms", ">8", "{:.1f}"),
+    ("p50 ms", ">8", "{:.1f}"), ("p99 ms", ">8", "{:.1f}"), ("thr", ">5", "{}"), ("heap MB", ">8", "{:.1f}"),
+]
+
+
+def format_header():
+    return "".join(format(name, align) for name, align, _ in COLUMNS)
+
+
+def format_row(mode, r):
+    values = [mode, r['conns'], r['size'], r['ok'], r['mb_s'], r['conn_s'], r['connect_p50_ms'],
+              r['p50_ms'], r['p99_ms'], r['threads'], r['heap_mb']]
+    return "".join(format(fmt.format(v), align) for v, (_, align, fmt) in zip(values, COLUMNS))
+
+
+class Bench:
+    def __init__(self, args, out):
+        self.args = args
+        self.out = out
+        self.server = StandInServer()
+        self.echo = EchoService()
+        self.clients = [self.server.connect() for _ in range(args.transports)]
+        transports = [c.get_transport() for c in self.clients]
+        self.transport = transports[0] if len(transports) == 1 else TransportGroup(transports, args.strategy)
+
+    def emit(self, line):
+        print(line)
+        if self.out:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def engine(self):
+        return ForwardingEngine(read_size=self.args.read_size, buffer_size=self.args.buffer_size)
+
+    def matrix(self, mode, port, forwarder, socks_target=None):
+        # Warm-up: first channel pays for worker-pool and stand-in thread start-up
+        echo_roundtrip(port, b'warm-up', socks_target)
+        for size in self.args.size:
+            for conns in self.args.conns:
+                self.emit(format_row(mode, run_clients(port, conns, size, socks_target)))
+        snap = forwarder.snapshot()
+        self.emit(f"  {snap['mapping']}: total={snap['total']} in={snap['bytes_in']} out={snap['bytes_out']} "
+                  f"open avg={snap['open_latency_avg'] * 1000:.1f}ms errors={snap['errors']}")
+
+    def wait_bound(self, forwarder):
+        deadline = time.time() + 5
+        while not forwarder.bound_ports and time.time() < deadline:
+            time.sleep(0.01)
+        if not forwarder.bound_ports:
+            raise RuntimeError(f"{forwarder.describe()} was not established")
+
+    def bench_local(self):
+        engine = self.engine()
+        port = free_port()
+        forwarder = PortForwarder(port, "127.0.0.1", self.echo.port, self.transport, engine)
+        forwarder.start()
+        self.wait_bound(forwarder)
+        self.matrix("local", port, forwarder)
+        engine.stop()
+
+    def bench_socks(self):
+        engine = self.engine()
+        port = free_port()
+        forwarder = SocksForwarder(port, self.transport, engine)
+        forwarder.start()
+        self.wait_bound(forwarder)
+        self.matrix("socks", port, forwarder, socks_target=self.echo.port)
+        engine.stop()
+
+    def bench_remote(self):
+        engine = self.engine()
+        # The server delivers reverse channels on the transport that asked for them
+        forwarder = RemoteForwarder(0, "127.0.0.1", self.echo.port, self.clients[0].get_transport(), engine)
+        forwarder.start()
+        self.wait_bound(forwarder)
+        self.matrix("remote", forwarder.remote_port, forwarder)
+        engine.stop()
+
+    def run(self, modes):
+        a = self.args
+        self.emit(f"read_size={a.read_size} buffer_size={a.buffer_size or 2 * a.read_size} "
+                  f"transports={a.transports} strategy={a.strategy}")
+        self.emit(format_header())
+        for mode in modes:
+            getattr(self, f"bench_{mode}")()
+        rss = rss_mb()
+        if rss is not None:
+            self.emit(f"peak RSS {rss:.1f} MB")
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.server.close()
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Port-forwarding benchmark")
+    parser.add_argument("mode", choices=["local", "socks", "remote", "all"])
+    parser.add_argument("--conns", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--size", type=int, nargs="+", default=[64 * 1024, 1024 * 1024])
+    parser.add_argument("--read-size", type=int, default=DEFAULT_READ_SIZE)
+    parser.add_argument("--buffer-size", type=int, default=None)
+    parser.add_argument("--transports", type=int, default=1)
+    parser.add_argument("--strategy", choices=[TransportGroup.LEAST_LOADED, TransportGroup.ROUND_ROBIN],
+                        default=TransportGroup.LEAST_LOADED)
+    parser.add_argument("--output", help="Also append results to this file")
+    args = parser.parse_args()
+
+    modes = ["local", "socks", "remote"] if args.mode == "all" else [args.mode]
+    tracemalloc.start()
+    out = open(args.output, "a", encoding="utf-8") if args.output else None
+    bench = Bench(args, out)
+    try:
+        bench.run(modes)
+    finally:
+        bench.close()
+        if out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Handshake time and bulk throughput per connection profile (ssh_profiles.PROFILES).
+
+Uses the same in-process stand-in server as bench_forwarding.py. Each profile
+connects --handshakes times (TCP + kex + password auth) and then pushes
+--size bytes per connection through a local forward to the echo service, once
+with log-like text and once with random bytes, so compression shows both its
+gain and its CPU cost. The stand-in runs on loopback, so MB/s is CPU-bound;
+"zlib" is the size ratio zlib gets on the payload, i.e. the wire saving a
+compressing profile would give on a slow link.
+
+    python bench_profiles.py
+    python bench_profiles.py --profiles 默认 AES-GCM --size 4194304 --output bench_output.txt
+"""
+import argparse
+import os
+import time
+import zlib
+
+from bench_forwarding import EchoService, StandInServer, free_port, run_clients
+from forwarding import ForwardingEngine, PortForwarder, percentile
+from ssh_profiles import PROFILES, negotiated
+
+
+def text_payload(size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = f"2024-05-01T12:{i // 60 % 60:02d}:{i % 60:02d} INFO GET /api/v1/items?id={i * 7} 200 {i % 97}ms\n"
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return "".join(lines).encode()[:size]
+
+
+COLUMNS = [
+    ("profile", "<18", "{}"), ("cipher", "<24", "{}"), ("mac", "<30", "{}"), ("comp", "<18", "{}"),
+    ("hs p50", ">8", "{:.1f}"), ("hs min", ">8", "{:.1f}"), ("payload", ">8", "{}"), ("zlib", ">6", "{:.2f}"),
+    ("MB/s", ">8", "{:.1f}"),
+]
+
+
+def format_header():
+    return "".join(format(name, align) for name, align, _ in COLUMNS)
+
+
+def format_row(values):
+    return "".join(format(fmt.format(v), align) for v, (_, align, fmt) in zip(values, COLUMNS))
+
+
+class ProfileBench:
+    def __init__(self, args, out):
+        self.args = args
+        self.out = out
+        self.server = StandInServer()
+        self.echo = EchoService()
+        self.payloads = {
+            "text": text_payload(args.size),
+            "random": os.urandom(args.size),
+        }
+        self.ratios = {name: len(zlib.compress(data)) / len(data) for name, data in self.payloads.items()}
+
+    def emit(self, line):
+        print(line)
+        if self.out:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def handshakes(self, profile):
+        times = []
+        client = None
+        for _ in range(self.args.handshakes):
+            if client:
+                client.close()
+            start = time.perf_counter()
+            client = self.server.connect(profile)
+            times.append(time.perf_counter() - start)
+        return client, times
+
+    def bench(self, profile):
+        client, times = self.handshakes(profile)
+        agreed = negotiated(client.get_transport())
+        engine = ForwardingEngine()
+        port = free_port()
+        forwarder = PortForwarder(port, "127.0.0.1", self.echo.port, client.get_transport(), engine)
+        forwarder.start()
+        deadline = time.time() + 5
+        while not forwarder.bound_ports and time.time() < deadline:
+            time.sleep(0.01)
+        try:
+            for name, payload in self.payloads.items():
+                r = run_clients(port, self.args.conns, len(payload), payload=payload)
+                self.emit(format_row([
+                    profile.name, agreed['cipher'], agreed['mac'], agreed['compression'],
+                    percentile(times, 50) * 1000, min(times) * 1000, name, self.ratios[name], r['mb_s'],
+                ]))
+        finally:
+            engine.stop()
+            client.close()
+
+    def run(self, names):
+        a = self.args
+        self.emit(f"handshakes={a.handshakes} conns={a.conns} size={a.size}")
+        self.emit(format_header())
+        for name in names:
+            self.bench(PROFILES[name])
+
+    def close(self):
+        self.server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connection profile benchmark")
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--handshakes", type=int, default=5)
+    parser.add_argument("--conns", type=int, default=4)
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--output", help="Also append results to this file")
+    args = parser.parse_args()
+
+    out = open(args.output, "a", encoding="utf-8") if args.output else None
+    bench = ProfileBench(args, out)
+    try:
+        bench.run(args.profiles)
+    finally:
+        bench.close()
+        if out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
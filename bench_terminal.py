@@ -0,0 +1,244 @@
+"""Terminal output throughput: screen model + damage-tracked rendering vs. the old writer.
+
+Feeds generated shell output to AnsiColorText in 4 KB chunks (the reader's
+recv size) and reports MB/s for the VT screen model alone, for the widget
+(model + rendering into Tk) and for the previous per-character writer, which
+did a compare/get/delete/insert against the Text widget for every character.
+The old writer is slow enough that it only gets the first --legacy-size bytes
+of each workload; speedup is widget MB/s over legacy MB/s.
+
+A second table is the screen model's printable-text path alone in chars/s:
+every character through Screen.put() (per char) against runs copied into the
+line a slice at a time (runs, Screen.fast_draw).
+
+    python bench_terminal.py
+    python bench_terminal.py --size 10485760 --workloads log ls --output bench_output.txt
+
+The widget columns need a display (Tk); without one only the model is measured.
+"""
+import argparse
+import re
+import time
+import tkinter as tk
+
+from vt_screen import DEFAULT_COLS, DEFAULT_ROWS, Screen
+
+CHUNK = 4096
+
+
+def log_output(size):
+    lines, total, i = [], 0, 0
+    while total < size:
+        line = f"2024-05-01T12:{i // 60 % 60:02d}:{i % 60:02d} INFO worker-{i % 7} GET /api/v1/items?id={i * 7} 200 {i % 97}ms\r\n"
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return "".join(lines)[:size]
+
+
+def ls_output(size):
+    """ls -R --color: a colour escape around every name"""
+    parts, total, i = [], 0, 0
+    while total < size:
+        color = (34, 32, 36, 0)[i % 4]
+        name = f"\x1b[01;{color}mfile_{i:06d}.txt\x1b[0m" if color else f"file_{i:06d}.txt"
+        part = name + ("\r\n" if i % 6 == 5 else "  ")
+        parts.append(part)
+        total += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def progress_output(size):
+    """A progress bar redrawn in place with \\r"""
+    parts, total, i = [], 0, 0
+    while total < size:
+        pct = i % 101
+        part = f"\r[{'#' * (pct // 2):<50}] {pct:3d}% \x1b[32m{i * 13 % 9999} KB/s\x1b[0m"
+        if pct == 100:
+            part += "\r\n"
+        parts.append(part)
+        total += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def tui_output(size):
+    """Full-screen redraws (top/htop style): cursor addressing, colours, erase to end of line"""
+    parts, total, frame = ["\x1b[?1049h"], 0, 0
+    while total < size:
+        part = "\x1b[H"
+        for row in range(1, DEFAULT_ROWS + 1):
+            part += f"\x1b[{row};1H\x1b[7m{row:3d}\x1b[0m \x1b[3{row % 8}mproc-{(row * frame) % 997:<6}\x1b[0m " \
+                    f"{(row * 31 + frame) % 100:5.1f}%\x1b[K"
+        parts.append(part)
+        total += len(part)
+        frame += 1
+    parts.append("\x1b[?1049l")
+    return "".join(parts)
+
+
+WORKLOADS = {"log": log_output, "ls": ls_output, "progress": progress_output, "tui": tui_output}
+
+
+class LegacyText(tk.Text):
+    """The writer AnsiColorText used before the screen model: its printable, CR/LF, SGR and EL paths"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ansi_regex = re.compile(r'(\x1b\[[\?]?[0-9;]*[a-zA-Z]|\x08|\r|\n|\x07)')
+        self.current_tags = set()
+        self.mark_set("term_cursor", "end-1c")
+        self.mark_gravity("term_cursor", tk.RIGHT)
+
+    def write(self, text):
+        for part in self.ansi_regex.split(text):
+            if not part:
+                continue
+            if part == '\r':
+                self.mark_set("term_cursor", "term_cursor linestart")
+                continue
+            if part == '\n':
+                current_line = int(self.index("term_cursor").split('.')[0])
+                last_line = int(self.index("end-1c").split('.')[0])
+                if current_line >= last_line:
+                    self.mark_set("term_cursor", "end-1c")
+                    self.insert("term_cursor", "\n")
+                else:
+                    self.mark_set("term_cursor", "term_cursor + 1 lines")
+                continue
+            if part.startswith('\x1b['):
+                body = part[2:]
+                if body in ('K', '0K'):
+                    self.delete("term_cursor", "term_cursor lineend")
+                elif body.endswith('H'):
+                    fields = body[:-1].split(';')
+                    row = int(fields[0]) if fields[0] else 1
+                    col = int(fields[1]) if len(fields) > 1 and fields[1] else 1
+                    self.mark_set("term_cursor", f"{row}.{col - 1}")
+                elif body.endswith('m'):
+                    params = [int(p) for p in body[:-1].split(';') if p.isdigit()] or [0]
+                    for p in params:
+                        if p == 0:
+                            self.current_tags.clear()
+                        elif 30 <= p <= 37:
+                            self.current_tags = {t for t in self.current_tags if not t.startswith("fg_")}
+                            self.current_tags.add(f"fg_{p}")
+                continue
+            for char in part:
+                if self.compare("term_cursor", "==", "term_cursor lineend"):
+                    self.insert("term_cursor", char, tuple(self.current_tags))
+                elif self.get("term_cursor") == "\n":
+                    self.insert("term_cursor", char, tuple(self.current_tags))
+                else:
+                    self.delete("term_cursor")
+                    self.insert("term_cursor", char, tuple(self.current_tags))
+        self.see("term_cursor")
+
+
+def chunks(data):
+    return [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+
+
+def mb_s(size, seconds):
+    return size / seconds / 1024 / 1024 if seconds else float('inf')
+
+
+def bench_model(data):
+    screen = Screen()
+    start = time.perf_counter()
+    for chunk in chunks(data):
+        screen.feed(chunk)
+        screen.take_scrolled()
+    return mb_s(len(data), time.perf_counter() - start)
+
+
+def bench_chars(data, fast):
+    """Model chars/s with the run fast path on or off"""
+    screen = Screen()
+    screen.fast_draw = fast
+    parts = chunks(data)
+    start = time.perf_counter()
+    for chunk in parts:
+        screen.feed(chunk)
+        screen.take_scrolled()
+    elapsed = time.perf_counter() - start
+    return len(data) / elapsed if elapsed else float('inf')
+
+
+def bench_widget(root, widget_class, data):
+    widget = widget_class(root)
+    widget.pack()
+    start = time.perf_counter()
+    for chunk in chunks(data):
+        widget.write(chunk)
+    root.update_idletasks()
+    elapsed = time.perf_counter() - start
+    widget.destroy()
+    return mb_s(len(data), elapsed)
+
+
+COLUMNS = [
+    ("workload", "<10", "{}"), ("MB", ">7", "{:.1f}"), ("model MB/s", ">12", "{:.1f}"),
+    ("widget MB/s", ">13", "{}"), ("legacy MB/s", ">13", "{}"), ("speedup", ">9", "{}"),
+]
+
+
+def format_header():
+    return "".join(format(name, align) for name, align, _ in COLUMNS)
+
+
+def format_row(values):
+    return "".join(format(fmt.format(v), align) for v, (_, align, fmt) in zip(values, COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Terminal output throughput benchmark")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024, help="Bytes of output per workload")
+    parser.add_argument("--legacy-size", type=int, default=128 * 1024, help="Bytes fed to the old writer")
+    parser.add_argument("--output", help="Also append results to this file")
+    args = parser.parse_args()
+
+    try:
+        root = tk.Tk()
+        root.withdraw()
+        from terminal import AnsiColorText
+    except tk.TclError as e:
+        root = None
+        print(f"no display ({e}); measuring the screen model only")
+
+    out = open(args.output, "a", encoding="utf-8") if args.output else None
+
+    def emit(line):
+        print(line)
+        if out:
+            out.write(line + "\n")
+            out.flush()
+
+    emit(f"size={args.size} legacy_size={args.legacy_size} chunk={CHUNK} screen={DEFAULT_ROWS}x{DEFAULT_COLS}")
+    emit(format_header())
+    rates = []
+    try:
+        for name in args.workloads:
+            data = WORKLOADS[name](args.size)
+            model = bench_model(data)
+            widget = legacy = speedup = "-"
+            if root:
+                w = bench_widget(root, AnsiColorText, data)
+                l = bench_widget(root, LegacyText, data[:args.legacy_size])
+                widget, legacy, speedup = f"{w:.1f}", f"{l:.2f}", f"{w / l:.0f}x"
+            emit(format_row([name, len(data) / 1024 / 1024, model, widget, legacy, speedup]))
+            rates.append((name, bench_chars(data, False), bench_chars(data, True)))
+        emit("")
+        emit(f"{'workload':<10}{'per char/s':>14}{'runs/s':>14}{'speedup':>9}")
+        for name, slow, fast in rates:
+            emit(f"{name:<10}{slow:>14,.0f}{fast:>14,.0f}{fast / slow:>8.1f}x")
+    finally:
+        if out:
+            out.close()
+        if root:
+            root.destroy()
+
+
+if __name__ == "__main__":
+    main()
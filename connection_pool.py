@@ -0,0 +1,269 @@
+"""Shared SSH connections keyed by (host, port, user).
+
+Windows lease a connection instead of building their own SSHClient; closing a
+lease hands the connection back to the pool, which keeps it warm until it has
+been idle for idle_timeout. Dead transports are dropped on lease and by the
+reaper, and the least recently used idle connection is evicted when the pool
+is full.
+
+Connections behind a bastion (jump=[JumpHost, ...], see jump.py) ride on a
+direct-tcpip channel of a leased bastion connection. The bastion lease is a
+normal shared one, so every host reached through it shares one transport.
+"""
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from transport_tuning import nodelay_transport
+
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_MAX_CONNECTIONS = 16
+REAP_INTERVAL = 30
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class PooledConnection:
+    def __init__(self, key, client, password, profile=None, jump=None, bastion=None):
+        self.key = key
+        self.client = client
+        self.password = password
+        self.profile = profile      # ConnectionProfile the connection was negotiated with
+        self.jump = list(jump or [])    # JumpHost chain, outermost first
+        self.via = tuple(h.key for h in self.jump)
+        self.bastion = bastion      # Lease on the last hop; held for as long as this connection lives
+        self.leases = 0
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.handshake_time = 0.0
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return bool(transport and transport.is_active())
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+        if self.bastion:
+            bastion, self.bastion = self.bastion, None
+            bastion.close()
+
+
+class Lease:
+    """A borrowed connection. Behaves like the SSHClient; close() returns it to the pool"""
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+        self.client = conn.client
+        self.released = False
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def share(self):
+        """Another lease on the same connection, for a window that may outlive this one"""
+        return self.pool.attach(self.conn)
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.pool.release(self.conn)
+
+    release = close
+
+
+class ConnectionPool:
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_per_host=DEFAULT_MAX_PER_HOST,
+                 max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.idle_timeout = idle_timeout
+        self.max_per_host = max_per_host
+        self.max_connections = max_connections
+        # Reentrant: closing a tunnelled connection releases its bastion lease
+        self.lock = threading.RLock()
+        self.connecting = {}                # (key, via) -> Lock, one shared handshake at a time
+        self.connections = OrderedDict()    # id(conn) -> conn, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.reaper = None
+
+    def connect(self, host, port, user, password, **kwargs):
+        import paramiko     # deferred: importing the pool (e.g. from terminal.py) stays cheap
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        kwargs.setdefault('transport_factory', nodelay_transport)
+        client.connect(host, port=port, username=user, password=password, **kwargs)
+        client.get_transport().set_keepalive(30)
+        return client
+
+    def lease(self, host, port, user, password, fresh=False, profile=None, jump=None, **connect_kwargs):
+        """Lease a healthy connection for (host, port, user).
+
+        fresh=True asks for a connection nobody else is using (e.g. an extra
+        striping transport); it reuses an idle one if there is one, and raises
+        PoolExhausted rather than exceed max_per_host. Only connections made
+        with the same profile (ssh_profiles.ConnectionProfile) and through the
+        same jump hosts are reused.
+        """
+        key = (host, int(port), user)
+        if profile is not None and not profile.connect_kwargs():
+            profile = None      # the default profile is plain paramiko, same as no profile
+        if fresh:
+            return self._lease(key, password, fresh, profile, jump, connect_kwargs)
+        # Concurrent shared leases (e.g. a fleet behind one bastion) wait for the
+        # first handshake and then share it instead of each making their own
+        via = tuple(h.key for h in jump or ())
+        with self.lock:
+            connecting = self.connecting.setdefault((key, via), threading.Lock())
+        with connecting:
+            return self._lease(key, password, fresh, profile, jump, connect_kwargs)
+
+    def _lease(self, key, password, fresh, profile, jump, connect_kwargs):
+        host, port, user = key
+        via = tuple(h.key for h in jump or ())
+        with self.lock:
+            self._drop_dead(key)
+            conn = self._find(key, password, fresh, profile, via)
+            if conn is None and fresh and self._count(key) >= self.max_per_host:
+                raise PoolExhausted(f"{user}@{host}:{port} 已达到 {self.max_per_host} 个连接上限")
+            if conn is not None:
+                self.hits += 1
+                return self._attach(conn)
+            self.misses += 1
+
+        if profile is not None:
+            connect_kwargs = dict(profile.connect_kwargs(), **connect_kwargs)
+        start = time.perf_counter()
+        bastion = None
+        try:
+            if jump:
+                hop = jump[-1]
+                bastion = self.lease(hop.host, hop.port, hop.user, hop.password, jump=jump[:-1],
+                                     timeout=connect_kwargs.get('timeout'))
+                # The inner SSH session runs over this channel instead of a TCP socket
+                connect_kwargs['sock'] = bastion.get_transport().open_channel(
+                    "direct-tcpip", (host, port), ("127.0.0.1", 0), timeout=connect_kwargs.get('timeout'))
+            client = self.connect(host, port, user, password, **connect_kwargs)
+        except Exception:
+            if bastion:
+                bastion.close()
+            raise
+        conn = PooledConnection(key, client, password, profile, jump, bastion)
+        conn.handshake_time = time.perf_counter() - start
+        with self.lock:
+            self.connections[id(conn)] = conn
+            lease = self._attach(conn)
+            self._evict()
+        self.start_reaper()
+        return lease
+
+    def attach(self, conn):
+        with self.lock:
+            return self._attach(conn)
+
+    def release(self, conn):
+        with self.lock:
+            conn.leases = max(0, conn.leases - 1)
+            conn.last_used = time.monotonic()
+            if id(conn) in self.connections:
+                self.connections.move_to_end(id(conn))
+            else:
+                # Evicted or dropped while leased; nobody else can reach it now
+                if conn.leases == 0:
+                    conn.close()
+
+    def _attach(self, conn):
+        conn.leases += 1
+        conn.last_used = time.monotonic()
+        self.connections.move_to_end(id(conn))
+        return Lease(self, conn)
+
+    def _find(self, key, password, fresh, profile=None, via=()):
+        name = profile.name if profile else None
+        candidates = [c for c in self.connections.values()
+                      if c.key == key and hmac.compare_digest(c.password or '', password or '')
+                      and (c.profile.name if c.profile else None) == name and c.via == via]
+        if fresh:
+            candidates = [c for c in candidates if c.leases == 0]
+        elif len(candidates) < self.max_per_host:
+            # Sharing is the point, but a host under the cap gets the least busy transport
+            candidates = [c for c in candidates if c.leases == 0] or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: c.leases)
+
+    def _count(self, key):
+        return sum(1 for c in self.connections.values() if c.key == key)
+
+    def _drop_dead(self, key=None):
+        for cid, conn in list(self.connections.items()):
+            if (key is None or conn.key == key) and not conn.is_active():
+                del self.connections[cid]
+                if conn.leases == 0:
+                    conn.close()
+
+    def _evict(self):
+        # Oldest idle first; connections somebody is leasing are never evicted
+        while len(self.connections) > self.max_connections:
+            idle = next((cid for cid, c in self.connections.items() if c.leases == 0), None)
+            if idle is None:
+                break
+            self.connections.pop(idle).close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            self._drop_dead()
+            for cid, conn in list(self.connections.items()):
+                if conn.leases == 0 and now - conn.last_used > self.idle_timeout:
+                    del self.connections[cid]
+                    conn.close()
+
+    def start_reaper(self):
+        if self.reaper and self.reaper.is_alive():
+            return
+        self.reaper = threading.Thread(target=self.reap, daemon=True, name="pool-reaper")
+        self.reaper.start()
+
+    def reap(self):
+        while True:
+            time.sleep(min(REAP_INTERVAL, max(1, self.idle_timeout / 4)))
+            self.evict_idle()
+            with self.lock:
+                if not self.connections:
+                    return
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                'host': conn.key[0], 'port': conn.key[1], 'user': conn.key[2],
+                'leases': conn.leases, 'active': conn.is_active(),
+                'idle': 0.0 if conn.leases else now - conn.last_used,
+                'handshake': conn.handshake_time, 'via': conn.via,
+            } for conn in self.connections.values()]
+
+    def close(self):
+        with self.lock:
+            conns = list(self.connections.values())
+            self.connections.clear()
+        for conn in conns:
+            conn.close()
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool():
+    """The process-wide pool used by the GUI, toolbox windows and in-process terminals"""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = ConnectionPool()
+        return _shared_pool
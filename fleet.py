@@ -0,0 +1,171 @@
+"""Connect to many hosts at once and keep the sessions around.
+
+Host list format, one host per line (blank lines and # comments ignored):
+
+    [user[:password]@]host[:port]
+
+Missing parts fall back to the defaults from the connect form. Connections go
+through the shared pool on a bounded worker pool, and each result records the
+handshake time (TCP + key exchange + auth) of that host. With a jump chain
+(jump.py) every host is reached through the same shared bastion transport.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from connection_pool import shared_pool
+
+DEFAULT_FLEET_WORKERS = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+
+PENDING = "pending"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+FAILED = "failed"
+
+
+class FleetHost:
+    def __init__(self, host, port=22, user="root", password=""):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        self.state = PENDING
+        self.lease = None
+        self.handshake = None
+        self.error = None
+
+    @property
+    def key(self):
+        return f"{self.user}@{self.host}:{self.port}"
+
+    @property
+    def client(self):
+        return self.lease
+
+    def is_active(self):
+        transport = self.lease.get_transport() if self.lease else None
+        return bool(transport and transport.is_active())
+
+    def info(self):
+        return {'key': self.key, 'host': self.host, 'port': self.port, 'user': self.user,
+                'state': self.state, 'active': self.is_active(),
+                'handshake_ms': round(self.handshake * 1000) if self.handshake is not None else None,
+                'error': str(self.error) if self.error else None}
+
+    def close(self):
+        if self.lease:
+            self.lease.close()
+            self.lease = None
+
+
+def parse_host_line(line, user="root", port=22, password=""):
+    """`[user[:password]@]host[:port]` -> FleetHost, None for blank/comment lines"""
+    line = line.split('#', 1)[0].strip()
+    if not line:
+        return None
+    if '@' in line:
+        cred, line = line.rsplit('@', 1)
+        user, _, pw = cred.partition(':')
+        password = pw or password
+    host, sep, p = line.rpartition(':')
+    if not sep or not p.isdigit():
+        host, p = line, port
+    if not host:
+        raise ValueError(f"无效的主机行: {line}")
+    return FleetHost(host.strip('[]'), int(p), user or "root", password)
+
+
+def parse_hosts(text, user="root", port=22, password=""):
+    hosts, seen = [], set()
+    for line in text.splitlines():
+        h = parse_host_line(line, user, port, password)
+        if h and h.key not in seen:
+            seen.add(h.key)
+            hosts.append(h)
+    return hosts
+
+
+def load_hosts(path, user="root", port=22, password=""):
+    with open(path, encoding='utf-8') as f:
+        return parse_hosts(f.read(), user, port, password)
+
+
+class Fleet:
+    """Registry of fleet sessions, shared by the fleet window and mux masters"""
+    def __init__(self, pool=None):
+        self.pool = pool or shared_pool()
+        self.lock = threading.Lock()
+        self.hosts = {}     # key -> FleetHost, in connect order
+
+    def get(self, key):
+        with self.lock:
+            return self.hosts.get(key)
+
+    def sessions(self):
+        with self.lock:
+            return list(self.hosts.values())
+
+    def connect_all(self, hosts, workers=DEFAULT_FLEET_WORKERS, timeout=DEFAULT_CONNECT_TIMEOUT, on_update=None,
+                    profile=None, jump=None):
+        """Connect every host with at most `workers` handshakes in flight.
+
+        on_update(host) is called from worker threads on every state change.
+        Returns immediately; executor.shutdown(wait=True) on the returned
+        executor waits for the whole batch.
+        """
+        with self.lock:
+            for h in hosts:
+                old = self.hosts.get(h.key)
+                if old is not None and old is not h:
+                    old.close()
+                self.hosts[h.key] = h
+
+        def connect(h):
+            h.state = CONNECTING
+            h.error = None
+            if on_update:
+                on_update(h)
+            start = time.perf_counter()
+            try:
+                h.lease = self.pool.lease(h.host, h.port, h.user, h.password, profile=profile, jump=jump,
+                                          timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+                h.handshake = time.perf_counter() - start
+                h.state = CONNECTED
+            except Exception as e:
+                h.handshake = time.perf_counter() - start
+                h.error = e
+                h.state = FAILED
+            if on_update:
+                on_update(h)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fleet")
+        for h in hosts:
+            executor.submit(connect, h)
+        executor.shutdown(wait=False)
+        return executor
+
+    def remove(self, key):
+        with self.lock:
+            h = self.hosts.pop(key, None)
+        if h:
+            h.close()
+
+    def close_all(self):
+        with self.lock:
+            hosts = list(self.hosts.values())
+            self.hosts.clear()
+        for h in hosts:
+            h.close()
+
+
+_shared_fleet = None
+_shared_lock = threading.Lock()
+
+
+def shared_fleet():
+    global _shared_fleet
+    with _shared_lock:
+        if _shared_fleet is None:
+            _shared_fleet = Fleet()
+        return _shared_fleet
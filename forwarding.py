@@ -0,0 +1,1344 @@
+import errno
+import ipaddress
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_READ_SIZE = 64 * 1024
+MIN_READ_SIZE = 4096
+# How often the loop re-checks channels whose SSH window was full
+WINDOW_POLL_INTERVAL = 0.01
+
+
+# A SOCKS client that has not finished its handshake by then is dropped
+SOCKS_HANDSHAKE_TIMEOUT = 10.0
+
+# Completed-connection lifetimes kept per mapping for the percentiles
+LIFETIME_SAMPLES = 1000
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+# After interactive traffic, bulk mappings share this budget for a while so
+# they cannot queue megabytes on the transport ahead of keystrokes
+INTERACTIVE_HOLD = 0.5
+DEFAULT_BULK_YIELD_RATE = 256 * 1024
+
+# select(), the only selector on Windows, takes at most FD_SETSIZE (512) sockets per call;
+# epoll/kqueue have no such limit. A relay registers two: the client socket and the channel.
+SELECT_FD_LIMIT = 512
+MAX_REGISTERED = SELECT_FD_LIMIT - 8 if selectors.DefaultSelector is selectors.SelectSelector else None
+RELAY_FDS = 2
+# Past that an engine spreads its sockets over up to this many loops
+MAX_LOOPS = 16
+# Channel opens run in parallel, a burst of connections waits on round trips, not on a queue
+DEFAULT_OPEN_WORKERS = 32
+
+
+class EngineFull(Exception):
+    pass
+
+
+class TokenBucket:
+    """Classic token bucket, rate in bytes/s"""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate / 10.0, 16 * 1024))
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def available(self, now=None):
+        now = now or time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return self.tokens
+
+    def consume(self, n):
+        self.tokens -= n
+
+    def wait_time(self, n):
+        """Seconds until n tokens (capped at the burst) are available"""
+        missing = min(n, self.burst) - self.available()
+        return max(missing / self.rate, 0.0)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+class ForwardStats:
+    """Counters for one mapping; updated on the engine loop, readable from any thread"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_in = 0       # remote -> local client
+        self.bytes_out = 0      # local client -> remote
+        self.active = 0
+        self.total = 0
+        self.errors = Counter()
+        self.open_latency_last = 0.0
+        self.open_latency_total = 0.0
+        self.opens = 0
+        self.lifetimes = deque(maxlen=LIFETIME_SAMPLES)
+
+    def record_open(self, latency):
+        with self.lock:
+            self.active += 1
+            self.total += 1
+            self.opens += 1
+            self.open_latency_last = latency
+            self.open_latency_total += latency
+
+    def record_close(self, lifetime):
+        with self.lock:
+            self.active -= 1
+            self.lifetimes.append(lifetime)
+
+    def record_error(self, error):
+        with self.lock:
+            self.errors[type(error).__name__] += 1
+
+    def snapshot(self):
+        with self.lock:
+            lifetimes = list(self.lifetimes)
+            return {
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'active': self.active,
+                'total': self.total,
+                'open_latency_last': self.open_latency_last,
+                'open_latency_avg': self.open_latency_total / self.opens if self.opens else 0.0,
+                'errors': dict(self.errors),
+                'lifetime_p50': percentile(lifetimes, 50),
+                'lifetime_p99': percentile(lifetimes, 99),
+            }
+
+
+class TransportGroup:
+    """Several transports to the same host; new channels go to one of them.
+
+    Quacks like a paramiko Transport for open_channel/is_active, so it can be
+    handed to any forwarder in place of a single transport.
+    """
+    ROUND_ROBIN = "round-robin"
+    LEAST_LOADED = "least-loaded"
+
+    def __init__(self, transports, strategy=LEAST_LOADED, clients=None):
+        self.transports = list(transports)
+        self.strategy = strategy
+        self.clients = list(clients or [])     # extra SSHClients owned (and closed) by the group
+        self.lock = threading.Lock()
+        self.channels = [set() for _ in self.transports]
+        self.totals = [0] * len(self.transports)
+        self.failures = [0] * len(self.transports)
+        self.opening = [0] * len(self.transports)     # opens in flight count as load too
+        self._next = 0
+
+    def _prune(self):
+        for live in self.channels:
+            for ch in [ch for ch in live if ch.closed]:
+                live.discard(ch)
+
+    def pick(self):
+        with self.lock:
+            self._prune()
+            alive = [i for i, t in enumerate(self.transports) if t.is_active()]
+            if not alive:
+                raise OSError("No active transport")
+            choice = None
+            if self.strategy == self.ROUND_ROBIN:
+                for _ in range(len(self.transports)):
+                    i = self._next % len(self.transports)
+                    self._next += 1
+                    if i in alive:
+                        choice = i
+                        break
+            if choice is None:
+                choice = min(alive, key=lambda i: (len(self.channels[i]) + self.opening[i], self.totals[i]))
+            self.opening[choice] += 1
+            return choice
+
+    def open_channel(self, kind, dest_addr=None, src_addr=None, **kwargs):
+        i = self.pick()
+        try:
+            channel = self.transports[i].open_channel(kind, dest_addr, src_addr, **kwargs)
+        except Exception:
+            with self.lock:
+                self.opening[i] -= 1
+                self.failures[i] += 1
+            raise
+        with self.lock:
+            self.opening[i] -= 1
+            self.channels[i].add(channel)
+            self.totals[i] += 1
+        return channel
+
+    def is_active(self):
+        return any(t.is_active() for t in self.transports)
+
+    def load_stats(self):
+        """[{'index', 'active', 'total', 'failures', 'alive'}] per transport"""
+        with self.lock:
+            self._prune()
+            return [
+                {'index': i, 'active': len(self.channels[i]), 'total': self.totals[i],
+                 'failures': self.failures[i], 'alive': t.is_active()}
+                for i, t in enumerate(self.transports)
+            ]
+
+    def replace(self, index, transport, client=None):
+        """Swap member `index` for a new transport (after a reconnect); its counters start over"""
+        with self.lock:
+            old = self.transports[index]
+            self.transports[index] = transport
+            self.channels[index] = set()
+            stale = [c for c in self.clients if c.get_transport() is old]
+            for c in stale:
+                self.clients.remove(c)
+            if client is not None:
+                self.clients.append(client)
+        for c in stale:
+            try:
+                c.close()
+            except Exception:
+                pass
+
+    def close(self):
+        for client in self.clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+class ForwardingEngine(threading.Thread):
+    """Selector loop that relays every forwarded connection of a transport.
+
+    Where select() caps the sockets per loop, the engine starts extra loops
+    (shards sharing its worker pool and interactive state) and places new
+    connections on whichever has the most room.
+    """
+    def __init__(self, read_size=DEFAULT_READ_SIZE, open_workers=DEFAULT_OPEN_WORKERS, buffer_size=None, root=None):
+        self.root = root or self
+        super().__init__(daemon=True, name="pf-engine" if root is None else f"pf-engine-{len(root.loops)}")
+        self.read_size = max(int(read_size), MIN_READ_SIZE)
+        # Per-direction buffer of each relay; reading pauses once it is full
+        self.buffer_size = max(int(buffer_size or 2 * self.read_size), self.read_size)
+        self.selector = selectors.DefaultSelector()
+        self.max_registered = MAX_REGISTERED if root is None else root.max_registered   # None: no limit
+        self.reserved = 0       # sockets placed on this loop but not registered yet
+        self.opening = 0        # channel opens in flight, each becomes a relay
+        self.forwarders = []
+        self.relays = set()
+        self.tuning = None      # TransportTuning applied to every channel opened here
+        self.running = True
+        self.throttled = {}     # relay -> monotonic time it may read again
+        self.handshakes = set()     # SOCKS handshakes still negotiating on this loop
+        self.interactive_at = 0.0
+        self._bulk_yield = TokenBucket(DEFAULT_BULK_YIELD_RATE)
+
+        # Other threads hand work to the loop through this queue + wakeup socket
+        self._calls = deque()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, self._drain_wakeup)
+
+        if root is None:
+            self.loops = [self]
+            self._place_lock = threading.Lock()
+            # open_channel blocks for a full round trip, keep it off the loop thread
+            self._opener = ThreadPoolExecutor(max_workers=open_workers, thread_name_prefix="pf-open")
+        else:
+            self._opener = root._opener
+        self._start_lock = threading.Lock()
+
+    def call_soon(self, fn, *args):
+        self._calls.append((fn, args))
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def ensure_started(self):
+        """Start the loop thread unless it is already running (or was stopped); safe from any thread"""
+        with self._start_lock:
+            if self.running and self.ident is None:
+                self.start()
+
+    def add_forwarder(self, forwarder):
+        self.ensure_started()
+        self.call_soon(self._bind_forwarder, forwarder)
+
+    def remove_forwarder(self, forwarder):
+        self.call_soon(self._unbind_forwarder, forwarder)
+
+    def stop(self):
+        self.running = False
+        self.call_soon(lambda: None)
+
+    def place(self, n, fn, *args):
+        """Run fn(loop, *args) on the loop with the most room for n more sockets,
+        starting another loop when all are full; raises EngineFull past MAX_LOOPS"""
+        root = self.root
+        if root.max_registered is None:
+            root.call_soon(fn, root, *args)
+            return
+        with root._place_lock:
+            loop = max(root.loops, key=ForwardingEngine.free)
+            if loop.free() < n and len(root.loops) < MAX_LOOPS and root.running:
+                loop = ForwardingEngine(root.read_size, buffer_size=root.buffer_size, root=root)
+                root.loops.append(loop)
+                loop.start()
+            if loop.free() < n:
+                raise root.full_error()
+            loop.reserved += n
+
+        def run():
+            try:
+                fn(loop, *args)
+            finally:
+                with root._place_lock:
+                    loop.reserved -= n
+        loop.call_soon(run)
+
+    def discard(self, sock):
+        """Unregister and close sock on this loop's own thread"""
+        if self.is_alive() and threading.current_thread() is not self:
+            self.call_soon(self.discard, sock)
+            return
+        try:
+            self.selector.unregister(sock)
+        except Exception:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def free(self):
+        """Sockets this loop can still take"""
+        return self.max_registered - len(self.selector.get_map()) - self.reserved
+
+    def mapping_status(self):
+        """[(description, bound ports, live connections)] for every mapping on this loop"""
+        return [(f.describe(), f.bound_ports, f.live_connections) for f in list(self.forwarders)]
+
+    def stats(self):
+        """Stats snapshot of every mapping on this loop, see PortForwarder.snapshot"""
+        return [f.snapshot() for f in list(self.forwarders)]
+
+    def mark_interactive(self):
+        """Note interactive traffic (forwarded or e.g. a shell on the same transport)"""
+        self.root.interactive_at = time.monotonic()
+
+    def interactive_active(self):
+        return time.monotonic() - self.root.interactive_at < INTERACTIVE_HOLD
+
+    @property
+    def bulk_yield(self):
+        return self.root._bulk_yield
+
+    def set_bulk_yield_rate(self, rate):
+        self.root._bulk_yield = TokenBucket(rate)
+
+    def throttle(self, relay, until):
+        self.throttled[relay] = until
+
+    def submit(self, fn, callback=None):
+        """Run a blocking fn() in the worker pool, then callback(result, error) on the loop"""
+        def task():
+            try:
+                result, error = fn(), None
+            except Exception as e:
+                result, error = None, e
+            if callback is not None:
+                self.call_soon(callback, result, error)
+        try:
+            self._opener.submit(task)
+        except RuntimeError:
+            # Pool already shut down with the loop
+            if callback is not None:
+                callback(None, RuntimeError("forwarding engine stopped"))
+
+    def open_channel(self, transport, dest_addr, src_addr, callback):
+        """Open a direct-tcpip channel in the worker pool, then run callback(channel, error) on the loop"""
+        root = self.root
+        kwargs = root.tuning.channel_kwargs() if root.tuning else {}
+        with root._place_lock:
+            root.opening += 1
+
+        def done(channel, error):
+            with root._place_lock:
+                root.opening -= 1
+            callback(channel, error)
+        self.submit(lambda: transport.open_channel("direct-tcpip", dest_addr, src_addr, **kwargs), done)
+
+    def has_room(self, n=RELAY_FDS):
+        """True if n more sockets fit in the engine's loops next to the relays still being opened"""
+        root = self.root
+        if root.max_registered is None:
+            return True
+        with root._place_lock:
+            free = sum(loop.free() for loop in root.loops) - RELAY_FDS * root.opening
+            # Loops not started yet, less their wakeup socket
+            free += (MAX_LOOPS - len(root.loops)) * (root.max_registered - 1)
+        return free >= n
+
+    def full_error(self):
+        return EngineFull(f"forwarding engine is at its {MAX_LOOPS} x {self.max_registered} socket limit")
+
+    def run(self):
+        try:
+            while self.running:
+                waiting = any(r.waiting_for_window() for r in self.relays)
+                timeout = WINDOW_POLL_INTERVAL if waiting else None
+                if self.throttled:
+                    wake = max(min(self.throttled.values()) - time.monotonic(), 0.0)
+                    timeout = wake if timeout is None else min(timeout, wake)
+                if self.handshakes:
+                    expire = min(h.started for h in self.handshakes) + SOCKS_HANDSHAKE_TIMEOUT
+                    wake = max(expire - time.monotonic(), 0.0)
+                    timeout = wake if timeout is None else min(timeout, wake)
+                try:
+                    events = self.selector.select(timeout)
+                except (ValueError, OSError) as e:
+                    # Too many sockets for select() or one closed under us: drop what broke
+                    # it rather than let the loop die and take every mapping down
+                    print(f"Forwarding select error: {e}")
+                    self._recover_select()
+                    continue
+                # Interactive relays are serviced before bulk ones
+                events.sort(key=lambda event: self._event_rank(event[0].data))
+                for key, mask in events:
+                    try:
+                        key.data(mask)
+                    except Exception as e:
+                        print(f"Forwarding loop error: {e}")
+                if waiting:
+                    for relay in list(self.relays):
+                        if relay.waiting_for_window():
+                            relay.flush()
+                if self.throttled:
+                    self._wake_throttled()
+                if self.handshakes:
+                    self._expire_handshakes()
+                self._run_calls()
+        finally:
+            self._shutdown()
+
+    def _recover_select(self):
+        dropped = 0
+        for key in list(self.selector.get_map().values()):
+            try:
+                closed = key.fileobj.fileno() < 0
+            except Exception:
+                closed = True
+            if closed:
+                self._drop_registration(key, OSError(errno.EBADF, "socket closed while registered"))
+                dropped += 1
+        # Still over the limit: shed the newest connections
+        while self.max_registered is not None and len(self.selector.get_map()) > self.max_registered and self.relays:
+            max(self.relays, key=lambda r: r.started)._error(self.full_error())
+            dropped += 1
+        if not dropped:
+            time.sleep(WINDOW_POLL_INTERVAL)    # nothing to blame, don't spin
+
+    def _drop_registration(self, key, error):
+        owner = getattr(key.data, '__self__', None)
+        if isinstance(owner, Relay):
+            owner._error(error)
+        elif isinstance(owner, SocksHandshake):
+            owner.fail(error)
+        else:
+            try:
+                self.selector.unregister(key.fileobj)
+            except Exception:
+                pass
+
+    def _event_rank(self, callback):
+        relay = getattr(callback, '__self__', None)
+        return 0 if getattr(relay, 'interactive', False) else 1
+
+    def _wake_throttled(self):
+        now = time.monotonic()
+        for relay in [r for r, until in self.throttled.items() if until <= now]:
+            del self.throttled[relay]
+            relay.flush()
+
+    def _expire_handshakes(self):
+        now = time.monotonic()
+        for handshake in [h for h in self.handshakes if now - h.started >= SOCKS_HANDSHAKE_TIMEOUT]:
+            handshake.fail(SocksError(f"handshake timed out after {SOCKS_HANDSHAKE_TIMEOUT:g}s"))
+
+    def _run_calls(self):
+        while self._calls:
+            fn, args = self._calls.popleft()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Forwarding loop error: {e}")
+
+    def _drain_wakeup(self, mask):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _bind_forwarder(self, forwarder):
+        try:
+            forwarder.bind(self)
+            self.forwarders.append(forwarder)
+        except Exception as e:
+            forwarder.stats.record_error(e)
+            print(f"Port forwarding failed on {forwarder.describe()}: {e}")
+
+    def _unbind_forwarder(self, forwarder):
+        if forwarder in self.forwarders:
+            self.forwarders.remove(forwarder)
+        forwarder.unbind()
+
+    def _shutdown(self):
+        for relay in list(self.relays):
+            relay.close()
+        for handshake in list(self.handshakes):
+            handshake.fail(SocksError("forwarding engine stopped"))
+        for forwarder in list(self.forwarders):
+            forwarder.unbind()
+        if self.root is self:
+            for loop in self.loops[1:]:
+                loop.stop()
+            self._opener.shutdown(wait=False)
+        try:
+            self.selector.close()
+        except Exception:
+            pass
+        for s in (self._wakeup_r, self._wakeup_w):
+            try:
+                s.close()
+            except OSError:
+                pass
+
+
+class RelayBuffer:
+    """Preallocated byte buffer, filled at the tail and drained from the head"""
+    __slots__ = ('data', 'view', 'start', 'end')
+
+    def __init__(self, size):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def space(self):
+        return len(self.data) - len(self)
+
+    def tail(self):
+        """Writable view after the buffered bytes (compacting first if needed)"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start and len(self.data) - self.end < len(self.data) // 2:
+            self.compact()
+        return self.view[self.end:]
+
+    def compact(self):
+        n = self.end - self.start
+        self.view[:n] = self.view[self.start:self.end]
+        self.start, self.end = 0, n
+
+    def pending(self):
+        return self.view[self.start:self.end]
+
+    def produced(self, n):
+        self.end += n
+
+    def consumed(self, n):
+        self.start += n
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def write(self, data):
+        """Append data, which must fit in space()"""
+        n = len(data)
+        tail = self.tail()
+        if n > len(tail):
+            # space() counts the bytes already consumed at the head too
+            self.compact()
+            tail = self.view[self.end:]
+        tail[:n] = data
+        self.end += n
+
+
+class Relay:
+    """Moves bytes between one local socket and one SSH channel on the engine loop.
+
+    Each direction has a fixed buffer; a side is only read while the buffer
+    towards the other side has room, so a full SSH window or socket buffer
+    pushes back instead of growing memory or dropping data.
+    """
+    def __init__(self, engine, sock, channel, owner=None, open_latency=0.0, dest=None, initial=b''):
+        self.engine = engine
+        self.sock = sock
+        self.channel = channel
+        self.dest = dest
+        self.owner = owner
+        self.stats = owner.stats if owner is not None else None
+        self.bucket = owner.bucket if owner is not None else None
+        self.interactive = owner is not None and owner.priority == PRIORITY_INTERACTIVE
+        self.peer = None
+        self.started = time.monotonic()
+        self.open_latency = open_latency
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.to_channel = RelayBuffer(engine.buffer_size)   # read from sock, waiting for the channel
+        self.to_sock = RelayBuffer(engine.buffer_size)      # read from channel, waiting for sock
+        self.sock_eof = False
+        self.channel_eof = False
+        self.closed = False
+        self._sock_events = 0
+        self._channel_registered = False
+
+        sock.setblocking(False)
+        # Chunks are already coalesced by the buffers; Nagle would only add delayed-ACK stalls
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        channel.setblocking(0)
+        try:
+            self.peer = sock.getpeername()
+        except OSError:
+            pass
+        engine.relays.add(self)
+        if owner is not None:
+            owner.relays.add(self)
+            self.stats.record_open(open_latency)
+        if initial:
+            # Bytes the client sent before the channel existed (e.g. right after a SOCKS request)
+            self.to_channel.write(initial)
+            self._flush_channel()
+        self._update_interest()
+
+    def snapshot(self):
+        return {
+            'peer': self.peer,
+            'dest': self.dest,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'open_latency': self.open_latency,
+            'age': time.monotonic() - self.started,
+        }
+
+    def _read_quota(self, cap):
+        """Bytes this relay may read right now under the mapping limit and bulk yielding"""
+        buckets = []
+        if self.bucket is not None:
+            buckets.append(self.bucket)
+        if self.interactive:
+            self.engine.mark_interactive()
+        elif self.engine.interactive_active():
+            buckets.append(self.engine.bulk_yield)
+        quota = cap
+        for bucket in buckets:
+            quota = min(quota, int(bucket.available()))
+        if quota <= 0:
+            wait = max(bucket.wait_time(cap) for bucket in buckets)
+            self.engine.throttle(self, time.monotonic() + max(wait, 0.001))
+            return 0
+        return quota
+
+    def _charge(self, n):
+        if self.bucket is not None:
+            self.bucket.consume(n)
+        if not self.interactive and self.engine.interactive_active():
+            self.engine.bulk_yield.consume(n)
+
+    def _error(self, error):
+        if self.stats is not None:
+            self.stats.record_error(error)
+        self.close()
+
+    def waiting_for_window(self):
+        return len(self.to_channel) > 0 and not self.closed
+
+    def on_sock_event(self, mask):
+        if mask & selectors.EVENT_WRITE:
+            self._flush_sock()
+        if mask & selectors.EVENT_READ and not self.closed and self.to_channel.space():
+            tail = self.to_channel.tail()
+            quota = self._read_quota(min(len(tail), self.engine.read_size))
+            if not quota:
+                self._update_interest()
+                return
+            try:
+                n = self.sock.recv_into(tail, quota)
+            except (BlockingIOError, InterruptedError):
+                n = None
+            except OSError as e:
+                self._error(e)
+                return
+            if n is not None:
+                if n:
+                    self._charge(n)
+                    self.to_channel.produced(n)
+                else:
+                    self.sock_eof = True
+                self._flush_channel()
+        self._update_interest()
+
+    def on_channel_event(self, mask):
+        # paramiko has no recv_into, so cap the read at the free space instead
+        space = self.to_sock.space()
+        quota = self._read_quota(min(space, self.engine.read_size)) if space else 0
+        if not quota:
+            self._update_interest()
+            return
+        try:
+            data = self.channel.recv(quota)
+        except socket.timeout:
+            data = None
+        except OSError as e:
+            self._error(e)
+            return
+        if data is not None:
+            self._charge(len(data))
+            if not data:
+                self.channel_eof = True
+                self._flush_sock()
+            elif len(self.to_sock):
+                self.to_sock.write(data)
+                self._flush_sock()
+            else:
+                # Nothing queued: hand the chunk straight to the socket, buffer only the rest
+                sent = self._send_sock(data)
+                if sent is not None and sent < len(data):
+                    self.to_sock.write(memoryview(data)[sent:])
+        self._update_interest()
+
+    def flush(self):
+        self._flush_channel()
+        self._update_interest()
+
+    def _flush_channel(self):
+        while len(self.to_channel) and not self.closed:
+            try:
+                sent = self.channel.send(self.to_channel.pending())
+            except socket.timeout:
+                return  # SSH window is full, the loop will retry
+            except OSError as e:
+                self._error(e)
+                return
+            if sent == 0:
+                self.close()
+                return
+            self.to_channel.consumed(sent)
+            self.bytes_out += sent
+            if self.stats is not None:
+                self.stats.bytes_out += sent
+        if self.sock_eof and not len(self.to_channel) and not self.closed:
+            try:
+                self.channel.shutdown_write()
+            except Exception:
+                pass
+
+    def _send_sock(self, data):
+        try:
+            sent = self.sock.send(data)
+        except (BlockingIOError, InterruptedError):
+            return 0
+        except OSError as e:
+            self._error(e)
+            return None
+        self.bytes_in += sent
+        if self.stats is not None:
+            self.stats.bytes_in += sent
+        return sent
+
+    def _flush_sock(self):
+        while len(self.to_sock) and not self.closed:
+            sent = self._send_sock(self.to_sock.pending())
+            if not sent:
+                return
+            self.to_sock.consumed(sent)
+        if self.channel_eof and not len(self.to_sock) and not self.closed:
+            try:
+                self.sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    def _update_interest(self):
+        if self.closed:
+            return
+        if self.sock_eof and self.channel_eof and not len(self.to_sock) and not len(self.to_channel):
+            self.close()
+            return
+
+        # While throttled neither side is read; the engine calls flush() when the wait is over
+        throttled = self in self.engine.throttled
+        events = 0
+        if not self.sock_eof and self.to_channel.space() and not throttled:
+            events |= selectors.EVENT_READ
+        if len(self.to_sock):
+            events |= selectors.EVENT_WRITE
+        if events != self._sock_events:
+            if self._sock_events and events:
+                self.engine.selector.modify(self.sock, events, self.on_sock_event)
+            elif events:
+                self.engine.selector.register(self.sock, events, self.on_sock_event)
+            else:
+                self.engine.selector.unregister(self.sock)
+            self._sock_events = events
+
+        want_channel = not self.channel_eof and self.to_sock.space() > 0 and not throttled
+        if want_channel != self._channel_registered:
+            if want_channel:
+                self.engine.selector.register(self.channel, selectors.EVENT_READ, self.on_channel_event)
+            else:
+                self.engine.selector.unregister(self.channel)
+            self._channel_registered = want_channel
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.engine.relays.discard(self)
+        self.engine.throttled.pop(self, None)
+        if self.owner is not None:
+            self.owner.relays.discard(self)
+            self.stats.record_close(time.monotonic() - self.started)
+        for obj, registered in ((self.sock, self._sock_events), (self.channel, self._channel_registered)):
+            if registered:
+                try:
+                    self.engine.selector.unregister(obj)
+                except Exception:
+                    pass
+        try:
+            self.channel.close()
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class PortForwarder:
+    """localhost:local_port -> remote_host:remote_port over a ForwardingEngine"""
+    def __init__(self, local_port, remote_host, remote_port, transport, engine=None,
+                 rate_limit=0, priority=PRIORITY_BULK):
+        self.local_port = local_port
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.transport = transport
+        self.engine = engine
+        self.server_socket = None
+        self.listeners = {}     # listening socket -> (local_port, remote_port)
+        self.listener_loops = {}    # listening socket -> engine loop it is registered on
+        self.relays = set()
+        self.stats = ForwardStats()
+        self.priority = priority
+        self.bucket = None
+        self.set_rate_limit(rate_limit)
+        self.running = False
+
+    def set_rate_limit(self, rate):
+        """Cap both directions of this mapping together at `rate` bytes/s (0 = unlimited)"""
+        self.rate_limit = rate
+        self.bucket = TokenBucket(rate) if rate else None
+        for relay in list(self.relays):
+            relay.bucket = self.bucket
+
+    def port_map(self):
+        return {self.local_port: self.remote_port}
+
+    @property
+    def bound_ports(self):
+        return len(self.listeners)
+
+    @property
+    def live_connections(self):
+        return len(self.relays)
+
+    def snapshot(self):
+        """Mapping counters plus one entry per live connection"""
+        snap = self.stats.snapshot()
+        snap['mapping'] = self.describe()
+        snap['bound_ports'] = self.bound_ports
+        snap['rate_limit'] = self.rate_limit
+        snap['priority'] = self.priority
+        snap['connections'] = [r.snapshot() for r in list(self.relays)]
+        return snap
+
+    def start(self):
+        if self.engine is None:
+            self.engine = ForwardingEngine()
+        self.running = True
+        self.engine.add_forwarder(self)
+
+    def stop(self):
+        self.running = False
+        if self.engine:
+            self.engine.remove_forwarder(self)
+
+    def bind(self, engine):
+        error = None
+        for local_port, remote_port in self.port_map().items():
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                s.bind(('localhost', local_port))
+                s.listen(socket.SOMAXCONN)
+                s.setblocking(False)
+            except OSError as e:
+                print(f"Port forwarding failed on {local_port}: {e}")
+                self.stats.record_error(e)
+                s.close()
+                error = e
+                continue
+            self.listeners[s] = (local_port, remote_port)
+            try:
+                # Large ranges fill one select() loop after another
+                engine.place(1, self.listen, s)
+            except EngineFull as e:
+                # Every loop is full, the rest of the range would fail the same way
+                print(f"Port forwarding failed from {local_port} on: {e}")
+                self.stats.record_error(e)
+                del self.listeners[s]
+                s.close()
+                error = e
+                break
+        if not self.listeners:
+            raise error
+        self.server_socket = next(iter(self.listeners))
+        print(f"Forwarding {self.describe()} ({self.bound_ports} port(s) bound)")
+
+    def listen(self, loop, s):
+        if s in self.listeners:     # not unbound in the meantime
+            loop.selector.register(s, selectors.EVENT_READ, lambda mask: self.on_accept(s, mask))
+            self.listener_loops[s] = loop
+
+    def unbind(self):
+        self.running = False
+        for s in list(self.listeners):
+            del self.listeners[s]
+            loop = self.listener_loops.pop(s, None)
+            if loop is not None:
+                loop.discard(s)
+            else:
+                try:
+                    s.close()
+                except OSError:
+                    pass
+        self.server_socket = None
+
+    def swap_transport(self, transport):
+        """Carry on over a new transport after a reconnect. Local listeners stay
+        bound; connections that lived on the old transport die with it."""
+        self.transport = transport
+
+    def describe(self):
+        return f"localhost:{self.local_port} -> {self.remote_host}:{self.remote_port}"
+
+    def on_accept(self, server_socket, mask):
+        ports = self.listeners.get(server_socket)
+        if ports is None:
+            return
+        _, remote_port = ports
+        while self.running:
+            try:
+                client_socket, addr = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"Accept failed on {self.describe()}: {e}")
+                self.stats.record_error(e)
+                return
+            if not self.engine.has_room():
+                self.reject(client_socket, self.engine.full_error())
+                continue
+            self.handle_client(client_socket, addr, (self.remote_host, remote_port))
+
+    def reject(self, client_socket, error):
+        print(f"Connection refused on {self.describe()}: {error}")
+        self.stats.record_error(error)
+        try:
+            client_socket.close()
+        except OSError:
+            pass
+
+    def handle_client(self, client_socket, addr, dest, initial=b''):
+        # The channel is only opened once a client actually connects
+        self.engine.open_channel(
+            self.transport,
+            dest,
+            addr,
+            lambda channel, error, t=time.monotonic():
+                self.on_channel(client_socket, dest, channel, error, time.monotonic() - t, initial),
+        )
+
+    def on_channel(self, client_socket, dest, channel, error, latency=0.0, initial=b''):
+        if channel is None or not self.engine.running:
+            if error:
+                print(f"Channel open failed for {dest[0]}:{dest[1]}: {error}")
+                self.stats.record_error(error)
+            try:
+                client_socket.close()
+            except OSError:
+                pass
+            if channel is not None:
+                channel.close()
+            return
+        try:
+            self.engine.place(RELAY_FDS, Relay, client_socket, channel, self, latency, dest, initial)
+        except EngineFull as e:
+            channel.close()
+            self.reject(client_socket, e)
+
+
+class PortRangeForwarder(PortForwarder):
+    """localhost:local_start-local_end -> remote_host, all listeners owned by one engine.
+
+    A remote range of the same length maps port by port; a single remote port
+    receives every local port of the range.
+    """
+    def __init__(self, local_start, local_end, remote_host, remote_start, remote_end, transport, engine=None,
+                 rate_limit=0, priority=PRIORITY_BULK):
+        super().__init__(local_start, remote_host, remote_start, transport, engine, rate_limit, priority)
+        self.local_end = local_end
+        self.remote_end = remote_end
+
+    def port_map(self):
+        fan_in = self.remote_end == self.remote_port
+        return {
+            self.local_port + i: self.remote_port + (0 if fan_in else i)
+            for i in range(self.local_end - self.local_port + 1)
+        }
+
+    def describe(self):
+        remote = str(self.remote_port)
+        if self.remote_end != self.remote_port:
+            remote += f"-{self.remote_end}"
+        return f"localhost:{self.local_port}-{self.local_end} -> {self.remote_host}:{remote}"
+
+
+class RemoteDispatch:
+    """The forwarded-tcpip handler of one transport, routing channels by the (address, port) they came in on.
+
+    paramiko keeps a single handler per transport: every request_port_forward
+    replaces it and cancel_port_forward clears it. So all RemoteForwarders on a
+    transport register here, and only the last cancel goes through paramiko.
+    """
+    _lock = threading.Lock()
+    _dispatchers = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def of(cls, transport):
+        with cls._lock:
+            dispatch = cls._dispatchers.get(transport)
+            if dispatch is None:
+                dispatch = cls._dispatchers[transport] = cls(transport)
+            return dispatch
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.routes = {}                        # (address, port) -> RemoteForwarder
+        self.lock = threading.Lock()            # routes; taken on the transport thread, never held over I/O
+        self.requests = threading.Lock()        # one global request at a time, so the handler is never dropped early
+
+    def __call__(self, channel, origin, server):
+        # Called on the transport thread
+        address, port = server
+        with self.lock:
+            forwarder = self.routes.get((address, port))
+            if forwarder is None:
+                # The server may spell the address differently (localhost vs 127.0.0.1)
+                forwarder = next((f for (a, p), f in self.routes.items() if p == port), None)
+        if forwarder is None:
+            channel.close()
+            return
+        forwarder.on_remote_channel(channel, origin, server)
+
+    def forward(self, forwarder, address, port):
+        """Blocking: have the server listen on address:port for forwarder; returns the port it got"""
+        with self.requests:
+            if port:
+                # Registered first: a connection can arrive before the reply does
+                with self.lock:
+                    self.routes[(address, port)] = forwarder
+            try:
+                bound = self.transport.request_port_forward(address, port, self)
+            except Exception:
+                with self.lock:
+                    if self.routes.get((address, port)) is forwarder:
+                        del self.routes[(address, port)]
+                raise
+            with self.lock:
+                self.routes[(address, bound)] = forwarder
+            return bound
+
+    def cancel(self, address, port):
+        with self.requests:
+            with self.lock:
+                self.routes.pop((address, port), None)
+                last = not self.routes
+            if last:
+                self.transport.cancel_port_forward(address, port)
+            elif self.transport.is_active():
+                # Leaves paramiko's handler (us) in place for the other forwards
+                self.transport.global_request("cancel-tcpip-forward", (address, port), wait=True)
+
+
+class RemoteForwarder(PortForwarder):
+    """Reverse forward like ssh -R: server bind_address:remote_port -> local_host:local_port.
+
+    The server opens a forwarded-tcpip channel per incoming connection; each one
+    is connected to the local service and relayed on the engine loop, so no
+    thread is started per channel.
+    """
+    def __init__(self, remote_port, local_host, local_port, transport, engine=None,
+                 rate_limit=0, priority=PRIORITY_BULK, bind_address="localhost"):
+        super().__init__(local_port, bind_address, remote_port, transport, engine, rate_limit, priority)
+        self.local_host = local_host
+        self.bind_address = bind_address
+        self.forwarding = False
+        self.binding = False
+
+    @property
+    def bound_ports(self):
+        return 1 if self.forwarding else 0
+
+    def port_map(self):
+        return {self.remote_port: self.local_port}
+
+    def describe(self):
+        return f"remote {self.bind_address}:{self.remote_port} -> {self.local_host}:{self.local_port}"
+
+    @property
+    def needs_rebind(self):
+        """Running but not forwarding, e.g. the server still held the port right after a reconnect"""
+        return self.running and not self.forwarding and not self.binding
+
+    def bind(self, engine):
+        # tcpip-forward is a blocking global request, keep it off the loop
+        self.binding = True
+        dispatch = RemoteDispatch.of(self.transport)
+        engine.submit(lambda: dispatch.forward(self, self.bind_address, self.remote_port), self.on_forward_ready)
+
+    def on_forward_ready(self, port, error):
+        self.binding = False
+        if error is not None:
+            print(f"Remote forwarding failed on {self.describe()}: {error}")
+            self.stats.record_error(error)
+            return
+        if not self.running:
+            dispatch = RemoteDispatch.of(self.transport)
+            self.engine.submit(lambda: dispatch.cancel(self.bind_address, port))
+            return
+        # Port 0 asks the server to pick one
+        self.remote_port = port
+        self.forwarding = True
+        print(f"Forwarding {self.describe()}")
+
+    def unbind(self):
+        self.running = False
+        if self.forwarding:
+            self.forwarding = False
+            address, port, dispatch = self.bind_address, self.remote_port, RemoteDispatch.of(self.transport)
+            self.engine.submit(lambda: dispatch.cancel(address, port))
+
+    def swap_transport(self, transport):
+        # The server dropped our tcpip-forward along with the old connection, ask again
+        self.transport = transport
+        self.forwarding = False
+        if self.running and self.engine:
+            self.bind(self.engine)
+
+    def on_remote_channel(self, channel, origin, server):
+        # Called on the transport thread by this transport's RemoteDispatch, for our (address, port)
+        try:
+            self.engine.place(RELAY_FDS, self.connect_local, channel, time.monotonic())
+        except EngineFull as e:
+            print(f"Connection refused on {self.describe()}: {e}")
+            self.stats.record_error(e)
+            channel.close()
+
+    def connect_local(self, loop, channel, started):
+        if not self.running or not loop.running:
+            channel.close()
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        err = sock.connect_ex((self.local_host, self.local_port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self.local_failed(sock, channel, OSError(err, os.strerror(err)))
+            return
+        loop.selector.register(sock, selectors.EVENT_WRITE,
+                               lambda mask: self.on_local_connected(loop, sock, channel, started))
+
+    def on_local_connected(self, loop, sock, channel, started):
+        loop.selector.unregister(sock)
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self.local_failed(sock, channel, OSError(err, os.strerror(err)))
+            return
+        Relay(loop, sock, channel, self, time.monotonic() - started, (self.local_host, self.local_port))
+
+    def local_failed(self, sock, channel, error):
+        print(f"Local connect failed for {self.describe()}: {error}")
+        self.stats.record_error(error)
+        sock.close()
+        channel.close()
+
+
+class SocksError(Exception):
+    pass
+
+
+class SocksHandshake:
+    """Non-blocking SOCKS5 CONNECT negotiation for one client, run on one of the engine's loops"""
+    def __init__(self, engine, forwarder, sock, addr):
+        self.forwarder = forwarder
+        self.engine = engine
+        self.sock = sock
+        self.addr = addr
+        self.buffer = b''
+        self.greeted = False
+        self.started = time.monotonic()     # the loop fails us SOCKS_HANDSHAKE_TIMEOUT after this
+        sock.setblocking(False)
+        self.engine.selector.register(sock, selectors.EVENT_READ, self.on_read)
+        self.engine.handshakes.add(self)
+
+    def on_read(self, mask):
+        try:
+            data = self.sock.recv(1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.fail(e)
+            return
+        if not data:
+            self.fail(SocksError("client closed during handshake"))
+            return
+        self.buffer += data
+        try:
+            self.advance()
+        except (SocksError, EngineFull) as e:
+            self.fail(e)
+
+    def advance(self):
+        if not self.greeted:
+            # VER NMETHODS METHODS...
+            if len(self.buffer) < 2:
+                return
+            if self.buffer[0] != 5:
+                raise SocksError(f"unsupported SOCKS version {self.buffer[0]}")
+            n = self.buffer[1]
+            if len(self.buffer) < 2 + n:
+                return
+            if 0 not in self.buffer[2:2 + n]:
+                self.sock.send(b'\x05\xff')
+                raise SocksError("client requires authentication")
+            self.buffer = self.buffer[2 + n:]
+            self.greeted = True
+            self.sock.send(b'\x05\x00')
+
+        # VER CMD RSV ATYP DST.ADDR DST.PORT
+        if len(self.buffer) < 5:
+            return
+        ver, cmd, _, atyp = self.buffer[:4]
+        if atyp == 1:
+            end = 4 + 4
+            host = lambda: str(ipaddress.IPv4Address(self.buffer[4:8]))
+        elif atyp == 3:
+            end = 5 + self.buffer[4]
+            host = lambda: self.buffer[5:end].decode('idna')
+        elif atyp == 4:
+            end = 4 + 16
+            host = lambda: str(ipaddress.IPv6Address(self.buffer[4:20]))
+        else:
+            self.reply(8)
+            raise SocksError(f"unsupported address type {atyp}")
+        if len(self.buffer) < end + 2:
+            return
+        if ver != 5 or cmd != 1:
+            self.reply(7)
+            raise SocksError(f"unsupported SOCKS command {cmd}")
+        try:
+            dest = (host(), struct.unpack('>H', self.buffer[end:end + 2])[0])
+        except ValueError as e:
+            # Malformed domain name (UnicodeError is a ValueError)
+            self.reply(1)
+            raise SocksError(f"bad destination address: {e}")
+        initial = self.buffer[end + 2:]
+
+        self.engine.selector.unregister(self.sock)
+        self.engine.handshakes.discard(self)
+        if not self.engine.has_room():
+            self.reply(1)
+            raise self.engine.full_error()
+        self.forwarder.handle_client(self.sock, self.addr, dest, initial)
+
+    def reply(self, code):
+        # Bound address is not meaningful for a tunnelled connection
+        try:
+            self.sock.send(bytes([5, code, 0, 1, 0, 0, 0, 0, 0, 0]))
+        except OSError:
+            pass
+
+    def fail(self, error):
+        self.engine.handshakes.discard(self)
+        self.forwarder.stats.record_error(error)
+        try:
+            self.engine.selector.unregister(self.sock)
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class SocksForwarder(PortForwarder):
+    """Dynamic forwarding like ssh -D: a local SOCKS5 listener, one direct-tcpip channel per CONNECT"""
+    def __init__(self, local_port, transport, engine=None, rate_limit=0, priority=PRIORITY_BULK):
+        super().__init__(local_port, None, None, transport, engine, rate_limit, priority)
+
+    def describe(self):
+        return f"SOCKS5 localhost:{self.local_port}"
+
+    def handle_client(self, client_socket, addr, dest, initial=b''):
+        if dest[0] is None:
+            try:
+                self.engine.place(1, SocksHandshake, self, client_socket, addr)
+            except EngineFull as e:
+                self.reject(client_socket, e)
+        else:
+            super().handle_client(client_socket, addr, dest, initial)
+
+    def on_channel(self, client_socket, dest, channel, error, latency=0.0, initial=b''):
+        if channel is not None and self.engine.running:
+            try:
+                client_socket.send(bytes([5, 0, 0, 1, 0, 0, 0, 0, 0, 0]))
+            except OSError as e:
+                self.stats.record_error(e)
+                channel.close()
+                channel = None
+        elif channel is None:
+            # 0x05 = connection refused, covers the usual open_channel failures
+            try:
+                client_socket.send(bytes([5, 5, 0, 1, 0, 0, 0, 0, 0, 0]))
+            except OSError:
+                pass
+        super().on_channel(client_socket, dest, channel, error, latency, initial)
@@ -5,92 +5,66 @@ import threading
 import socket
 import sys
 import re
-import select
 import time
 import os
 import stat
 import subprocess
 import sys
+import queue
 from datetime import datetime
 from tkinter import filedialog
+from forwarding import (ForwardingEngine, PortForwarder, PortRangeForwarder, RemoteForwarder, SocksForwarder,
+                        TransportGroup,
+                        PRIORITY_BULK, PRIORITY_INTERACTIVE, percentile)
+from transport_tuning import TransportTuning, set_nodelay
+from mux import ControlMaster
+from terminal import TerminalWindow
+from connection_pool import PoolExhausted, shared_pool
+from reconnect import ReconnectSupervisor, RECONNECTING, STOPPED
+import fleet
+import batch_exec
+from ssh_profiles import DEFAULT_PROFILE, PROFILES, get_profile, negotiated
+from fleet import shared_fleet
+from jump import format_hops, format_jump, hop_latencies, parse_jump
+
+# Terminals are Toplevels in this process with a shell on the existing connection.
+# SSH_SIMPLE_TERMINAL=process brings back one terminal.py process per window
+# (attached through the mux, isolated from the GUI).
+TERMINAL_PROCESS = os.environ.get("SSH_SIMPLE_TERMINAL") == "process"
 
 
-
-class PortForwarder(threading.Thread):
-    def __init__(self, local_port, remote_host, remote_port, transport):
-        super().__init__(daemon=True)
-        self.local_port = local_port
-        self.remote_host = remote_host
-        self.remote_port = remote_port
-        self.transport = transport
-        self.server_socket = None
-        self.running = True
-
-    def run(self):
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind(('localhost', self.local_port))
-            self.server_socket.listen(5)
-            print(f"Forwarding localhost:{self.local_port} -> {self.remote_host}:{self.remote_port}")
-            
-            while self.running:
-                client_socket, addr = self.server_socket.accept()
-                if not self.running:
-                    break
-                threading.Thread(target=self.handle_connection, args=(client_socket,), daemon=True).start()
-        except Exception as e:
-            print(f"Port forwarding failed on {self.local_port}: {e}")
-
-    def handle_connection(self, client_socket):
-        try:
-            channel = self.transport.open_channel(
-                "direct-tcpip",
-                (self.remote_host, self.remote_port),
-                client_socket.getpeername()
-            )
-            if channel is None:
-                client_socket.close()
-                return
-
-            while True:
-                r, w, x = select.select([client_socket, channel], [], [])
-                if client_socket in r:
-                    data = client_socket.recv(1024)
-                    if len(data) == 0: break
-                    channel.send(data)
-                if channel in r:
-                    data = channel.recv(1024)
-                    if len(data) == 0: break
-                    client_socket.send(data)
-            
-            channel.close()
-            client_socket.close()
-        except Exception as e:
-            try:
-                client_socket.close()
-            except:
-                pass
-
 class PortMappingRow(ttk.Frame):
+    # 本地 = fixed local forward (-L), SOCKS5 = dynamic forward (-D, remote fields unused),
+    # 远程 = reverse forward (-R): server 远程IP:远程端口 -> localhost:本地
+    MODES = ("本地", "SOCKS5", "远程")
+
     def __init__(self, parent, app, index):
         super().__init__(parent)
         self.app = app
         self.index = index
         
         # Widgets
+        self.mode = ttk.Combobox(self, values=self.MODES, width=7, state="readonly")
+        self.mode.current(0)
         self.local_port = self.app.create_themed_entry(self, width=10)
         self.remote_host = self.app.create_themed_entry(self, width=15)
         self.remote_port = self.app.create_themed_entry(self, width=10)
+        self.rate_limit = self.app.create_themed_entry(self, width=6)
+        self.interactive = tk.BooleanVar(value=False)
+        self.interactive_chk = ttk.Checkbutton(self, text="交互", variable=self.interactive)
         self.remove_btn = ttk.Button(self, text="-", width=3, command=self.remove)
         
         # Layout
+        self.mode.pack(side=tk.LEFT, padx=2)
         ttk.Label(self, text="本地:").pack(side=tk.LEFT, padx=2)
         self.local_port.pack(side=tk.LEFT, padx=2)
         ttk.Label(self, text="远程IP:").pack(side=tk.LEFT, padx=2)
         self.remote_host.pack(side=tk.LEFT, padx=2)
         ttk.Label(self, text="远程端口:").pack(side=tk.LEFT, padx=2)
         self.remote_port.pack(side=tk.LEFT, padx=2)
+        ttk.Label(self, text="限速KB/s:").pack(side=tk.LEFT, padx=2)
+        self.rate_limit.pack(side=tk.LEFT, padx=2)
+        self.interactive_chk.pack(side=tk.LEFT, padx=2)
         self.remove_btn.pack(side=tk.LEFT, padx=5)
         
         self.pack(fill=tk.X, pady=2)
@@ -117,7 +91,7 @@ class SSHGui:
     def __init__(self, root):
         self.root = root
         self.root.title("SSH Simple GUI - by 高粱NexT")
-        self.root.geometry("500x700")
+        self.root.geometry("680x800")
         self.root.resizable(True, True)
         
         # Fade In Effect
@@ -141,6 +115,7 @@ class SSHGui:
             }
         }
         
+        self.pool = shared_pool()
         self.themed_entries = []
         self.mapping_rows = []
         self.hover_buttons = []
@@ -189,6 +164,49 @@ class SSHGui:
         self.pass_entry = self.create_themed_entry(self.info_frame, show="*")
         self.pass_entry.grid(row=3, column=1, padx=5, pady=5)
 
+        # Transport tuning: blank = derive from measured RTT
+        ttk.Label(self.info_frame, text="目标带宽 Mbps:", font=("Segoe UI", 9)).grid(row=4, column=0, sticky=tk.W)
+        self.bw_entry = self.create_themed_entry(self.info_frame)
+        self.bw_entry.insert(0, "100")
+        self.bw_entry.grid(row=4, column=1, padx=5, pady=5)
+
+        ttk.Label(self.info_frame, text="窗口/包 KB:", font=("Segoe UI", 9)).grid(row=5, column=0, sticky=tk.W)
+        tuning_frame = ttk.Frame(self.info_frame)
+        tuning_frame.grid(row=5, column=1, padx=5, pady=5, sticky=tk.W)
+        self.window_entry = self.create_themed_entry(tuning_frame, width=11)
+        self.window_entry.pack(side=tk.LEFT)
+        self.packet_entry = self.create_themed_entry(tuning_frame, width=11)
+        self.packet_entry.pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(self.info_frame, text="(留空自动)", font=("Segoe UI", 8)).grid(row=5, column=2, sticky=tk.W)
+
+        # Striping: forwarded connections spread over N transports to the same host
+        ttk.Label(self.info_frame, text="并行传输:", font=("Segoe UI", 9)).grid(row=6, column=0, sticky=tk.W)
+        stripe_frame = ttk.Frame(self.info_frame)
+        stripe_frame.grid(row=6, column=1, padx=5, pady=5, sticky=tk.W)
+        self.transports_entry = self.create_themed_entry(stripe_frame, width=5)
+        self.transports_entry.insert(0, "1")
+        self.transports_entry.pack(side=tk.LEFT)
+        self.stripe_strategies = {"最少负载": TransportGroup.LEAST_LOADED, "轮询": TransportGroup.ROUND_ROBIN}
+        self.stripe_combo = ttk.Combobox(stripe_frame, values=list(self.stripe_strategies), width=8, state="readonly")
+        self.stripe_combo.current(0)
+        self.stripe_combo.pack(side=tk.LEFT, padx=(5, 0))
+
+        # Algorithm/compression profile, see ssh_profiles.PROFILES
+        ttk.Label(self.info_frame, text="连接配置:", font=("Segoe UI", 9)).grid(row=7, column=0, sticky=tk.W)
+        self.profile_combo = ttk.Combobox(self.info_frame, values=list(PROFILES), width=22, state="readonly")
+        self.profile_combo.current(0)
+        self.profile_combo.grid(row=7, column=1, padx=5, pady=5, sticky=tk.W)
+        self.profile_desc = ttk.Label(self.info_frame, text=PROFILES[DEFAULT_PROFILE].describe(), font=("Segoe UI", 8))
+        self.profile_desc.grid(row=7, column=2, sticky=tk.W)
+        self.profile_combo.bind("<<ComboboxSelected>>",
+                                lambda e: self.profile_desc.config(text=get_profile(self.profile_combo.get()).describe()))
+
+        # ProxyJump: bastions in front of the host (and of fleet hosts), outermost first
+        ttk.Label(self.info_frame, text="跳板机:", font=("Segoe UI", 9)).grid(row=8, column=0, sticky=tk.W)
+        self.jump_entry = self.create_themed_entry(self.info_frame)
+        self.jump_entry.grid(row=8, column=1, padx=5, pady=5)
+        ttk.Label(self.info_frame, text="用户@主机:端口, 多级用逗号", font=("Segoe UI", 8)).grid(row=8, column=2, sticky=tk.W)
+
         # --- Port Forwarding (Collapsible) ---
         self.pf_toggle_btn = self.create_hover_button(self.main_frame, text="▼ 端口映射 (可选)", command=self.toggle_pf_section, relief='flat', anchor='w')
         self.pf_toggle_btn.pack(fill=tk.X, pady=(5, 0))
@@ -225,9 +243,29 @@ class SSHGui:
         self.canvas.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(side="right", fill="y")
 
+        # Live per-mapping stats (filled once a session is forwarding)
+        self.pf_stats_frame = ttk.LabelFrame(self.pf_container, text="映射状态", padding="5")
+        self.pf_stats_frame.pack(fill=tk.X, pady=(5, 0))
+        stats_columns = ("mapping", "ports", "conns", "down", "up", "open", "life", "errors")
+        self.pf_stats_tree = ttk.Treeview(self.pf_stats_frame, columns=stats_columns, show="headings", height=4)
+        for col, text, width in [
+            ("mapping", "映射", 160), ("ports", "端口", 45), ("conns", "连接", 55),
+            ("down", "下行", 70), ("up", "上行", 70), ("open", "建立", 50),
+            ("life", "时长 p50/p99", 85), ("errors", "错误", 80)
+        ]:
+            self.pf_stats_tree.heading(col, text=text)
+            self.pf_stats_tree.column(col, width=width, stretch=(col == "mapping"))
+        self.pf_stats_tree.pack(fill=tk.X)
+        self.engine = None
+        self.transport_group = None
+        self.pf_last_bytes = {}
+        self.pf_stats_job = None
+
         # --- Connect Button ---
         self.connect_btn = self.create_hover_button(self.main_frame, text="连接 SSH", command=self.connect)
         self.connect_btn.pack(pady=10, fill=tk.X)
+        self.fleet_btn = self.create_hover_button(self.main_frame, text="批量连接 (主机列表)", command=self.open_fleet)
+        self.fleet_btn.pack(pady=(0, 10), fill=tk.X)
 
         # Footer
         footer_label = ttk.Label(self.main_frame, text="by 高粱NexT", font=("Segoe UI", 8), foreground="gray")
@@ -235,6 +273,26 @@ class SSHGui:
 
         self.apply_theme()
 
+    def open_fleet(self):
+        # Form values are the defaults for host lines that leave them out
+        port = self.port_entry.get().strip() or "22"
+        if not self.validate_port(port):
+            messagebox.showerror("错误", "无效的 SSH 端口")
+            return
+        t = self.themes["dark"] if self.is_dark else self.themes["light"]
+        try:
+            jump = self.parse_jump_entry()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
+        FleetWindow(self.root, t, self.user_entry.get().strip() or "root", int(port), self.pass_entry.get().strip(),
+                    get_profile(self.profile_combo.get()), jump)
+
+    def parse_jump_entry(self):
+        # Bastions default to the form's user/password on port 22
+        return parse_jump(self.jump_entry.get().strip(), self.user_entry.get().strip() or "root", 22,
+                          self.pass_entry.get().strip())
+
     def fade_in(self):
         alpha = self.root.attributes("-alpha")
         if alpha < 1.0:
@@ -296,6 +354,48 @@ class SSHGui:
             except:
                 pass
 
+    def format_rate(self, bps):
+        if bps >= 1024 * 1024:
+            return f"{bps / 1024 / 1024:.1f} MB/s"
+        if bps >= 1024:
+            return f"{bps / 1024:.1f} KB/s"
+        return f"{bps:.0f} B/s"
+
+    def refresh_pf_stats(self):
+        engine = self.engine
+        if engine is None or not engine.running:
+            return
+        now = time.time()
+        self.pf_stats_tree.delete(*self.pf_stats_tree.get_children())
+        for snap in engine.stats():
+            key = snap['mapping']
+            last_in, last_out, last_t = self.pf_last_bytes.get(key, (snap['bytes_in'], snap['bytes_out'], now))
+            dt = max(now - last_t, 1e-6)
+            down = (snap['bytes_in'] - last_in) / dt if now > last_t else 0
+            up = (snap['bytes_out'] - last_out) / dt if now > last_t else 0
+            self.pf_last_bytes[key] = (snap['bytes_in'], snap['bytes_out'], now)
+            errors = ", ".join(f"{name}:{n}" for name, n in snap['errors'].items()) or "-"
+            self.pf_stats_tree.insert("", "end", values=(
+                key,
+                snap['bound_ports'],
+                f"{snap['active']}/{snap['total']}",
+                self.format_rate(down),
+                self.format_rate(up),
+                f"{snap['open_latency_avg'] * 1000:.0f}ms",
+                f"{snap['lifetime_p50']:.1f}/{snap['lifetime_p99']:.1f}s",
+                errors
+            ))
+        if self.transport_group:
+            for load in self.transport_group.load_stats():
+                self.pf_stats_tree.insert("", "end", values=(
+                    f"传输 #{load['index'] + 1}" + ("" if load['alive'] else " (断开)"),
+                    "-",
+                    f"{load['active']}/{load['total']}",
+                    "-", "-", "-", "-",
+                    f"open:{load['failures']}" if load['failures'] else "-"
+                ))
+        self.pf_stats_job = self.root.after(1000, self.refresh_pf_stats)
+
     def add_mapping_row(self):
         row = PortMappingRow(self.scrollable_frame, self, len(self.mapping_rows))
         self.mapping_rows.append(row)
@@ -341,7 +441,13 @@ class SSHGui:
         user = self.user_entry.get().strip()
         password = self.pass_entry.get().strip()
 
-        if not self.validate_ip(ip):
+        try:
+            jump = self.parse_jump_entry()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
+        # Behind a bastion the target is resolved there, so internal host names are fine
+        if not self.validate_ip(ip) and not (jump and ip):
             messagebox.showerror("错误", "无效的 IP 地址")
             return
         if not self.validate_port(port):
@@ -349,14 +455,60 @@ class SSHGui:
             return
         if not user: user = "root"
 
+        tuning_values = []
+        for entry in (self.bw_entry, self.window_entry, self.packet_entry):
+            value = entry.get().strip()
+            if value and not value.isdigit():
+                messagebox.showerror("错误", "无效的传输调优参数")
+                return
+            tuning_values.append(int(value) if value else None)
+        bw, window_kb, packet_kb = tuning_values
+        tuning = TransportTuning(bw, window_kb * 1024 if window_kb else None,
+                                 packet_kb * 1024 if packet_kb else None)
+
+        n_transports = self.transports_entry.get().strip() or "1"
+        # Every transport is a pooled connection to the host, the pool caps how many there may be
+        max_transports = self.pool.max_per_host
+        if not n_transports.isdigit() or not 1 <= int(n_transports) <= max_transports:
+            messagebox.showerror("错误", f"并行传输数应为 1-{max_transports}")
+            return
+        stripe = (int(n_transports), self.stripe_strategies[self.stripe_combo.get()])
+
         # Collect Port Forwarding Configs
         pf_configs = []
         for row in self.mapping_rows:
             l_port = row.local_port.get().strip()
             r_host = row.remote_host.get().strip()
             r_port = row.remote_port.get().strip()
+            mode = row.mode.get()
             
             if not l_port and not r_port: continue # Skip empty rows
+
+            rate = row.rate_limit.get().strip()
+            if rate and not rate.isdigit():
+                messagebox.showerror("错误", "无效的限速值")
+                return
+            rate_limit = int(rate) * 1024 if rate else 0
+            priority = PRIORITY_INTERACTIVE if row.interactive.get() else PRIORITY_BULK
+
+            if mode == "SOCKS5":
+                if not l_port.isdigit() or not self.validate_port(l_port):
+                    messagebox.showerror("错误", "SOCKS5 需要单个本地端口")
+                    return
+                pf_configs.append({'mode': 'socks', 'local': (int(l_port), int(l_port)),
+                                   'rate_limit': rate_limit, 'priority': priority})
+                continue
+
+            if mode == "远程":
+                if not l_port.isdigit() or not r_port.isdigit() or not self.validate_port(l_port) \
+                        or not self.validate_port(r_port):
+                    messagebox.showerror("错误", "远程映射需要单个本地端口和远程端口")
+                    return
+                pf_configs.append({'mode': 'remote', 'local': (int(l_port), int(l_port)),
+                                   'remote_host': r_host or "localhost",
+                                   'remote_port': (int(r_port), int(r_port)),
+                                   'rate_limit': rate_limit, 'priority': priority})
+                continue
             
             if not self.validate_port(l_port) or not self.validate_port(r_port):
                 messagebox.showerror("错误", "无效的端口映射配置")
@@ -377,26 +529,72 @@ class SSHGui:
                  messagebox.showerror("错误", "端口范围长度不匹配")
                  return
 
-            items = l_count if l_is_range else r_count
-            for i in range(items):
-                pf_configs.append({
-                    'local': l_start + (i if l_is_range else 0),
-                    'remote_host': r_host,
-                    'remote_port': r_start + (i if r_is_range else 0)
-                })
+            # Ranges stay one mapping; its listeners are expanded by the forwarding engine
+            pf_configs.append({
+                'mode': 'local',
+                'local': (l_start, l_end),
+                'remote_host': r_host,
+                'remote_port': (r_start, r_end),
+                'rate_limit': rate_limit,
+                'priority': priority
+            })
 
         # Start Connection Thread
-        threading.Thread(target=self.start_ssh_session, args=(ip, int(port), user, password, pf_configs), daemon=True).start()
+        profile = get_profile(self.profile_combo.get())
+        threading.Thread(target=self.start_ssh_session, args=(ip, int(port), user, password, pf_configs, tuning, stripe, profile, jump), daemon=True).start()
 
-    def start_ssh_session(self, ip, port, user, password, pf_configs):
+    def start_ssh_session(self, ip, port, user, password, pf_configs, tuning=None, stripe=(1, TransportGroup.LEAST_LOADED),
+                          profile=None, jump=None):
         try:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            client.connect(ip, port=port, username=user, password=password)
+            # A warm connection to the same host/user is reused instead of logging in again
+            client = self.pool.lease(ip, port, user, password, profile=profile, jump=jump)
+            if jump:
+                print(f"Via {format_jump(jump)}: {format_hops(hop_latencies(client))}")
             
             transport = client.get_transport()
+            tuning = (tuning or TransportTuning()).calibrate(transport)
+            print(f"Transport tuning: {tuning.describe()}")
+            print(f"Negotiated: {negotiated(transport)}")
+
+            # Extra transports only carry forwarded connections; shells/SFTP stay on the first one
+            n_transports, strategy = stripe
+            group = None
+            if n_transports > 1 and pf_configs:
+                extra_clients = []
+                for _ in range(n_transports - 1):
+                    try:
+                        extra = self.pool.lease(ip, port, user, password, fresh=True, profile=profile, jump=jump)
+                    except PoolExhausted as e:
+                        # Other sessions already hold connections to this host
+                        print(f"Striping capped: {e}")
+                        msg = f"仅建立了 {len(extra_clients) + 1}/{n_transports} 个并行传输:\n{e}"
+                        self.root.after(0, lambda: messagebox.showwarning("并行传输", msg))
+                        break
+                    set_nodelay(extra.get_transport())
+                    extra_clients.append(extra)
+                group = TransportGroup([transport] + [c.get_transport() for c in extra_clients],
+                                       strategy, extra_clients)
+                transport = group
+            # One relay loop serves every mapping on this transport
+            engine = ForwardingEngine()
+            engine.tuning = tuning
             for cfg in pf_configs:
-                pf = PortForwarder(cfg['local'], cfg['remote_host'], cfg['remote_port'], transport)
+                l_start, l_end = cfg['local']
+                if cfg['mode'] == 'socks':
+                    SocksForwarder(l_start, transport, engine, cfg['rate_limit'], cfg['priority']).start()
+                    continue
+                r_start, r_end = cfg['remote_port']
+                if cfg['mode'] == 'remote':
+                    # Reverse forwards are bound to the primary transport, the server delivers channels there
+                    RemoteForwarder(r_start, "localhost", l_start, client.get_transport(), engine,
+                                    cfg['rate_limit'], cfg['priority'], cfg['remote_host']).start()
+                    continue
+                if l_start == l_end:
+                    pf = PortForwarder(l_start, cfg['remote_host'], r_start, transport, engine,
+                                       cfg['rate_limit'], cfg['priority'])
+                else:
+                    pf = PortRangeForwarder(l_start, l_end, cfg['remote_host'], r_start, r_end, transport, engine,
+                                            cfg['rate_limit'], cfg['priority'])
                 pf.start()
 
             # Pass theme colors to terminal
@@ -404,7 +602,13 @@ class SSHGui:
 
             def launch_windows():
                 # Open Toolbox only
-                SSHToolbox(self.root, t, client, user, ip, port, password)
+                SSHToolbox(self.root, t, client, user, ip, port, password, engine, tuning, group)
+                self.engine = engine
+                self.transport_group = group
+                self.pf_last_bytes = {}
+                if self.pf_stats_job:
+                    self.root.after_cancel(self.pf_stats_job)
+                self.refresh_pf_stats()
 
             self.root.after(0, launch_windows)
             
@@ -458,7 +662,7 @@ class TextEditorWindow(tk.Toplevel):
             messagebox.showerror("错误", f"无法保存文件: {str(e)}")
 
 class FileManagerWindow(tk.Toplevel):
-    def __init__(self, master, client, theme):
+    def __init__(self, master, client, theme, tuning=None):
         super().__init__(master)
         self.title("文件管理")
         self.geometry("900x600")
@@ -466,9 +670,13 @@ class FileManagerWindow(tk.Toplevel):
         self.theme = theme
         self.configure(bg=theme["bg"])
         
-        self.sftp = self.client.open_sftp()
+        if tuning:
+            self.sftp = paramiko.SFTPClient.from_transport(self.client.get_transport(), **tuning.channel_kwargs())
+        else:
+            self.sftp = self.client.open_sftp()
         self.current_path = "/"
         self.clipboard = None # {path, op='cut'|'copy'}
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Toolbar
         toolbar = ttk.Frame(self)
@@ -677,11 +885,295 @@ class FileManagerWindow(tk.Toplevel):
         except Exception as e:
             messagebox.showerror("错误", f"粘贴失败: {str(e)}")
 
+    def on_close(self):
+        try:
+            self.sftp.close()
+        except:
+            pass
+        # Returns the leased connection to the pool rather than disconnecting
+        self.client.close()
+        self.destroy()
+
+class FleetWindow(tk.Toplevel):
+    STATES = {fleet.PENDING: "等待", fleet.CONNECTING: "连接中", fleet.CONNECTED: "已连接", fleet.FAILED: "失败"}
+
+    def __init__(self, master, theme, user, port, password, profile=None, jump=None):
+        super().__init__(master)
+        self.title("批量连接" + (f" (经 {format_jump(jump)})" if jump else ""))
+        self.profile = profile
+        self.jump = jump
+        self.geometry("640x560")
+        self.theme = theme
+        self.defaults = (user, port, password)
+        self.fleet = shared_fleet()
+        self.engine = None
+        self.mux = None
+        self.configure(bg=theme["bg"])
+
+        ttk.Label(self, text="主机列表 (每行 [用户[:密码]@]主机[:端口])").pack(anchor=tk.W, padx=10, pady=(10, 0))
+        self.hosts_text = scrolledtext.ScrolledText(self, height=8, font=("Consolas", 10))
+        self.hosts_text.pack(fill=tk.X, padx=10, pady=5)
+
+        toolbar = ttk.Frame(self)
+        toolbar.pack(fill=tk.X, padx=10, pady=5)
+        for text, cmd in [("📂 导入文件", self.import_file), ("⚡ 全部连接", self.connect_all),
+                          ("💻 打开终端", self.open_terminal), ("✖ 断开全部", self.disconnect_all)]:
+            HoverButton(toolbar, text=text, command=cmd, font=("Segoe UI", 9),
+                        bg=theme["btn_bg"], fg=theme["btn_fg"], hover_bg=theme["btn_hover"],
+                        relief='flat').pack(side=tk.LEFT, padx=2)
+        ttk.Label(toolbar, text="并发:").pack(side=tk.LEFT, padx=(10, 2))
+        self.workers_entry = tk.Entry(toolbar, width=5, relief='flat', font=("Segoe UI", 9))
+        self.workers_entry.insert(0, str(fleet.DEFAULT_FLEET_WORKERS))
+        self.workers_entry.pack(side=tk.LEFT)
+
+        columns = ("host", "state", "handshake", "error")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", selectmode="browse")
+        for col, text, width in [("host", "主机", 200), ("state", "状态", 70),
+                                 ("handshake", "握手 ms", 70), ("error", "错误", 260)]:
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, stretch=(col == "error"))
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.tree.bind("<Double-1>", lambda e: self.open_terminal())
+
+        self.summary_label = ttk.Label(self, text="")
+        self.summary_label.pack(anchor=tk.W, padx=10, pady=(0, 10))
+
+        for h in self.fleet.sessions():
+            self.update_row(h)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def import_file(self):
+        path = filedialog.askopenfilename(parent=self, filetypes=[("主机列表", "*.txt"), ("所有文件", "*.*")])
+        if not path:
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.hosts_text.insert(tk.END, f.read().rstrip('\n') + "\n")
+        except Exception as e:
+            messagebox.showerror("错误", f"无法读取文件: {str(e)}", parent=self)
+
+    def connect_all(self):
+        workers = self.workers_entry.get().strip()
+        if not workers.isdigit() or not 1 <= int(workers) <= 100:
+            messagebox.showerror("错误", "并发数应为 1-100", parent=self)
+            return
+        try:
+            hosts = fleet.parse_hosts(self.hosts_text.get("1.0", tk.END), *self.defaults)
+        except ValueError as e:
+            messagebox.showerror("错误", str(e), parent=self)
+            return
+        if not hosts:
+            messagebox.showerror("错误", "主机列表为空", parent=self)
+            return
+        for h in hosts:
+            self.update_row(h)
+        self.fleet.connect_all(hosts, int(workers), on_update=lambda h: self.after(0, self.update_row, h),
+                               profile=self.profile, jump=self.jump)
+
+    def update_row(self, h):
+        values = (h.key, self.STATES.get(h.state, h.state),
+                  f"{h.handshake * 1000:.0f}" if h.handshake is not None else "--",
+                  str(h.error) if h.error else "")
+        if self.tree.exists(h.key):
+            self.tree.item(h.key, values=values)
+        else:
+            self.tree.insert("", tk.END, iid=h.key, values=values)
+        self.update_summary()
+
+    def update_summary(self):
+        sessions = self.fleet.sessions()
+        done = [h for h in sessions if h.state == fleet.CONNECTED]
+        times = sorted(h.handshake for h in done)
+        text = f"已连接 {len(done)}/{len(sessions)}"
+        if times:
+            text += f"   握手 p50 {percentile(times, 50) * 1000:.0f} ms / 最慢 {times[-1] * 1000:.0f} ms"
+        self.summary_label.config(text=text)
+
+    def open_terminal(self):
+        selected = self.tree.selection()
+        if not selected:
+            return
+        h = self.fleet.get(selected[0])
+        if not h or not h.is_active():
+            messagebox.showerror("错误", "该主机未连接", parent=self)
+            return
+        if not self.mux:
+            # One master serves every fleet host; terminals name the host with -s
+            self.engine = ForwardingEngine()
+            self.mux = ControlMaster(None, None, self.engine, self.fleet)
+        theme_mode = "dark" if self.theme["bg"] == "#202020" else "light"
+        try:
+            if TERMINAL_PROCESS:
+                args = [sys.executable, "terminal.py", "-u", h.user, "-h", h.host, "-p", str(h.port),
+                        "-t", theme_mode, "-s", h.key]
+                subprocess.Popen(args, env=self.mux.env())
+            else:
+                TerminalWindow(h.host, h.port, h.user, h.password, theme_mode, session=h.key,
+                               master=self.master, client=h.lease.share(), control=self.mux)
+        except Exception as e:
+            messagebox.showerror("错误", f"无法打开终端: {str(e)}", parent=self)
+
+    def disconnect_all(self):
+        self.fleet.close_all()
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+        self.update_summary()
+
+    def on_close(self):
+        if self.mux:
+            self.mux.stop()
+        if self.engine:
+            self.engine.stop()
+        self.fleet.close_all()
+        self.destroy()
+
+class BatchExecWindow(tk.Toplevel):
+    HOST_COLORS = ["#0DBC79", "#2472C8", "#BC3FBC", "#11A8CD", "#E5A50A", "#D670D6", "#3B8EEA", "#23D18B"]
+    # Events handled per after() tick, so a chatty fleet can't starve the main loop
+    DRAIN_BATCH = 500
+
+    def __init__(self, master, theme, targets):
+        super().__init__(master)
+        self.title("批量执行")
+        self.geometry("820x620")
+        self.theme = theme
+        # The toolbox's own host can also be a fleet session; run it once (the tree uses keys as iids)
+        self.targets = []
+        seen = set()
+        for key, client in targets:
+            if key not in seen:
+                seen.add(key)
+                self.targets.append((key, client))
+        self.runner = None
+        self.started = {}
+        self.configure(bg=theme["bg"])
+
+        top = ttk.Frame(self)
+        top.pack(fill=tk.X, padx=10, pady=(10, 5))
+        ttk.Label(top, text="命令:").pack(side=tk.LEFT)
+        self.cmd_entry = tk.Entry(top, relief='flat', font=("Consolas", 10))
+        self.cmd_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.cmd_entry.bind("<Return>", lambda e: self.run())
+        ttk.Label(top, text="并发:").pack(side=tk.LEFT)
+        self.conc_entry = tk.Entry(top, width=4, relief='flat', font=("Segoe UI", 9))
+        self.conc_entry.insert(0, str(batch_exec.DEFAULT_CONCURRENCY))
+        self.conc_entry.pack(side=tk.LEFT, padx=5)
+        self.run_btn = HoverButton(top, text="▶ 执行", command=self.run, font=("Segoe UI", 9),
+                                   bg=theme["btn_bg"], fg=theme["btn_fg"], hover_bg=theme["btn_hover"], relief='flat')
+        self.run_btn.pack(side=tk.LEFT, padx=2)
+        HoverButton(top, text="■ 停止", command=self.stop, font=("Segoe UI", 9),
+                    bg=theme["btn_bg"], fg=theme["btn_fg"], hover_bg=theme["btn_hover"], relief='flat').pack(side=tk.LEFT, padx=2)
+
+        body = ttk.Frame(self)
+        body.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.host_list = tk.Listbox(body, selectmode=tk.MULTIPLE, width=28, exportselection=False, font=("Consolas", 9))
+        for key, _ in self.targets:
+            self.host_list.insert(tk.END, key)
+        self.host_list.select_set(0, tk.END)
+        self.host_list.pack(side=tk.LEFT, fill=tk.Y)
+        self.output = scrolledtext.ScrolledText(body, font=("Consolas", 10), state='disabled',
+                                                bg="#1E1E1E", fg="#CCCCCC")
+        self.output.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5, 0))
+        self.output.tag_configure("stderr", foreground="#F14C4C")
+        for i, (key, _) in enumerate(self.targets):
+            self.output.tag_configure(f"host_{key}", foreground=self.HOST_COLORS[i % len(self.HOST_COLORS)])
+
+        columns = ("host", "exit", "runtime", "error")
+        self.result_tree = ttk.Treeview(self, columns=columns, show="headings", height=6)
+        for col, text, width in [("host", "主机", 220), ("exit", "退出码", 60),
+                                 ("runtime", "耗时", 80), ("error", "错误", 300)]:
+            self.result_tree.heading(col, text=text)
+            self.result_tree.column(col, width=width, stretch=(col == "error"))
+        self.result_tree.pack(fill=tk.X, padx=10, pady=5)
+        self.summary_label = ttk.Label(self, text="")
+        self.summary_label.pack(anchor=tk.W, padx=10, pady=(0, 10))
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def run(self):
+        command = self.cmd_entry.get().strip()
+        conc = self.conc_entry.get().strip()
+        if not command:
+            return
+        if not conc.isdigit() or not 1 <= int(conc) <= 100:
+            messagebox.showerror("错误", "并发数应为 1-100", parent=self)
+            return
+        if self.runner:
+            messagebox.showerror("错误", "上一个命令仍在执行", parent=self)
+            return
+        targets = [self.targets[i] for i in self.host_list.curselection()]
+        if not targets:
+            return
+        self.output.configure(state='normal')
+        self.output.delete("1.0", tk.END)
+        self.output.configure(state='disabled')
+        for iid in self.result_tree.get_children():
+            self.result_tree.delete(iid)
+        for key, _ in targets:
+            self.result_tree.insert("", tk.END, iid=key, values=(key, "", "等待", ""))
+        self.started = {}
+        self.summary_label.config(text=f"正在执行: {len(targets)} 台主机")
+        self.run_btn.config(state="disabled")
+        self.runner = batch_exec.BatchRunner(targets, command, int(conc)).start()
+        self.drain()
+
+    def drain(self):
+        if not self.runner:
+            return
+        lines = []
+        finished = False
+        for _ in range(self.DRAIN_BATCH):
+            try:
+                event = self.runner.events.get_nowait()
+            except queue.Empty:
+                break
+            kind = event[0]
+            if kind == "line":
+                _, key, stream, text = event
+                lines.append((key, stream, text))
+            elif kind == "start":
+                self.result_tree.set(event[1], "runtime", "运行中")
+            elif kind == "done":
+                _, key, status, runtime, error = event
+                self.result_tree.item(key, values=(key, "" if status is None else status,
+                                                   f"{runtime:.2f}s", error or ""))
+            elif kind == "finished":
+                finished = True
+        if lines:
+            # One insert per tick instead of one per line
+            self.output.configure(state='normal')
+            for key, stream, text in lines:
+                self.output.insert(tk.END, f"[{key}] ", (f"host_{key}",))
+                self.output.insert(tk.END, text + "\n", ("stderr",) if stream == "stderr" else ())
+            self.output.see(tk.END)
+            self.output.configure(state='disabled')
+        if finished:
+            self.finish()
+        else:
+            self.after(50, self.drain)
+
+    def finish(self):
+        self.runner = None
+        self.run_btn.config(state="normal")
+        rows = [self.result_tree.item(iid, "values") for iid in self.result_tree.get_children()]
+        ok = sum(1 for r in rows if str(r[1]) == "0")
+        failed = len(rows) - ok
+        self.summary_label.config(text=f"完成: 成功 {ok}, 失败 {failed}")
+
+    def stop(self):
+        if self.runner:
+            self.runner.cancel()
+
+    def on_close(self):
+        self.stop()
+        self.runner = None
+        self.destroy()
+
 class SSHToolbox(tk.Toplevel):
-    def __init__(self, master, theme, client, user, ip, port, password):
+    def __init__(self, master, theme, client, user, ip, port, password, engine=None, tuning=None, transport_group=None):
         super().__init__(master)
         self.title("SSH 工具箱")
-        self.geometry("350x450")
+        self.geometry("350x520")
         self.resizable(False, False)
         self.theme = theme
         self.client = client
@@ -689,6 +1181,22 @@ class SSHToolbox(tk.Toplevel):
         self.ip = ip
         self.port = str(port)
         self.password = password
+        self.engine = engine
+        self.tuning = tuning
+        self.transport_group = transport_group
+        # Terminal processes attach to this transport through the mux instead of logging in again
+        self.mux = None
+        if engine:
+            try:
+                self.mux = ControlMaster(client, password, engine, shared_fleet(), f"{user}@{ip}:{port}")
+            except Exception as e:
+                print(f"Mux start failed: {e}")
+        self.monitor_job = None
+        # Rebuilds the transport with backoff when it drops and moves every mapping over
+        self.supervisor = ReconnectSupervisor(client, ip, port, user, password, engine, tuning, transport_group,
+                                              on_change=lambda: self.after(0, self.monitor_connection),
+                                              on_restore=self.on_reconnected)
+        self.supervisor.start()
         self.configure(bg=theme["bg"])
         
         # Status Section
@@ -709,6 +1217,7 @@ class SSHToolbox(tk.Toplevel):
         buttons = [
             ("📁 文件管理", self.open_file_manager),
             ("🚀 3x-ui 一键安装", self.install_3x_ui),
+            ("⚡ 批量执行", self.open_batch_exec),
             ("📊 服务器状态", self.show_dev_msg),
             ("🐳 Docker 管理", self.show_dev_msg)
         ]
@@ -731,6 +1240,11 @@ class SSHToolbox(tk.Toplevel):
                                           font=("Segoe UI", 8), width=8, relief='flat')
         self.test_latency_btn.pack(side=tk.LEFT)
 
+        # Per-hop round trips when the connection goes through bastions
+        self.hops_label = tk.Label(self, text="", bg=theme["bg"], fg=theme["fg"], font=("Segoe UI", 8),
+                                   wraplength=320, justify=tk.RIGHT)
+        self.hops_label.pack(side=tk.BOTTOM, anchor=tk.E, padx=10)
+
         self.protocol("WM_DELETE_WINDOW", self.on_close)
         self.monitor_connection()
         
@@ -748,6 +1262,9 @@ class SSHToolbox(tk.Toplevel):
                  self.after(0, lambda: self.latency_label.config(text="延迟: 未连接"))
                  return
 
+            # Let bulk forwards yield while we measure
+            if self.engine:
+                self.engine.mark_interactive()
             start_time = time.time()
             # Execute a lightweight command
             stdin, stdout, stderr = self.client.exec_command('echo 1', timeout=5)
@@ -756,6 +1273,10 @@ class SSHToolbox(tk.Toplevel):
             
             latency = int((end_time - start_time) * 1000)
             self.after(0, lambda: self.latency_label.config(text=f"延迟: {latency} ms"))
+            conn = getattr(self.client, 'conn', None)
+            if conn and conn.bastion:
+                hops = format_hops(hop_latencies(self.client))
+                self.after(0, lambda: self.hops_label.config(text=f"逐跳: {hops}"))
             
         except Exception as e:
             self.after(0, lambda: self.latency_label.config(text="延迟: 错误"))
@@ -766,56 +1287,90 @@ class SSHToolbox(tk.Toplevel):
         self.monitor_connection()
 
     def monitor_connection(self):
-        if self.client and self.client.get_transport() and self.client.get_transport().is_active():
-             self.status_lbl.config(text=f"🟢 已连接: {self.ip}", foreground="green")
-             self.after(2000, self.monitor_connection)
+        if self.monitor_job:
+            self.after_cancel(self.monitor_job)
+            self.monitor_job = None
+        note = self.supervisor.status_text()
+        if self.supervisor.state == RECONNECTING:
+             self.status_lbl.config(text=f"🟡 {note}: {self.ip}", foreground="orange")
+        elif self.client and self.client.get_transport() and self.client.get_transport().is_active():
+             text = f"🟢 已连接: {self.ip}"
+             if note:
+                 text += f" ({note})"
+             self.status_lbl.config(text=text, foreground="green")
         else:
              self.status_lbl.config(text=f"🔴 已断开: {self.ip}", foreground="red")
+        # Keep polling while disconnected too, the supervisor may bring it back
+        if self.supervisor.state != STOPPED:
+            self.monitor_job = self.after(2000, self.monitor_connection)
 
-    def open_terminal(self):
-        if self.client and self.client.get_transport() and self.client.get_transport().is_active():
-            try:
-                channel = self.client.invoke_shell()
-                TerminalWindow(self.master, self.client, channel, 
-                             title=f"SSH: {self.user}@{self.ip}",
-                             bg_color=self.theme["bg"], fg_color=self.theme["fg"])
-            except Exception as e:
-                messagebox.showerror("错误", f"无法打开终端: {str(e)}")
-        else:
-            messagebox.showerror("错误", "连接已断开")
+    def on_reconnected(self, lease):
+        # Called on the supervisor thread; new shells, exec and SFTP go to the new transport
+        self.client = lease
+        if self.mux:
+            self.mux.client = lease
 
     def on_close(self):
+        self.supervisor.stop()
+        if self.mux:
+            self.mux.stop()
+        if self.engine:
+            self.engine.stop()
+        if self.transport_group:
+            self.transport_group.close()
         try:
             self.client.close()
         except:
             pass
         self.destroy()
 
-    def open_terminal(self):
-        # Use terminal.py for the independent SSH command box (Tkinter based)
+    def spawn_terminal(self, command=None):
+        if not TERMINAL_PROCESS:
+            # A Toplevel in this process with a shell on the toolbox's connection
+            theme_mode = "dark" if self.theme["bg"] == "#202020" else "light"
+            TerminalWindow(self.ip, self.port, self.user, self.password, theme_mode, command,
+                           master=self.master, client=self.client.share(), control=self.mux)
+            return
+        # With a mux the child gets the master address/token via the environment
+        # and never sees the password; without one it falls back to its own login
         theme_mode = "dark" if self.theme["bg"] == "#202020" else "light"
-        args = [sys.executable, "terminal.py", "-u", self.user, "-h", self.ip, "-p", self.port, "-pwd", self.password, "-t", theme_mode]
+        args = [sys.executable, "terminal.py", "-u", self.user, "-h", self.ip, "-p", self.port, "-t", theme_mode]
+        env = None
+        if self.mux:
+            env = self.mux.env()
+        else:
+            args += ["-pwd", self.password]
+        if command:
+            args += ["-cmd", command]
+        subprocess.Popen(args, env=env)
+
+    def open_terminal(self):
         try:
-            subprocess.Popen(args)
+            self.spawn_terminal()
         except Exception as e:
-            messagebox.showerror("错误", f"无法启动 terminal.py: {str(e)}")
+            messagebox.showerror("错误", f"无法打开终端: {str(e)}")
 
     def open_file_manager(self):
         if self.client:
             try:
-                FileManagerWindow(self.master, self.client, self.theme)
+                # Its own lease, so the connection stays up if the toolbox closes first
+                FileManagerWindow(self.master, self.client.share(), self.theme, self.tuning)
             except Exception as e:
                 messagebox.showerror("错误", f"无法打开文件管理: {str(e)}")
         else:
              messagebox.showerror("错误", "未连接")
 
+    def open_batch_exec(self):
+        # This host plus every connected fleet session
+        targets = [(f"{self.user}@{self.ip}:{self.port}", self.client)]
+        targets += [(h.key, h.lease) for h in shared_fleet().sessions() if h.is_active()]
+        BatchExecWindow(self.master, self.theme, targets)
+
     def install_3x_ui(self):
         if messagebox.askyesno("安装确认", "是否安装 3x-ui?"):
             try:
                 cmd = "bash <(curl -Ls https://raw.githubusercontent.com/mhsanaei/3x-ui/master/install.sh)"
-                theme_mode = "dark" if self.theme["bg"] == "#202020" else "light"
-                args = [sys.executable, "terminal.py", "-u", self.user, "-h", self.ip, "-p", self.port, "-pwd", self.password, "-t", theme_mode, "-cmd", cmd]
-                subprocess.Popen(args)
+                self.spawn_terminal(cmd)
             except Exception as e:
                 messagebox.showerror("错误", f"无法启动安装进程: {str(e)}")
 
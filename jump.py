@@ -0,0 +1,78 @@
+"""ProxyJump-style chaining: reach a host through one or more bastions.
+
+A jump spec uses the host list syntax of fleet.py, comma separated and
+outermost first, like `ssh -J`:
+
+    [user[:password]@]bastion[:port][,[user[:password]@]inner-bastion[:port]...]
+
+The pool (connection_pool.ConnectionPool.lease(jump=...)) opens the target's
+SSH session over a direct-tcpip channel of the last bastion, and leases each
+bastion like any other shared connection, so one bastion transport carries
+every host behind it.
+"""
+from fleet import parse_host_line
+from transport_tuning import measure_rtt
+
+
+class JumpHost:
+    def __init__(self, host, port=22, user="root", password=""):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+
+    @property
+    def key(self):
+        return f"{self.user}@{self.host}:{self.port}"
+
+    def __repr__(self):
+        return f"JumpHost({self.key})"
+
+
+def parse_jump(text, user="root", port=22, password=""):
+    """Jump spec -> [JumpHost], outermost first; [] for an empty spec"""
+    hops = []
+    for part in (text or "").split(','):
+        h = parse_host_line(part, user, port, password)
+        if h:
+            hops.append(JumpHost(h.host, h.port, h.user, h.password))
+    return hops
+
+
+def format_jump(hops):
+    return ",".join(h.key for h in hops)
+
+
+def hop_chain(lease):
+    """Pooled connections from the outermost bastion to the target"""
+    chain = []
+    conn = getattr(lease, 'conn', None)
+    while conn is not None:
+        chain.append(conn)
+        conn = conn.bastion.conn if conn.bastion else None
+    return chain[::-1]
+
+
+def hop_latencies(lease, samples=3):
+    """[(label, seconds or None)] per hop.
+
+    Each transport's keepalive round trip covers every hop in front of it, so
+    a hop's own latency is its RTT minus the RTT of the bastion it goes through.
+    """
+    hops = []
+    outer = 0.0
+    for conn in hop_chain(lease):
+        host, port, user = conn.key
+        label = f"{user}@{host}:{port}"
+        transport = conn.client.get_transport()
+        rtt = measure_rtt(transport, samples) if transport and transport.is_active() else None
+        if rtt is None:
+            hops.append((label, None))
+            break
+        hops.append((label, max(0.0, rtt - outer)))
+        outer = rtt
+    return hops
+
+
+def format_hops(hops):
+    return " → ".join(f"{label} {'--' if rtt is None else f'{rtt * 1000:.0f}'} ms" for label, rtt in hops)
@@ -62,6 +62,17 @@ class MonitoringPanel(tk.Frame):
         self.monitoring = True
         self.update_data()
     
+    def reattach(self, channel):
+        """Point the panel at a new channel/transport after a reconnect"""
+        try:
+            if self.monitoring_session:
+                self.monitoring_session.close()
+        except: pass
+        self.monitoring_session = None
+        self.channel = channel
+        if not self.monitoring:
+            self.start_monitoring(channel)
+    
     def stop_monitoring(self):
         self.monitoring = False
         if self.monitoring_session:
@@ -0,0 +1,348 @@
+"""Connection multiplexing in the spirit of OpenSSH ControlMaster.
+
+The GUI process owns the authenticated transport and runs a ControlMaster on a
+loopback socket. Terminal processes attach with a MuxClient and get channels
+on that transport in one local round trip instead of a full TCP + key
+exchange + password handshake. The master address and token travel in the
+environment, never on the command line.
+
+Protocol: the client sends one JSON line {"token", "op", ...} and the master
+answers one JSON line {"ok": bool, ...}. For "shell" the socket then carries
+the raw channel stream; for "exec" the reply holds exit_status and size and
+is followed by that many bytes of output.
+"""
+import hmac
+import json
+import os
+import secrets
+import select
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from forwarding import EngineFull, ForwardStats, Relay, RELAY_FDS, PRIORITY_INTERACTIVE
+
+MUX_ENV = "SSH_SIMPLE_MUX"
+HEADER_LIMIT = 64 * 1024
+HANDSHAKE_TIMEOUT = 10
+
+
+def read_line(sock, limit=HEADER_LIMIT):
+    """Read one newline-terminated line byte by byte, so nothing past it is consumed"""
+    data = bytearray()
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(1)
+        if not chunk:
+            raise ConnectionError("mux peer closed the connection")
+        data += chunk
+        if len(data) > limit:
+            raise ValueError("mux header too long")
+    return json.loads(data.decode('utf-8'))
+
+
+def send_line(sock, obj):
+    sock.sendall(json.dumps(obj).encode('utf-8') + b'\n')
+
+
+class ControlMaster:
+    """Serves shell/exec channels on an existing client to local mux clients"""
+    def __init__(self, client, password, engine, fleet=None, label=""):
+        self.client = client
+        self.password = password
+        self.engine = engine
+        self.fleet = fleet      # requests naming a fleet session get that host's connection
+        self.label = label
+        self.token = secrets.token_hex(16)
+        # Relay owner attributes: mux shells count as interactive traffic
+        self.stats = ForwardStats()
+        self.bucket = None
+        self.priority = PRIORITY_INTERACTIVE
+        self.relays = set()
+        self.running = True
+        # Shell relays run on the engine loop, which otherwise only starts with the first port mapping
+        engine.ensure_started()
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.address = self.listener.getsockname()
+        self.workers = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mux")
+        threading.Thread(target=self.accept_loop, daemon=True, name="mux-accept").start()
+
+    def env(self):
+        """Environment for a child process that should attach to this master"""
+        env = dict(os.environ)
+        env[MUX_ENV] = f"{self.address[0]}:{self.address[1]}:{self.token}"
+        return env
+
+    def describe(self):
+        return f"mux {self.address[0]}:{self.address[1]}"
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            self.workers.submit(self.handle, sock)
+
+    def handle(self, sock):
+        try:
+            sock.settimeout(HANDSHAKE_TIMEOUT)
+            request = read_line(sock)
+            if not hmac.compare_digest(str(request.get('token', '')), self.token):
+                send_line(sock, {'ok': False, 'error': 'bad token'})
+                sock.close()
+                return
+            op = request.get('op')
+            client, password = self.resolve(request.get('session'))
+            transport = client.get_transport() if client else None
+            if op == 'verify':
+                send_line(sock, {'ok': password is not None and
+                                       hmac.compare_digest(str(request.get('password', '')), password)})
+                sock.close()
+            elif op == 'hosts':
+                send_line(sock, {'ok': True, 'hosts': self.hosts()})
+                sock.close()
+            elif not transport or not transport.is_active():
+                send_line(sock, {'ok': False, 'error': '连接已断开'})
+                sock.close()
+            elif op == 'ping':
+                send_line(sock, {'ok': True})
+                sock.close()
+            elif op == 'shell':
+                self.open_shell(sock, transport, request)
+            elif op == 'exec':
+                self.run_exec(sock, transport, request)
+            else:
+                send_line(sock, {'ok': False, 'error': f'unknown op {op}'})
+                sock.close()
+        except Exception as e:
+            self.stats.record_error(e)
+            try:
+                send_line(sock, {'ok': False, 'error': str(e)})
+            except OSError:
+                pass
+            sock.close()
+
+    def resolve(self, session):
+        """(client, password) a request is about: a fleet session or this master's own"""
+        if session and self.fleet:
+            host = self.fleet.get(session)
+            if host is None:
+                return None, None
+            return host.lease, host.password
+        return self.client, self.password
+
+    def hosts(self):
+        hosts = []
+        if self.client:
+            transport = self.client.get_transport()
+            hosts.append({'key': '', 'label': self.label, 'active': bool(transport and transport.is_active()),
+                          'handshake_ms': None})
+        if self.fleet:
+            for h in self.fleet.sessions():
+                info = h.info()
+                info['label'] = h.key
+                hosts.append(info)
+        return hosts
+
+    def open_shell(self, sock, transport, request):
+        if not self.engine.has_room():
+            raise self.engine.full_error()
+        channel = transport.open_session()
+        channel.get_pty(term=request.get('term', 'xterm-256color'),
+                        width=int(request.get('width', 80)), height=int(request.get('height', 24)))
+        channel.invoke_shell()
+        send_line(sock, {'ok': True})
+        sock.settimeout(None)
+        # From here on it is a plain socket <-> channel relay on the forwarding loop
+        try:
+            self.engine.place(RELAY_FDS, Relay, sock, channel, self, 0.0, ('shell', None))
+        except EngineFull:
+            channel.close()
+            raise
+
+    def run_exec(self, sock, transport, request):
+        channel = transport.open_session()
+        channel.set_combine_stderr(True)
+        channel.exec_command(request.get('command', ''))
+        output = bytearray()
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            output += data
+        status = channel.recv_exit_status()
+        channel.close()
+        send_line(sock, {'ok': True, 'exit_status': status, 'size': len(output)})
+        sock.sendall(output)
+        sock.close()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        self.workers.shutdown(wait=False)
+        # Takes the shell relays with it
+        self.engine.stop()
+
+
+class MuxError(Exception):
+    pass
+
+
+class MuxClient:
+    """Child-process side: asks the master for channels on its transport"""
+    def __init__(self, host, port, token):
+        self.address = (host, int(port))
+        self.token = token
+
+    @classmethod
+    def from_env(cls, env=None):
+        value = (env or os.environ).get(MUX_ENV)
+        if not value:
+            return None
+        host, port, token = value.rsplit(':', 2)
+        return cls(host, port, token)
+
+    def request(self, op, **fields):
+        sock = socket.create_connection(self.address, timeout=HANDSHAKE_TIMEOUT)
+        fields.update(token=self.token, op=op)
+        send_line(sock, fields)
+        reply = read_line(sock)
+        if not reply.get('ok') and op != 'verify':
+            sock.close()
+            raise MuxError(reply.get('error', 'mux request failed'))
+        return sock, reply
+
+    def open_shell(self, term='xterm-256color', width=80, height=24, session=None):
+        sock, _ = self.request('shell', term=term, width=width, height=height, session=session)
+        sock.settimeout(None)
+        return MuxChannel(self, sock, session)
+
+    def exec_command(self, command, session=None):
+        """Run command on the master's transport; returns (exit_status, output bytes)"""
+        sock, reply = self.request('exec', command=command, session=session)
+        output = bytearray()
+        while len(output) < reply['size']:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            output += chunk
+        sock.close()
+        return reply['exit_status'], bytes(output)
+
+    def verify(self, password, session=None):
+        sock, reply = self.request('verify', password=password, session=session)
+        sock.close()
+        return bool(reply.get('ok'))
+
+    def hosts(self):
+        """Sessions the master can serve: its own connection plus fleet hosts"""
+        sock, reply = self.request('hosts')
+        sock.close()
+        return reply.get('hosts', [])
+
+    def is_active(self, session=None):
+        """True while the master is up and its transport is connected"""
+        try:
+            sock, _ = self.request('ping', session=session)
+            sock.close()
+            return True
+        except (OSError, MuxError, ValueError):
+            return False
+
+
+class MuxChannel:
+    """The subset of paramiko.Channel that TerminalWindow uses, over a mux socket"""
+    def __init__(self, mux, sock, session=None):
+        self.mux = mux
+        self.sock = sock
+        self.session = session
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.sock.sendall(data)
+        return len(data)
+
+    def recv_ready(self):
+        if self.closed:
+            return False
+        r, _, _ = select.select([self.sock], [], [], 0)
+        return bool(r)
+
+    def recv(self, nbytes):
+        data = self.sock.recv(nbytes)
+        if not data:
+            self.closed = True
+        return data
+
+    def get_transport(self):
+        return MuxTransport(self.mux, self.session)
+
+    def close(self):
+        self.closed = True
+        try:
+            # shutdown wakes a reader blocked in recv() on another thread; close alone may not
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class MuxTransport:
+    """Stands in for channel.get_transport() in MonitoringPanel"""
+    def __init__(self, mux, session=None):
+        self.mux = mux
+        self.session = session
+
+    def is_active(self):
+        return self.mux.is_active(self.session)
+
+    def open_session(self):
+        return MuxSession(self.mux, self.session)
+
+
+class MuxSession:
+    """One exec, run to completion by the master, then read back like a channel"""
+    def __init__(self, mux, session=None):
+        self.mux = mux
+        self.session = session
+        self.closed = False
+        self.output = b''
+        self.exit_status = None
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, command):
+        self.exit_status, self.output = self.mux.exec_command(command, self.session)
+
+    def exit_status_ready(self):
+        return self.exit_status is not None
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def recv_ready(self):
+        return bool(self.output)
+
+    def recv(self, nbytes):
+        data, self.output = self.output[:nbytes], self.output[nbytes:]
+        if not self.output:
+            self.closed = True
+        return data
+
+    def close(self):
+        self.closed = True
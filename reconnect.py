@@ -0,0 +1,183 @@
+"""Automatic reconnect for a pooled SSH connection.
+
+ReconnectSupervisor watches the transport behind a Lease. When it drops it
+leases a new one with exponential backoff + jitter, recalibrates tuning, moves
+every port mapping of the engine over to the new transport (remote forwards
+are requested again) and repairs dead members of a striping group. Listeners
+get the new lease so shells and monitors can re-attach.
+"""
+import random
+import threading
+import time
+
+from connection_pool import PoolExhausted, shared_pool
+from transport_tuning import set_nodelay
+
+CONNECTED = "connected"
+RECONNECTING = "reconnecting"
+STOPPED = "stopped"
+# How often dead striping members / denied reverse forwards are retried
+REPAIR_INTERVAL = 5.0
+
+
+class Backoff:
+    """Exponential backoff with jitter: each delay is drawn from [d/2, d], d = base * factor**attempt"""
+    def __init__(self, base=1.0, cap=60.0, factor=2.0):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.cap, self.base * self.factor ** self.attempt)
+        self.attempt += 1
+        # Jitter keeps several windows/hosts from hammering the server in lockstep
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class ReconnectSupervisor(threading.Thread):
+    def __init__(self, lease, host, port, user, password, engine=None, tuning=None, group=None,
+                 pool=None, on_change=None, on_restore=None, interval=1.0, backoff=None):
+        super().__init__(daemon=True, name="reconnect")
+        self.lease = lease
+        self.credentials = (host, port, user, password)
+        self.engine = engine
+        self.tuning = tuning
+        self.group = group
+        self.pool = pool or shared_pool()
+        self.on_change = on_change      # called with no args whenever state/attempt changes
+        self.on_restore = on_restore    # called with the new lease after a successful reconnect
+        self.interval = interval
+        self.backoff = backoff or Backoff()
+        self.state = CONNECTED
+        self.attempts = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.down_since = None
+        self.last_reconnect_time = None
+        self.stop_event = threading.Event()
+
+    def notify(self):
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"Reconnect status callback failed: {e}")
+
+    def stop(self):
+        self.state = STOPPED
+        self.stop_event.set()
+
+    @property
+    def profile(self):
+        """Reconnect with the same algorithms/compression the connection was made with"""
+        conn = getattr(self.lease, 'conn', None)
+        return conn.profile if conn else None
+
+    @property
+    def jump(self):
+        """...and through the same bastions"""
+        conn = getattr(self.lease, 'conn', None)
+        return conn.jump if conn else None
+
+    def is_active(self):
+        transport = self.lease.get_transport()
+        return bool(transport and transport.is_active())
+
+    def run(self):
+        last_repair = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            if not self.is_active():
+                self.reconnect()
+                continue
+            if time.monotonic() - last_repair >= REPAIR_INTERVAL:
+                last_repair = time.monotonic()
+                if self.group:
+                    self.repair_group()
+                self.repair_remote_forwards()
+
+    def reconnect(self):
+        self.state = RECONNECTING
+        self.down_since = time.monotonic()
+        self.attempts = 0
+        self.backoff.reset()
+        self.notify()
+        host, port, user, password = self.credentials
+        while not self.stop_event.is_set():
+            self.attempts += 1
+            try:
+                lease = self.pool.lease(host, port, user, password, profile=self.profile, jump=self.jump)
+                break
+            except Exception as e:
+                self.last_error = e
+                delay = self.backoff.next_delay()
+                print(f"Reconnect attempt {self.attempts} to {user}@{host}:{port} failed: {e}; retry in {delay:.1f}s")
+                self.notify()
+                self.stop_event.wait(delay)
+        else:
+            return
+        self.restore(lease)
+        self.last_reconnect_time = time.monotonic() - self.down_since
+        self.reconnects += 1
+        self.last_error = None
+        self.state = CONNECTED
+        print(f"Reconnected to {user}@{host}:{port} in {self.last_reconnect_time:.2f}s ({self.attempts} attempt(s))")
+        self.notify()
+
+    def restore(self, lease):
+        old_lease, old_transport = self.lease, self.lease.get_transport()
+        transport = lease.get_transport()
+        if self.tuning:
+            self.tuning.calibrate(transport)
+        else:
+            set_nodelay(transport)
+        self.lease = lease
+        old_lease.close()
+
+        if self.group:
+            for i, t in enumerate(list(self.group.transports)):
+                if t is old_transport:
+                    self.group.replace(i, transport)
+            self.repair_group()
+        if self.engine:
+            # Mappings bound straight to the old transport (remote forwards, unstriped locals)
+            for forwarder in list(self.engine.forwarders):
+                if forwarder.transport is old_transport:
+                    self.engine.call_soon(forwarder.swap_transport, transport)
+        if self.on_restore:
+            self.on_restore(lease)
+
+    def repair_group(self):
+        host, port, user, password = self.credentials
+        for i, t in enumerate(list(self.group.transports)):
+            if t.is_active():
+                continue
+            try:
+                extra = self.pool.lease(host, port, user, password, fresh=True, profile=self.profile,
+                                        jump=self.jump)
+            except PoolExhausted:
+                return
+            except Exception as e:
+                print(f"Striping transport {i} reconnect failed: {e}")
+                return
+            set_nodelay(extra.get_transport())
+            self.group.replace(i, extra.get_transport(), extra)
+
+    def repair_remote_forwards(self):
+        # A reverse forward can be denied right after a reconnect while the server
+        # still holds the port for the dead session; keep asking until it frees up
+        if not self.engine:
+            return
+        for forwarder in list(self.engine.forwarders):
+            if getattr(forwarder, 'needs_rebind', False):
+                self.engine.call_soon(forwarder.swap_transport, self.lease.get_transport())
+
+    def status_text(self):
+        if self.state == RECONNECTING:
+            return f"重连中 (第 {self.attempts} 次)"
+        if self.last_reconnect_time is not None:
+            return f"已重连 {self.reconnects} 次, 耗时 {self.last_reconnect_time:.1f}s"
+        return ""
@@ -0,0 +1,94 @@
+"""Connection profiles: preferred cipher / KEX / MAC order and compression.
+
+A profile only reorders what paramiko offers, it never removes the fallbacks,
+so a server that lacks the preferred algorithms still negotiates something.
+The SSH client's order decides the pick, so putting an algorithm first is
+enough to get it whenever the server supports it. Names paramiko does not
+implement (e.g. chacha20-poly1305@openssh.com) are skipped.
+"""
+from collections import OrderedDict
+
+from transport_tuning import nodelay_transport
+
+DEFAULT_PROFILE = "默认"
+
+
+def reorder(preferred, available):
+    """`preferred` names that exist, in that order, followed by the rest of `available`"""
+    first = [name for name in preferred if name in available]
+    return tuple(first + [name for name in available if name not in first])
+
+
+class ConnectionProfile:
+    def __init__(self, name, ciphers=(), kex=(), macs=(), compress=False, description=""):
+        self.name = name
+        self.ciphers = tuple(ciphers)
+        self.kex = tuple(kex)
+        self.macs = tuple(macs)
+        self.compress = compress
+        self.description = description
+
+    def apply(self, transport):
+        """Reorder a transport's offers; call before start_client / start_server"""
+        options = transport.get_security_options()
+        if self.ciphers:
+            options.ciphers = reorder(self.ciphers, options.ciphers)
+        if self.kex:
+            options.kex = reorder(self.kex, options.kex)
+        if self.macs:
+            options.digests = reorder(self.macs, options.digests)
+        if self.compress:
+            transport.use_compression(True)
+        return transport
+
+    def transport_factory(self, sock, **kwargs):
+        return self.apply(nodelay_transport(sock, **kwargs))
+
+    def connect_kwargs(self):
+        """Extra SSHClient.connect arguments for this profile"""
+        if not (self.ciphers or self.kex or self.macs or self.compress):
+            return {}
+        return {'compress': self.compress, 'transport_factory': self.transport_factory}
+
+    def describe(self):
+        return self.description or self.name
+
+
+PROFILES = OrderedDict((p.name, p) for p in [
+    ConnectionProfile(DEFAULT_PROFILE, description="paramiko 默认顺序, 不压缩"),
+    # GCM is an AEAD: one pass for encryption + integrity, AES-NI makes it the cheapest on x86
+    ConnectionProfile("AES-GCM",
+                      ciphers=("aes128-gcm@openssh.com", "aes256-gcm@openssh.com"),
+                      kex=("curve25519-sha256@libssh.org",),
+                      description="aes128-gcm + curve25519, 高吞吐低 CPU"),
+    ConnectionProfile("AES-CTR+ETM",
+                      ciphers=("aes128-ctr", "aes256-ctr"),
+                      kex=("curve25519-sha256@libssh.org",),
+                      macs=("hmac-sha2-256-etm@openssh.com", "hmac-sha2-512-etm@openssh.com"),
+                      description="aes-ctr + encrypt-then-MAC"),
+    ConnectionProfile("压缩 (慢速链路)",
+                      ciphers=("aes128-gcm@openssh.com",),
+                      kex=("curve25519-sha256@libssh.org",),
+                      compress=True,
+                      description="zlib 压缩, 适合文本多的转发和慢速链路"),
+    ConnectionProfile("兼容 (旧服务器)",
+                      ciphers=("aes128-ctr", "aes128-cbc", "3des-cbc"),
+                      kex=("diffie-hellman-group14-sha256", "diffie-hellman-group-exchange-sha256"),
+                      macs=("hmac-sha2-256", "hmac-sha1"),
+                      description="老版本 sshd 也支持的组合"),
+])
+
+
+def get_profile(name):
+    return PROFILES.get(name or DEFAULT_PROFILE, PROFILES[DEFAULT_PROFILE])
+
+
+def negotiated(transport):
+    """What a connected transport actually agreed on (paramiko drops the KEX name after kex)"""
+    cipher = transport.local_cipher
+    return {
+        'cipher': cipher,
+        # GCM authenticates itself; paramiko still reports the MAC it agreed on but never uses it
+        'mac': "(aead)" if cipher and cipher.endswith("gcm@openssh.com") else transport.local_mac,
+        'compression': transport.local_compression,
+    }
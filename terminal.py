@@ -1,17 +1,46 @@
+import time
+STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, simpledialog, ttk
-import paramiko
 import threading
 import sys
-import time
+import os
+import subprocess
 import argparse
+import codecs
 import logging
-import re
-from monitoring_panel import MonitoringPanel
+from collections import deque
+from mux import MuxClient
+from reconnect import Backoff
+from ssh_profiles import DEFAULT_PROFILE, PROFILES, get_profile
+from vt_screen import DEFAULT_COLS, DEFAULT_ROWS, DEFAULT_SCROLLBACK, FrozenLine, Screen, line_runs
+# paramiko (via connection_pool) and monitoring_panel (matplotlib) are imported
+# when first needed: a mux terminal never loads paramiko, and the charts load
+# after the window is up instead of in front of it.
 
-# Setup logging
-logging.basicConfig(filename='terminal_debug.log', level=logging.DEBUG, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+STARTUP_TARGET_MS = 300
+
+class StartupProfiler:
+    """Milestones in ms since terminal.py started executing"""
+    def __init__(self):
+        self.marks = [("imports", (time.perf_counter() - STARTUP_T0) * 1000)]
+    
+    def mark(self, name):
+        if name not in dict(self.marks):
+            self.marks.append((name, (time.perf_counter() - STARTUP_T0) * 1000))
+    
+    def report(self):
+        lines = ["startup profile (ms since terminal.py start):"]
+        for name, ms in self.marks:
+            lines.append(f"  {name:<16}{ms:8.1f}")
+        prompt = dict(self.marks).get("prompt")
+        if prompt is not None:
+            verdict = "OK" if prompt <= STARTUP_TARGET_MS else "SLOW"
+            lines.append(f"  prompt target {STARTUP_TARGET_MS} ms: {verdict}")
+        heavy = [m for m in ("paramiko", "matplotlib") if m in sys.modules]
+        lines.append(f"  heavy modules loaded: {', '.join(heavy) or 'none'}")
+        return "\n".join(lines)
 
 class ModernTheme:
     BG = "#1E1E1E"       # Main background
@@ -29,10 +58,15 @@ class ModernTheme:
 
 class AnsiColorText(tk.Text):
     """Text widget with ANSI color support and blinking cursor"""
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, rows=DEFAULT_ROWS, cols=DEFAULT_COLS, scrollback=DEFAULT_SCROLLBACK, **kwargs):
         super().__init__(*args, **kwargs)
-        self.ansi_regex = re.compile(r'(\x1b\[[\?]?[0-9;]*[a-zA-Z]|\x08|\r|\n|\x07)')
-        self.current_tags = set()
+        # The shell's output goes into a VT screen model; write() only redraws what changed
+        self.screen = Screen(rows, cols, scrollback)
+        self.screen_top = 1     # widget line of the screen's first row; lines above it are scrollback
+        self.scrollback = scrollback
+        self.history = deque(maxlen=scrollback)     # FrozenLines of the scrollback, oldest first
+        self.trim_batch = max(1, scrollback // 10)
+        self.insert("1.0", "\n" * (rows - 1))
         
         self.tag_configure("bold", font=("Consolas", 11, "bold"))
         for code, color in ModernTheme.ANSI_COLORS.items():
@@ -40,9 +74,12 @@ class AnsiColorText(tk.Text):
             self.tag_configure(f"fg_{90+code}", foreground=color)
             self.tag_configure(f"bg_{40+code}", background=color)
             self.tag_configure(f"bg_{100+code}", background=color)
+        # Reverse video on default colours
+        self.tag_configure("rev_fg", foreground=ModernTheme.BG)
+        self.tag_configure("rev_bg", background=ModernTheme.FG)
         
-        # Initialize terminal cursor at the end
-        self.mark_set("term_cursor", "end-1c")
+        # Initialize terminal cursor at the top of the screen
+        self.mark_set("term_cursor", "1.0")
         self.mark_gravity("term_cursor", tk.RIGHT)
         
         # Cursor Visuals - Green block cursor using a Frame
@@ -123,163 +160,272 @@ class AnsiColorText(tk.Text):
         # Restart blinking cycle from 'on' state
         self.blink_job = self.after(500, self.blink_cursor)
     
+    def feed(self, text):
+        """Update the screen model only; render() shows the result"""
+        self.screen.feed(text)
+    
     def write(self, text):
-        self.configure(state='normal')
+        self.screen.feed(text)
+        self.render()
+    
+    def render(self):
+        """Push the screen model's changes into the widget.
         
-        parts = self.ansi_regex.split(text)
-        for part in parts:
-            if not part: continue
-            
-            if part == '\x08':
-                if not self.compare("term_cursor", "==", "1.0"):
-                    self.mark_set("term_cursor", "term_cursor-1c")
-                continue
-            
-            if part == '\r':
-                self.mark_set("term_cursor", "term_cursor linestart")
-                continue
-            
-            if part == '\n':
-                current_line = int(self.index("term_cursor").split('.')[0])
-                last_line = int(self.index("end-1c").split('.')[0])
-                if current_line >= last_line:
-                    self.mark_set("term_cursor", "end-1c")
-                    self.insert("term_cursor", "\n")
-                else:
-                    self.mark_set("term_cursor", "term_cursor + 1 lines")
-                continue
-            
-            if part == '\x07': continue
-            
-            if part.startswith('\x1b['):
-                code_body = part[2:]
-                if code_body.endswith('K'):
-                    if code_body == 'K' or code_body == '0K':
-                        self.delete("term_cursor", "term_cursor lineend")
-                    elif code_body == '1K':
-                        self.delete("term_cursor linestart", "term_cursor")
-                    elif code_body == '2K':
-                        self.delete("term_cursor linestart", "term_cursor lineend")
-                    continue
-                
-                if code_body.endswith('J'):
-                    if code_body == '2J':
-                        self.delete("1.0", "end")
-                        self.mark_set("term_cursor", "1.0")
-                    continue
-
-                if code_body.endswith('P'): # Delete Character (DCH)
-                    try:
-                        count = int(code_body[:-1]) if code_body[:-1] else 1
-                        self.delete("term_cursor", f"term_cursor +{count} chars")
-                    except: pass
-                    continue
-                    
-                if code_body.endswith('X'): # Erase Character (ECH)
-                    try:
-                        count = int(code_body[:-1]) if code_body[:-1] else 1
-                        # Replace with spaces
-                        self.insert("term_cursor", " " * count)
-                        self.delete("term_cursor", f"term_cursor +{count} chars")
-                        # Move cursor back? No, ECH usually doesn't move cursor, but insert moves it.
-                        # Actually ECH just overwrites with space and doesn't move cursor.
-                        # So we insert spaces then move cursor back.
-                        self.mark_set("term_cursor", f"term_cursor -{count} chars")
-                    except: pass
-                    continue
-
-                if code_body.endswith('@'): # Insert Character (ICH)
-                    try:
-                        count = int(code_body[:-1]) if code_body[:-1] else 1
-                        self.insert("term_cursor", " " * count)
-                        self.mark_set("term_cursor", f"term_cursor -{count} chars")
-                    except: pass
-                    continue
-
-                if code_body.endswith('H') or code_body.endswith('f'): # Cursor Position
-                    try:
-                        parts = code_body[:-1].split(';')
-                        row = int(parts[0]) if parts[0] else 1
-                        col = int(parts[1]) if len(parts) > 1 and parts[1] else 1
-                        # Tkinter text is 1-based line, 0-based char. ANSI is 1-based both.
-                        self.mark_set("term_cursor", f"{row}.{col-1}")
-                    except: pass
-                    continue
-                
-                if code_body.startswith('?'): continue
-                
-                if code_body.endswith('A'):
-                    try:
-                        rows = int(code_body[:-1]) if code_body[:-1] else 1
-                        self.mark_set("term_cursor", f"term_cursor -{rows} lines")
-                    except: pass
-                elif code_body.endswith('B'):
-                    try:
-                        rows = int(code_body[:-1]) if code_body[:-1] else 1
-                        self.mark_set("term_cursor", f"term_cursor +{rows} lines")
-                    except: pass
-                elif code_body.endswith('C'):
-                    try:
-                        cols = int(code_body[:-1]) if code_body[:-1] else 1
-                        self.mark_set("term_cursor", f"term_cursor +{cols} chars")
-                    except: pass
-                elif code_body.endswith('D'):
-                    try:
-                        cols = int(code_body[:-1]) if code_body[:-1] else 1
-                        self.mark_set("term_cursor", f"term_cursor -{cols} chars")
-                    except: pass
-                
-                if code_body.endswith('m'):
-                    params_str = code_body[:-1]
-                    params = [int(p) for p in params_str.split(';') if p.isdigit()]
-                    if not params: params = [0]
-                    for p in params:
-                        if p == 0:
-                            self.current_tags.clear()
-                        elif p == 1:
-                            self.current_tags.add("bold")
-                        elif 30 <= p <= 37:
-                            self.current_tags = {t for t in self.current_tags if not t.startswith("fg_")}
-                            self.current_tags.add(f"fg_{p}")
-                        elif 40 <= p <= 47:
-                            self.current_tags = {t for t in self.current_tags if not t.startswith("bg_")}
-                            self.current_tags.add(f"bg_{p}")
-                        elif 90 <= p <= 97:
-                            self.current_tags = {t for t in self.current_tags if not t.startswith("fg_")}
-                            self.current_tags.add(f"fg_{p}")
-                        elif 100 <= p <= 107:
-                            self.current_tags = {t for t in self.current_tags if not t.startswith("bg_")}
-                            self.current_tags.add(f"bg_{p}")
-                continue
-            
-            for char in part:
-                # Robust VT100 logic:
-                # Check if we are at the end of the line using 'lineend' modifier
-                # This is more reliable than get() which might return newline char
-                
-                is_at_line_end = self.compare("term_cursor", "==", "term_cursor lineend")
-                
-                if is_at_line_end:
-                    # At end of line - insert (append)
-                    self.insert("term_cursor", char, tuple(self.current_tags))
-                else:
-                    # In middle of line - check if next char is newline (just in case)
-                    next_char = self.get("term_cursor")
-                    if next_char == "\n":
-                        self.insert("term_cursor", char, tuple(self.current_tags))
-                    else:
-                        # Overwrite
-                        self.delete("term_cursor")
-                        self.insert("term_cursor", char, tuple(self.current_tags))
+        Widget layout: scrollback lines, then the screen's rows starting at
+        line screen_top. Lines that scrolled off the screen simply stay where
+        they are and become scrollback, so a scroll costs one append instead
+        of a redraw; only dirty lines are rewritten. Everything is addressed
+        relative to screen_top, so trimming old scrollback is one delete at
+        the top and a subtraction.
+        """
+        screen = self.screen
+        rows = screen.rows
+        scrolled, k = screen.take_scrolled()
+        self.history.extend(scrolled)
+        top = self.screen_top
+        cursor_line = screen.lines[screen.y]
+        cursor_col = screen.cursor_column()
+        if cursor_line.rendered < cursor_col:
+            cursor_line.dirty = True    # pad the line out to the cursor
+        
+        self.configure(state='normal')
+        if k > len(scrolled) or k > self.scrollback:
+            # More scrolled by than we keep: rebuild from the scrollback ring instead of appending and trimming
+            self.rebuild(cursor_line, cursor_col)
+        else:
+            # Scrolled-off lines that are still the widget's old screen rows: fix up in place
+            self.rewrite(top, scrolled[:rows], cursor_line, cursor_col)
+            # Everything below the old screen is new: one insert at the end
+            new = scrolled[rows:] + screen.lines[max(0, rows - k):] if k else []
+            if new:
+                args = []
+                for line in new:
+                    args.append("\n")
+                    args.append(())
+                    args += self.line_args(line, cursor_line, cursor_col)
+                self.insert("end-1c", *args)
+            self.screen_top = top + k
+            # Rows that were already on screen
+            self.rewrite(self.screen_top, screen.lines[:rows - k] if k else screen.lines, cursor_line, cursor_col)
+            self.trim()
         
+        self.mark_set("term_cursor", f"{self.screen_top + screen.y}.{cursor_col}")
         self.see("term_cursor")
         self.mark_set("insert", "term_cursor")
         self.configure(state='disabled')
         self.force_cursor_update()
+    
+    def trim(self):
+        """Drop scrollback beyond the limit, in batches so it is one delete per trim_batch lines"""
+        excess = self.screen_top - 1 - self.scrollback
+        if excess >= self.trim_batch:
+            self.delete("1.0", f"{excess + 1}.0")
+            self.screen_top -= excess
+    
+    def rebuild(self, cursor_line, cursor_col):
+        args = []
+        for line in self.history:
+            args += line.insert_args()
+            args += ["\n", ()]
+        for i, line in enumerate(self.screen.lines):
+            if i:
+                args += ["\n", ()]
+            args += self.line_args(line, cursor_line, cursor_col)
+        self.delete("1.0", "end")
+        if args:
+            self.insert("1.0", *args)
+        self.screen_top = len(self.history) + 1
+    
+    def line_args(self, line, cursor_line, cursor_col):
+        if line.__class__ is FrozenLine:
+            line.dirty = False
+            return line.insert_args()
+        length = line.content_length()
+        args = line_runs(line, length)
+        rendered = length - line.chars[:length].count('')
+        if line is cursor_line and rendered < cursor_col:
+            args += [" " * (cursor_col - rendered), ()]
+            rendered = cursor_col
+        line.rendered = rendered
+        line.dirty = False
+        return args
+    
+    def rewrite(self, first, lines, cursor_line, cursor_col):
+        """Rewrite the dirty ones of `lines` (widget lines first, first+1, ...), one call per dirty block"""
+        i, n = 0, len(lines)
+        while i < n:
+            if not lines[i].dirty:
+                i += 1
+                continue
+            j = i
+            args = []
+            while j < n and lines[j].dirty:
+                if j > i:
+                    args += ["\n", ()]
+                args += self.line_args(lines[j], cursor_line, cursor_col)
+                j += 1
+            self.delete(f"{first + i}.0", f"{first + j - 1}.end")
+            if args:
+                self.insert(f"{first + i}.0", *args)
+            i = j
+
+
+class ShellTab:
+    """One shell in a TerminalWindow: its own channel, emulator widget and reader thread.
+    Output for a tab that is not on screen still goes through the screen
+    model, which keeps at most `scrollback` lines of it, and is rendered
+    when the tab is selected.
+    
+    The reader thread never renders: it queues what it receives and asks for
+    a frame, and each frame drains the queue into one render pass, so bulk
+    output costs at most FRAME_RATE renders a second however many chunks
+    arrive. Small output (echo, a prompt) and the first reply after a
+    keystroke are rendered right away instead of waiting for the next frame."""
+    FRAME_RATE = 60
+    FRAME_INTERVAL = 1 / FRAME_RATE
+    IMMEDIATE_CHARS = 256           # queued output up to this size renders without waiting for a frame
+    READ_SIZE = 65536               # recv returns whatever is buffered, up to this much
+    
+    def __init__(self, window, number, scrollback=DEFAULT_SCROLLBACK):
+        self.window = window
+        self.title = f"shell {number}"
+        self.frame = tk.Frame(window.notebook, bg=ModernTheme.BG)
+        self.text_area = AnsiColorText(self.frame, state='normal',  # Start in normal state 
+                                       bg=ModernTheme.BG, fg=ModernTheme.FG, 
+                                       font=("Consolas", 11), 
+                                       insertbackground="white",
+                                       selectbackground=ModernTheme.SELECTION,
+                                       bd=0, highlightthickness=0,
+                                       scrollback=scrollback)
+        self.text_area.pack(side=tk.LEFT, expand=True, fill='both')
+        self.channel = None
+        self.transport = None   # what served the channel: tells "shell exited" from "connection lost"
+        self.input_buffer = ""
+        self.pending = False    # background output the widget hasn't shown yet
+        self.visible = False
+        self.running = True
+        self.incoming = deque()         # reader thread -> Tk thread
+        self.incoming_size = 0
+        self.frame_lock = threading.Lock()
+        self.frame_scheduled = False
+        self.last_frame = 0.0
+        self.input_pending = False      # a key went out since the last frame; its echo is interactive
+        window.bind_keys(self.text_area)
+    
+    def open(self):
+        self.channel = self.window.open_channel()
+        self.transport = self.channel.get_transport()
+    
+    def start(self):
+        threading.Thread(target=self.receive_data, daemon=True).start()
+    
+    def receive_data(self):
+        while self.running and self.window.running:
+            channel = self.channel
+            # Stateful: a multi-byte character split across two reads is decoded once both halves are in
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            try:
+                while self.running and channel:
+                    # Blocks until output arrives or the channel closes: an idle shell costs no wakeups
+                    data = channel.recv(self.READ_SIZE)
+                    if not data:
+                        break
+                    text = decoder.decode(data)
+                    if text:
+                        self.receive(text)
+            except: pass
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                self.receive(tail)
+            if not self.running or not self.window.reconnect(self):
+                break
+    
+    def receive(self, data):
+        """Reader thread: queue output and make sure a frame is coming"""
+        with self.frame_lock:
+            self.incoming.append(data)
+            self.incoming_size += len(data)
+            if self.frame_scheduled:
+                return
+            self.frame_scheduled = True
+            since = time.monotonic() - self.last_frame
+            if self.input_pending or (self.incoming_size <= self.IMMEDIATE_CHARS and since >= self.FRAME_INTERVAL):
+                delay = 0
+            else:
+                delay = max(0, self.FRAME_INTERVAL - since)
+        self.window.after(int(delay * 1000), self.frame)
+    
+    def frame(self):
+        """Tk thread: everything received since the last frame, in one render"""
+        with self.frame_lock:
+            parts = list(self.incoming)
+            self.incoming.clear()
+            self.incoming_size = 0
+            self.frame_scheduled = False
+            self.input_pending = False
+            self.last_frame = time.monotonic()
+        if parts:
+            self.output("".join(parts), True)
+    
+    def send(self, data):
+        self.input_pending = True
+        if self.window.engine:
+            self.window.engine.mark_interactive()
+        self.channel.send(data)
+    
+    def output(self, data, remote=False):
+        """Tk thread: render, or keep for later when the tab is in the background"""
+        if not self.running:
+            return
+        if not remote:
+            data = data.replace("\n", "\r\n")    # our own notices; the pty already sends CRLF
+        if self.visible:
+            self.text_area.write(data)
+            if remote:
+                self.window.note_output()
+            return
+        if not self.pending:
+            self.pending = True
+            self.window.notebook.tab(self.frame, text=f"● {self.title}")
+        self.text_area.feed(data)
+    
+    def show(self):
+        self.visible = True
+        self.window.notebook.tab(self.frame, text=self.title)
+        if self.pending:
+            self.pending = False
+            self.text_area.render()
+        self.text_area.stop_blink()
+        self.text_area.start_blink()
+        self.text_area.focus_set()
+    
+    def hide(self):
+        self.visible = False
+        self.text_area.stop_blink()
+    
+    def close(self):
+        self.running = False
+        self.text_area.stop_blink()
+        if self.channel:
+            try: self.channel.close()
+            except: pass
+
 
-class TerminalWindow(tk.Tk):
-    def __init__(self, ip, port, user, password, theme_mode="dark", command=None):
-        super().__init__()
+class TerminalWindow(tk.Toplevel):
+    """One shell window. Standalone (python terminal.py) it owns a hidden Tk root;
+    inside the GUI it is a Toplevel of the GUI's root and gets an existing
+    `client` (a pool lease it may close) to open its shell on, and the GUI's
+    ControlMaster as `control` for the host list."""
+    def __init__(self, ip, port, user, password, theme_mode="dark", command=None, mux=None, session=None, profile=None,
+                 startup=None, startup_exit=False, master=None, client=None, control=None,
+                 scrollback=DEFAULT_SCROLLBACK):
+        self.own_root = None
+        if master is None:
+            master = self.own_root = tk.Tk()
+            master.withdraw()
+        super().__init__(master)
+        self.startup = startup
+        self.startup_exit = startup_exit
         self.title("SSH Terminal")
         self.geometry("1000x700")
         self.configure(bg=ModernTheme.BG)
@@ -289,6 +435,20 @@ class TerminalWindow(tk.Tk):
         self.user = user
         self.password = password
         self.command = command
+        self.theme_mode = theme_mode
+        self.mux = mux
+        self.session = session    # fleet session key on the mux master, None for its own connection
+        self.profile = profile    # ssh_profiles.ConnectionProfile for direct (non-mux) logins
+        conn = getattr(client, 'conn', None)
+        if profile is None and conn is not None:
+            # Reconnects re-lease with the profile the shared connection was made with
+            self.profile = conn.profile
+        # ... and through the same bastions (jump.JumpHost chain, outermost first)
+        self.jump = list(conn.jump) if conn is not None else []
+        self.control = control    # in-process ControlMaster (GUI terminals); hosts() without the socket
+        # Forwarding loop on this window's transport: keystrokes make its bulk mappings yield
+        self.engine = control.engine if control is not None and not session else None
+        self.scrollback = scrollback    # lines kept above the screen in each tab
         
         # Sidebar
         self.sidebar = tk.Frame(self, bg=ModernTheme.SIDEBAR_BG, width=200)
@@ -298,19 +458,16 @@ class TerminalWindow(tk.Tk):
         tk.Label(self.sidebar, text="主机列表", bg=ModernTheme.SIDEBAR_BG, fg="#555555", 
                 font=("Microsoft YaHei UI", 9, "bold"), anchor="w").pack(fill=tk.X, padx=15, pady=(20, 5))
         
-        self.host_item = tk.Frame(self.sidebar, bg=ModernTheme.SELECTION, height=40)
-        self.host_item.pack(fill=tk.X, padx=5)
-        self.host_item.pack_propagate(False)
-        
-        tk.Label(self.host_item, text="⬤", fg="#0DBC79", bg=ModernTheme.SELECTION, 
-                font=("Segoe UI", 8)).pack(side=tk.LEFT, padx=(10, 5))
-        tk.Label(self.host_item, text=f"{user}@{ip}", fg="white", bg=ModernTheme.SELECTION, 
-                font=("Microsoft YaHei UI", 10)).pack(side=tk.LEFT)
+        self.host_list = tk.Frame(self.sidebar, bg=ModernTheme.SIDEBAR_BG)
+        self.host_list.pack(fill=tk.X)
+        self.add_host_item(f"{user}@{ip}", True, True)
         
         tk.Label(self.sidebar, text="服务器监控", bg=ModernTheme.SIDEBAR_BG, fg="#555555", 
                 font=("Microsoft YaHei UI", 9, "bold"), anchor="w").pack(fill=tk.X, padx=15, pady=(20, 5))
-        self.monitoring_panel = MonitoringPanel(self.sidebar, bg=ModernTheme.SIDEBAR_BG)
-        self.monitoring_panel.pack(fill='both', expand=True, padx=5, pady=5)
+        # Filled by load_monitoring_panel once the window has painted
+        self.monitor_frame = tk.Frame(self.sidebar, bg=ModernTheme.SIDEBAR_BG)
+        self.monitor_frame.pack(fill='both', expand=True, padx=5, pady=5)
+        self.monitoring_panel = None
         
         # Main Area
         self.main_area = tk.Frame(self, bg=ModernTheme.BG)
@@ -323,93 +480,331 @@ class TerminalWindow(tk.Tk):
         tk.Label(self.header, text=f" {user}@{ip} ", bg=ModernTheme.BG, fg="white", 
                 font=("Microsoft YaHei UI", 10, "bold")).pack(side=tk.LEFT, padx=10, pady=5)
         
+        for text, cmd in (("✕", lambda: self.close_tab()), ("＋", lambda: self.new_tab())):
+            btn = tk.Label(self.header, text=text, bg=ModernTheme.BG, fg="#888888", cursor="hand2",
+                           font=("Segoe UI", 11))
+            btn.pack(side=tk.RIGHT, padx=5)
+            btn.bind("<Button-1>", lambda e, c=cmd: c())
+        
         self.term_frame = tk.Frame(self.main_area, bg=ModernTheme.BG)
         self.term_frame.pack(expand=True, fill='both', padx=10, pady=(0, 10))
         
         # Scrollbar removed as per user request
         
-        self.text_area = AnsiColorText(self.term_frame, state='normal',  # Start in normal state 
-                                       bg=ModernTheme.BG, fg=ModernTheme.FG, 
-                                       font=("Consolas", 11), 
-                                       insertbackground="white",
-                                       selectbackground=ModernTheme.SELECTION,
-                                       bd=0, highlightthickness=0)
-        self.text_area.pack(side=tk.LEFT, expand=True, fill='both')
-        self.text_area.focus_force()
-        
-        # Start cursor blinking immediately
-        self.text_area.start_blink()
+        style = ttk.Style(self)
+        style.configure("Terminal.TNotebook", background=ModernTheme.BG, borderwidth=0)
+        style.configure("Terminal.TNotebook.Tab", background=ModernTheme.SIDEBAR_BG, foreground=ModernTheme.FG,
+                        padding=(12, 3), borderwidth=0)
+        style.map("Terminal.TNotebook.Tab", background=[("selected", ModernTheme.BG)],
+                  foreground=[("selected", "white")])
+        self.notebook = ttk.Notebook(self.term_frame, style="Terminal.TNotebook")
+        self.notebook.pack(expand=True, fill='both')
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
         
-        self.client = None
-        self.channel = None
+        # Every tab is another shell channel on the same connection
+        self.client = client
+        self.client_lock = threading.Lock()
+        self.reconnect_lock = threading.Lock()
         self.running = True
-        self.input_buffer = ""
-        
-        self.text_area.bind("<KeyPress>", self.on_key)
-        self.text_area.bind("<Return>", self.on_enter)
-        self.text_area.bind("<BackSpace>", self.on_backspace)
-        self.text_area.bind("<Up>", lambda e: self.send_control_sequence("\x1b[A"))
-        self.text_area.bind("<Down>", lambda e: self.send_control_sequence("\x1b[B"))
-        self.text_area.bind("<Right>", lambda e: self.send_control_sequence("\x1b[C"))
-        self.text_area.bind("<Left>", lambda e: self.send_control_sequence("\x1b[D"))
-        self.text_area.bind("<Home>", lambda e: self.send_control_sequence("\x1b[H"))
-        self.text_area.bind("<End>", lambda e: self.send_control_sequence("\x1b[F"))
-        self.text_area.bind("<Control-c>", self.send_interrupt)
-        self.text_area.bind("<Control-v>", self.paste_from_clipboard)
-        self.text_area.bind("<Button-3>", self.show_context_menu)
-        self.text_area.bind("<Button-1>", self.on_mouse_click)
+        self.tabs = {}          # str(tab.frame) -> ShellTab
+        self.tab_count = 0
+        self.new_tab(command)
         
-        self.connect_thread = threading.Thread(target=self.connect_ssh, daemon=True)
-        self.connect_thread.start()
+        if self.mux or self.control:
+            self.after(500, self.refresh_hosts)
         
         self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.bind("<Map>", self.on_first_map)
+        if self.startup:
+            self.startup.mark("window built")
+    
+    def on_first_map(self, event):
+        if event.widget is not self:
+            return
+        self.unbind("<Map>")
+        # after_idle runs once the pending redraws are done, i.e. the window is actually painted
+        self.after_idle(self.on_first_paint)
+    
+    def on_first_paint(self):
+        if self.startup:
+            self.startup.mark("first paint")
+        self.after(50, self.load_monitoring_panel)
+    
+    def load_monitoring_panel(self):
+        """Import matplotlib off the Tk thread, then build the panel on it"""
+        def load():
+            try:
+                import monitoring_panel
+            except Exception as e:
+                logging.warning(f"Monitoring panel unavailable: {e}")
+                self.after(0, self.monitoring_unavailable, str(e))
+                return
+            self.after(0, self.build_monitoring_panel, monitoring_panel.MonitoringPanel)
+        threading.Thread(target=load, daemon=True).start()
+    
+    def build_monitoring_panel(self, panel_class):
+        if not self.running:
+            return
+        self.monitoring_panel = panel_class(self.monitor_frame, bg=ModernTheme.SIDEBAR_BG)
+        self.monitoring_panel.pack(fill='both', expand=True)
+        if self.startup:
+            self.startup.mark("monitor ready")
+        if self.channel:
+            self.start_monitoring()
+    
+    def monitoring_unavailable(self, error):
+        tk.Label(self.monitor_frame, text=f"监控不可用\n{error}", bg=ModernTheme.SIDEBAR_BG, fg="#666666",
+                 font=("Microsoft YaHei UI", 8), wraplength=180, justify=tk.LEFT).pack(anchor="w")
+    
+    def start_monitoring(self):
+        if self.monitoring_panel and self.channel and not self.monitoring_panel.monitoring:
+            self.monitoring_panel.start_monitoring(self.channel)
+    
+    def bind_keys(self, text_area):
+        text_area.bind("<KeyPress>", self.on_key)
+        text_area.bind("<Return>", self.on_enter)
+        text_area.bind("<BackSpace>", self.on_backspace)
+        text_area.bind("<Up>", lambda e: self.send_control_sequence("\x1b[A"))
+        text_area.bind("<Down>", lambda e: self.send_control_sequence("\x1b[B"))
+        text_area.bind("<Right>", lambda e: self.send_control_sequence("\x1b[C"))
+        text_area.bind("<Left>", lambda e: self.send_control_sequence("\x1b[D"))
+        text_area.bind("<Home>", lambda e: self.send_control_sequence("\x1b[H"))
+        text_area.bind("<End>", lambda e: self.send_control_sequence("\x1b[F"))
+        text_area.bind("<Control-c>", self.send_interrupt)
+        text_area.bind("<Control-v>", self.paste_from_clipboard)
+        text_area.bind("<Control-T>", lambda e: self.new_tab() or "break")     # Ctrl+Shift+T
+        text_area.bind("<Control-W>", lambda e: self.close_tab() or "break")   # Ctrl+Shift+W
+        text_area.bind("<Button-3>", self.show_context_menu)
+        text_area.bind("<Button-1>", self.on_mouse_click)
+    
+    @property
+    def current(self):
+        if not self.tabs:
+            return None
+        return self.tabs.get(self.notebook.select())
+    
+    # Key handlers act on the selected tab
+    @property
+    def text_area(self):
+        return self.current.text_area
+    
+    @property
+    def channel(self):
+        tab = self.current
+        return tab.channel if tab else None
+    
+    @channel.setter
+    def channel(self, value):
+        if self.current:
+            self.current.channel = value
+    
+    @property
+    def input_buffer(self):
+        return self.current.input_buffer
+    
+    @input_buffer.setter
+    def input_buffer(self, value):
+        self.current.input_buffer = value
     
-    def connect_ssh(self):
+    def new_tab(self, command=None):
+        self.tab_count += 1
+        tab = ShellTab(self, self.tab_count, self.scrollback)
+        self.tabs[str(tab.frame)] = tab
+        self.notebook.add(tab.frame, text=tab.title)
+        self.notebook.select(tab.frame)
+        threading.Thread(target=self.connect_tab, args=(tab, command), daemon=True).start()
+        return tab
+    
+    def close_tab(self, tab=None):
+        tab = tab or self.current
+        if tab is None:
+            return
+        tab.close()
+        self.tabs.pop(str(tab.frame), None)
+        self.notebook.forget(tab.frame)
+        tab.frame.destroy()
+        if not self.tabs:
+            self.on_close()
+    
+    def on_tab_changed(self, event=None):
+        current = self.current
+        for tab in self.tabs.values():
+            if tab is current:
+                tab.show()
+            elif tab.visible:
+                tab.hide()
+    
+    def connect_tab(self, tab, command=None):
         try:
-            self.update_terminal(f"正在连接到 {self.user}@{self.ip}...\n")
-            self.client = paramiko.SSHClient()
-            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.client.connect(self.ip, port=self.port, username=self.user, password=self.password)
-            self.client.get_transport().set_keepalive(30)
-            
-            self.channel = self.client.invoke_shell(term='xterm-256color', width=120, height=40)
-            self.update_terminal("已连接。\n")
-            
-            self.channel.send("\n")
-            self.channel.send("export LANG=zh_CN.UTF-8\n")
+            self.after(0, tab.output, f"正在连接到 {self.user}@{self.ip}...\n")
+            tab.open()
+            self.after(0, tab.output, "已连接。\n")
             
-            if self.command:
-                self.update_terminal(f"正在执行: {self.command}\n")
-                self.channel.send(self.command + "\n")
+            if command:
+                self.after(0, tab.output, f"正在执行: {command}\n")
+                tab.channel.send(command + "\n")
             
-            self.recv_thread = threading.Thread(target=self.receive_data, daemon=True)
-            self.recv_thread.start()
+            tab.start()
             
-            self.after(1000, lambda: self.monitoring_panel.start_monitoring(self.channel))
+            if self.startup:
+                self.startup.mark("shell open")
+            self.after(1000, self.start_monitoring)
         except Exception as e:
-            self.update_terminal(f"连接失败: {str(e)}\n")
+            self.after(0, tab.output, f"连接失败: {str(e)}\n")
     
-    def update_terminal(self, data):
-        self.text_area.write(data)
+    def add_host_item(self, label, active, current, host=None):
+        bg = ModernTheme.SELECTION if current else ModernTheme.SIDEBAR_BG
+        item = tk.Frame(self.host_list, bg=bg, height=40)
+        item.pack(fill=tk.X, padx=5)
+        item.pack_propagate(False)
+        
+        dot = tk.Label(item, text="⬤", fg="#0DBC79" if active else "#CD3131", bg=bg, 
+                font=("Segoe UI", 8))
+        dot.pack(side=tk.LEFT, padx=(10, 5))
+        name = tk.Label(item, text=label, fg="white", bg=bg, 
+                font=("Microsoft YaHei UI", 10))
+        name.pack(side=tk.LEFT)
+        if host is not None and not current:
+            # Double-click another session to open its own terminal window
+            for w in (item, dot, name):
+                w.bind("<Double-Button-1>", lambda e, h=host: self.open_host(h))
     
-    def receive_data(self):
+    def refresh_hosts(self):
+        """Sessions of the GUI's mux master: its own connection plus fleet hosts"""
+        source = self.mux or self.control
+        if not self.running or not source:
+            return
+        def fetch():
+            try:
+                hosts = source.hosts()
+            except Exception as e:
+                logging.warning(f"Host list refresh failed: {e}")
+                return
+            self.after(0, self.render_hosts, hosts)
+        threading.Thread(target=fetch, daemon=True).start()
+        self.after(5000, self.refresh_hosts)
+    
+    def render_hosts(self, hosts):
+        for w in self.host_list.winfo_children():
+            w.destroy()
+        for h in hosts:
+            current = (h['key'] or None) == self.session
+            label = h['label'] or f"{self.user}@{self.ip}"
+            if h.get('handshake_ms') is not None:
+                label += f"  {h['handshake_ms']}ms"
+            self.add_host_item(label, h['active'], current, h)
+    
+    def open_host(self, host):
+        if self.control:
+            self.open_host_window(host)
+            return
+        args = [sys.executable, os.path.abspath(__file__), "-t", self.theme_mode]
+        if host['key']:
+            args += ["-u", host['user'], "-h", host['host'], "-p", str(host['port']), "-s", host['key']]
+        else:
+            args += ["-u", self.user, "-h", self.ip, "-p", str(self.port)]
+        # The mux address/token are inherited through the environment
         try:
-            while getattr(self, 'running', False) and self.channel:
-                if self.channel.recv_ready():
-                    try:
-                        data = self.channel.recv(4096).decode('utf-8', errors='ignore')
-                        if not data: break
-                        self.after(0, self.update_terminal, data)
-                    except: break
-                time.sleep(0.01)
-        except: pass
+            subprocess.Popen(args)
+        except Exception as e:
+            messagebox.showerror("错误", f"无法启动终端: {str(e)}")
+    
+    def open_host_window(self, host):
+        """In-process: another Toplevel on the session's existing connection"""
+        client, password = self.control.resolve(host['key'] or None)
+        if client is None:
+            messagebox.showerror("错误", "该会话已不存在", parent=self)
+            return
+        if host['key']:
+            ip, port, user = host['host'], host['port'], host['user']
+        else:
+            ip, port, user = self.ip, self.port, self.user
+        try:
+            TerminalWindow(ip, port, user, password, self.theme_mode, session=host['key'] or None,
+                           master=self.master, client=client.share(), control=self.control,
+                           scrollback=self.scrollback)
+        except Exception as e:
+            messagebox.showerror("错误", f"无法打开终端: {str(e)}", parent=self)
+    
+    def open_channel(self):
+        """A new shell channel; every tab's shell shares this window's connection"""
+        if self.mux:
+            # Reuse the GUI's authenticated transport: one local round trip, no handshake
+            channel = self.mux.open_shell(term='xterm-256color', width=120, height=40, session=self.session)
+        else:
+            with self.client_lock:
+                # A connection handed in by the GUI, or one an earlier tab set up
+                if not (self.client and self.transport_alive()):
+                    if self.client:
+                        self.client.close()
+                        self.client = None
+                    # Leased from the process pool: a no-op handshake when this process already has one
+                    from connection_pool import shared_pool
+                    self.client = shared_pool().lease(self.ip, self.port, self.user, self.password,
+                                                      profile=self.profile, jump=self.jump or None)
+                channel = self.client.invoke_shell(term='xterm-256color', width=120, height=40)
+        
+        channel.send("\n")
+        channel.send("export LANG=zh_CN.UTF-8\n")
+        return channel
+    
+    def transport_alive(self):
+        if self.mux:
+            return self.mux.is_active(self.session)
+        transport = self.client.get_transport() if self.client else None
+        return bool(transport and transport.is_active())
+    
+    def reconnect(self, tab):
+        """A tab's shell is gone: if its connection went with it, open a new shell with backoff.
+        Tabs reconnect one at a time; the first one re-establishes the connection
+        and the others just open their shell on it."""
+        with self.reconnect_lock:
+            if tab.transport is not None and tab.transport.is_active():
+                # The shell itself ended (exit/logout), nothing to restore
+                self.after(0, tab.output, "\n[会话已结束]\n")
+                return False
+            tab.channel = None
+            self.after(0, tab.output, "\n[连接已断开，正在重连...]\n")
+            backoff = Backoff()
+            start = time.time()
+            while self.running and tab.running:
+                try:
+                    tab.open()
+                    break
+                except Exception as e:
+                    delay = backoff.next_delay()
+                    logging.warning(f"Reconnect attempt {backoff.attempt} failed: {e}; retry in {delay:.1f}s")
+                    time.sleep(delay)
+            else:
+                return False
+        elapsed = time.time() - start
+        self.after(0, tab.output, f"[已重连，耗时 {elapsed:.1f}s]\n")
+        if self.monitoring_panel:
+            self.after(0, self.monitoring_panel.reattach, tab.channel)
+        return True
+    
+    def update_terminal(self, data):
+        if self.current:
+            self.current.output(data)
+    
+    def note_output(self):
+        if self.startup and "prompt" not in dict(self.startup.marks):
+            self.startup.mark("prompt")
+            if self.startup_exit:
+                # Let the prompt actually reach the screen before reporting
+                self.after_idle(self.finish_startup_profile)
+    
+    def finish_startup_profile(self):
+        self.startup.mark("prompt painted")
+        print(self.startup.report(), flush=True)
+        self.on_close()
     
     def on_key(self, event):
         if not self.channel: return "break"
         if len(event.char) > 0 and ord(event.char) >= 32:
             try:
                 self.input_buffer += event.char
-                self.channel.send(event.char)
+                self.current.send(event.char)
             except OSError:
                 self.update_terminal("\n[连接已断开]\n")
                 self.channel = None
@@ -421,31 +816,42 @@ class TerminalWindow(tk.Tk):
             if messagebox.askyesno("危险命令警告", "警告：您即将执行 'rm -rf /*'。\n此操作将删除系统上的所有内容。\n\n您确定要继续吗?", 
                                    icon='warning', default='no'):
                 pwd_check = simpledialog.askstring("密码验证", "请输入您的SSH密码：", show='*', parent=self)
-                if pwd_check != self.password:
+                if not self.check_password(pwd_check):
                     messagebox.showerror("错误", "密码错误。")
                     self.input_buffer = ""
-                    try: self.channel.send("\x03")
+                    try: self.current.send("\x03")
                     except: pass
                     return "break"
             else:
                 self.input_buffer = ""
-                try: self.channel.send("\x03")
+                try: self.current.send("\x03")
                 except: pass
                 return "break"
         try:
-            self.channel.send("\n")
+            self.current.send("\n")
             self.input_buffer = ""
         except OSError:
             self.update_terminal("\n[连接已断开]\n")
             self.channel = None
         return "break"
     
+    def check_password(self, pwd_check):
+        if pwd_check is None:
+            return False
+        if self.mux:
+            # The password only lives in the GUI process
+            try:
+                return self.mux.verify(pwd_check, self.session)
+            except OSError:
+                return False
+        return pwd_check == self.password
+
     def on_backspace(self, event):
         if not self.channel: return "break"
         try:
             if len(self.input_buffer) > 0:
                 self.input_buffer = self.input_buffer[:-1]
-            self.channel.send("\x7f")
+            self.current.send("\x7f")
         except OSError:
             self.update_terminal("\n[连接已断开]\n")
             self.channel = None
@@ -454,7 +860,7 @@ class TerminalWindow(tk.Tk):
     def send_control_sequence(self, seq):
         if not self.channel: return "break"
         try:
-            self.channel.send(seq)
+            self.current.send(seq)
         except OSError:
             self.update_terminal("\n[连接已断开]\n")
             self.channel = None
@@ -463,7 +869,7 @@ class TerminalWindow(tk.Tk):
     def send_interrupt(self, event=None):
         if not self.channel: return "break"
         try:
-            self.channel.send("\x03")
+            self.current.send("\x03")
             self.input_buffer = ""
         except OSError:
             self.update_terminal("\n[连接已断开]\n")
@@ -476,7 +882,7 @@ class TerminalWindow(tk.Tk):
             data = self.clipboard_get()
             if data:
                 self.input_buffer += data
-                self.channel.send(data)
+                self.current.send(data)
         except OSError:
             self.update_terminal("\n[连接已断开]\n")
             self.channel = None
@@ -513,34 +919,65 @@ class TerminalWindow(tk.Tk):
                 diff = click_col - cursor_col
                 if diff > 0:
                     # Move right
-                    self.channel.send("\x1b[C" * diff)
+                    self.current.send("\x1b[C" * diff)
                 elif diff < 0:
                     # Move left
-                    self.channel.send("\x1b[D" * abs(diff))
+                    self.current.send("\x1b[D" * abs(diff))
             
             self.text_area.focus_force()
         except: pass
         return "break"
     
     def on_close(self):
+        if not self.running:
+            return
         self.running = False
-        self.text_area.stop_blink()
-        self.monitoring_panel.stop_monitoring()
+        if self.monitoring_panel:
+            self.monitoring_panel.stop_monitoring()
+        # The transport may be pooled/shared, so the shells have to go explicitly
+        for tab in self.tabs.values():
+            tab.close()
         if self.client:
             try: self.client.close()
             except: pass
         self.destroy()
+        if self.own_root:
+            self.own_root.destroy()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument("-u", "--user", required=True)
     parser.add_argument("-h", "--host", required=True)
     parser.add_argument("-p", "--port", default="22")
-    parser.add_argument("-pwd", "--password", required=True)
+    parser.add_argument("-pwd", "--password", help="Only needed when not started from the GUI (no mux)")
     parser.add_argument("-t", "--theme", default="dark")
     parser.add_argument("-cmd", "--command", help="Initial command to run")
+    parser.add_argument("-s", "--session", help="Fleet session key on the GUI mux (user@host:port)")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=list(PROFILES),
+                        help="Cipher/KEX/compression profile for direct logins")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print import / first paint / prompt timings and exit once the prompt is shown")
+    parser.add_argument("--scrollback", type=int, default=DEFAULT_SCROLLBACK,
+                        help="Lines of history kept per tab (default %(default)s)")
     
     args = parser.parse_args()
+    # delay=True: the log file is only created once something is actually logged
+    handler = logging.FileHandler('terminal_debug.log', encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logging.basicConfig(level=logging.DEBUG, handlers=[handler])
+    
+    mux = MuxClient.from_env()
+    if not mux and args.password is None:
+        parser.error("-pwd is required without a GUI mux")
     
-    app = TerminalWindow(args.host, args.port, args.user, args.password, args.theme, args.command)
+    startup = StartupProfiler()
+    app = TerminalWindow(args.host, args.port, args.user, args.password, args.theme, args.command, mux, args.session,
+                         get_profile(args.profile), startup, args.profile_startup,
+                         scrollback=max(1, args.scrollback))
+    if args.profile_startup:
+        def give_up():
+            print(startup.report(), flush=True)
+            print("  (no prompt within 15 s)", flush=True)
+            app.on_close()
+        app.after(15000, give_up)
     app.mainloop()
@@ -0,0 +1,195 @@
+"""Forwarding tests against bench_forwarding's in-process SSH stand-in server.
+
+    python -m pytest -q test_forwarding.py
+"""
+import socket
+import threading
+import time
+
+import pytest
+
+import forwarding
+from bench_forwarding import StandInServer
+from forwarding import ForwardingEngine, PortForwarder, PortRangeForwarder, RemoteForwarder, SocksForwarder
+
+
+class GreetingService:
+    """Local TCP service that sends `greeting` to every client and closes"""
+    def __init__(self, greeting):
+        self.greeting = greeting
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            sock.sendall(self.greeting)
+            sock.close()
+
+    def close(self):
+        self.listener.close()
+
+
+class EchoService(GreetingService):
+    """Local TCP service that echoes until the client closes"""
+    def __init__(self):
+        super().__init__(b'')
+
+    def serve(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.echo, args=(sock,), daemon=True).start()
+
+    def echo(self, sock):
+        with sock:
+            while True:
+                data = sock.recv(1024)
+                if not data:
+                    return
+                sock.sendall(data)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def fetch(port):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        data = b''
+        while True:
+            chunk = sock.recv(1024)
+            if not chunk:
+                return data
+            data += chunk
+
+
+def free_port_range(n):
+    """First port of n consecutive ports nothing listens on"""
+    for start in range(20000, 60000, n):
+        probes = []
+        try:
+            for port in range(start, start + n):
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                probes.append(s)
+                s.bind(("127.0.0.1", port))
+            return start
+        except OSError:
+            pass
+        finally:
+            for s in probes:
+                s.close()
+    raise RuntimeError("no free port range")
+
+
+@pytest.fixture
+def session():
+    server = StandInServer()
+    client = server.connect()
+    engine = ForwardingEngine()
+    yield client.get_transport(), engine
+    engine.stop()
+    client.close()
+    server.close()
+
+
+def test_two_remote_forwards_on_one_transport(session):
+    transport, engine = session
+    services = [GreetingService(b"first"), GreetingService(b"second")]
+    forwarders = [RemoteForwarder(0, "127.0.0.1", s.port, transport, engine) for s in services]
+    for forwarder in forwarders:
+        forwarder.start()
+    wait_for(lambda: all(f.forwarding for f in forwarders))
+
+    # Each remote port reaches its own local service, not the last one bound
+    assert fetch(forwarders[0].remote_port) == b"first"
+    assert fetch(forwarders[1].remote_port) == b"second"
+
+    # Cancelling one mapping leaves the other working
+    forwarders[0].stop()
+    wait_for(lambda: not forwarders[0].forwarding)
+    time.sleep(0.2)     # the cancel request runs in the engine's worker pool
+    assert fetch(forwarders[1].remote_port) == b"second"
+    for service in services:
+        service.close()
+
+
+def test_connections_spread_over_loops_past_select_limit(session, monkeypatch):
+    monkeypatch.setattr(forwarding, "MAX_REGISTERED", 20)
+    transport, _ = session
+    engine = ForwardingEngine()     # picks up the patched limit
+    service = EchoService()
+    forwarder = PortForwarder(0, "127.0.0.1", service.port, transport, engine)
+    forwarder.start()
+    wait_for(lambda: forwarder.bound_ports)
+    port = next(iter(forwarder.listeners)).getsockname()[1]
+
+    # 30 open relays need 60 sockets, three times what one loop may hold
+    clients = [socket.create_connection(("127.0.0.1", port), timeout=5) for _ in range(30)]
+    for i, sock in enumerate(clients):
+        sock.sendall(b"ping %d" % i)
+        assert sock.recv(1024) == b"ping %d" % i
+    assert len(engine.loops) > 1
+    assert all(len(loop.selector.get_map()) <= 20 for loop in engine.loops)
+    assert forwarder.stats.snapshot()["errors"] == {}
+
+    for sock in clients:
+        sock.close()
+    engine.stop()
+    wait_for(lambda: not any(loop.is_alive() for loop in engine.loops))
+    service.close()
+
+
+def test_port_range_past_select_limit(session, monkeypatch):
+    monkeypatch.setattr(forwarding, "MAX_REGISTERED", 20)
+    transport, _ = session
+    engine = ForwardingEngine()
+    service = GreetingService(b"hello")
+    start = free_port_range(50)
+    forwarder = PortRangeForwarder(start, start + 49, "127.0.0.1", service.port, service.port, transport, engine)
+    forwarder.start()
+    wait_for(lambda: len(forwarder.listener_loops) == 50)
+
+    # 50 listeners, no single loop holds more than 20 sockets
+    assert len(set(forwarder.listener_loops.values())) >= 3
+    for port in (start, start + 25, start + 49):
+        assert fetch(port) == b"hello"
+
+    forwarder.stop()
+    wait_for(lambda: not forwarder.listeners)
+    engine.stop()
+    service.close()
+
+
+def test_stalled_socks_handshake_is_closed(session, monkeypatch):
+    monkeypatch.setattr(forwarding, "SOCKS_HANDSHAKE_TIMEOUT", 0.3)
+    transport, engine = session
+    forwarder = SocksForwarder(0, transport, engine)
+    forwarder.start()
+    wait_for(lambda: forwarder.listener_loops)
+    port = forwarder.server_socket.getsockname()[1]
+
+    # One client never speaks, the other stops halfway through its greeting
+    silent = socket.create_connection(("127.0.0.1", port), timeout=5)
+    partial = socket.create_connection(("127.0.0.1", port), timeout=5)
+    partial.sendall(b"\x05\x02\x00")
+    started = time.monotonic()
+    assert silent.recv(16) == b""
+    assert partial.recv(16) == b""
+    assert time.monotonic() - started < 3
+    assert forwarder.stats.snapshot()["errors"] == {"SocksError": 2}
+    assert not engine.handshakes
+    silent.close()
+    partial.close()
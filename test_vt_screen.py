@@ -0,0 +1,188 @@
+"""Regression tests for the VT screen model and AnsiColorText's damage-tracked rendering.
+
+The renderer runs against FakeText, a stand-in for the handful of tk.Text calls
+it makes, so no display is needed:
+
+    python -m pytest -q test_vt_screen.py
+"""
+import random
+from collections import deque
+
+from terminal import AnsiColorText
+from vt_screen import Screen, attr_tags
+
+
+class FakeText:
+    """Lines of (char, tags) edited through the Text index forms render() uses"""
+    feed = AnsiColorText.feed
+    write = AnsiColorText.write
+    render = AnsiColorText.render
+    trim = AnsiColorText.trim
+    rebuild = AnsiColorText.rebuild
+    line_args = AnsiColorText.line_args
+    rewrite = AnsiColorText.rewrite
+
+    def __init__(self, rows, cols, scrollback=10000):
+        self.screen = Screen(rows, cols, scrollback)
+        self.screen_top = 1
+        self.scrollback = scrollback
+        self.history = deque(maxlen=scrollback)
+        self.trim_batch = max(1, scrollback // 10)
+        self.lines = [[] for _ in range(rows)]
+
+    def pos(self, index):
+        if index in ("end", "end-1c"):
+            return len(self.lines) - 1, len(self.lines[-1])
+        line, col = index.split('.')
+        line = int(line) - 1
+        return line, len(self.lines[line]) if col == "end" else min(int(col), len(self.lines[line]))
+
+    def insert(self, index, *args):
+        line, col = self.pos(index)
+        head, tail = self.lines[line][:col], self.lines[line][col:]
+        out = [head]
+        for i in range(0, len(args), 2):
+            for ch in args[i]:
+                if ch == "\n":
+                    out.append([])
+                else:
+                    out[-1].append((ch, tuple(args[i + 1])))
+        out[-1] += tail
+        self.lines[line:line + 1] = out
+
+    def delete(self, start, end):
+        (l1, c1), (l2, c2) = self.pos(start), self.pos(end)
+        self.lines[l1:l2 + 1] = [self.lines[l1][:c1] + self.lines[l2][c2:]]
+
+    def mark_set(self, *args):
+        pass
+
+    def see(self, *args):
+        pass
+
+    def configure(self, **kwargs):
+        pass
+
+    def force_cursor_update(self):
+        pass
+
+    def cells(self, n):
+        cells = self.lines[n]
+        while cells and cells[-1] == (' ', ()):
+            cells = cells[:-1]      # padding out to the cursor
+        return cells
+
+    def text(self, n):
+        return "".join(ch for ch, _ in self.lines[n]).rstrip()
+
+
+def model_cells(line):
+    cells = []
+    for ch, attr in zip(line.chars[:line.content_length()], line.attrs):
+        cells += [(c, attr_tags(attr)) for c in ch]
+    while cells and cells[-1] == (' ', ()):
+        cells.pop()
+    return cells
+
+
+def check(stream, rows=10, cols=20, scrollback=10000, seed=0, max_chunk=50):
+    """Feed stream in random chunks to the widget and to a reference model; they must agree"""
+    rnd = random.Random(seed)
+    widget = FakeText(rows, cols, scrollback)
+    ref = Screen(rows, cols, 10 ** 6)
+    history = []
+    i = 0
+    while i < len(stream):
+        n = rnd.randint(1, max_chunk)
+        widget.write(stream[i:i + n])
+        ref.feed(stream[i:i + n])
+        history += [line.text.rstrip() for line in ref.take_scrolled()[0]]
+        i += n
+
+    top = widget.screen_top - 1
+    assert len(widget.lines) == top + rows
+    assert min(len(history), scrollback) <= top <= scrollback + widget.trim_batch
+    assert [widget.text(n) for n in range(top)] == history[len(history) - top:]
+    for r, line in enumerate(ref.lines):
+        assert widget.cells(top + r) == model_cells(line), f"row {r}"
+    return widget
+
+
+def test_scrolling_colored_lines():
+    check("".join(f"\x1b[3{i % 8}mline {i}\x1b[0m {'x' * (i % 30)}\r\n" for i in range(300)))
+
+
+def test_progress_bar_redrawn_in_place():
+    check("".join(f"\r[{'#' * (i // 5):<20}] {i}%" for i in range(101)) + "\r\ndone\r\n")
+
+
+def test_cursor_addressing_regions_and_alternate_screen():
+    stream = "pre\r\n" * 15 + "\x1b[?1049h\x1b[2J"
+    for k in range(30):
+        stream += f"\x1b[{k % 10 + 1};{k % 15 + 1}H\x1b[7mX{k}\x1b[m\x1b[K"
+        stream += "\x1b[2;8r\x1b[8;1H\n\x1b[r" + "\x1b[5;1H\x1b[2L\x1b[3M\x1b[3P\x1b[2@ab\x1b[1X"
+    stream += "\x1b[?1049l after\r\n" + "tail\r\n" * 12
+    check(stream)
+
+
+def test_wide_combining_and_split_sequences():
+    check("中文字符测试" * 10 + "\r\né ok\r\n" + "\x1b[31" + "mred\x1b[0m\r\n" + "a" * 55 + "\r\n")
+
+
+def test_wide_character_in_last_column_without_autowrap():
+    screen = Screen(4, 10)
+    screen.feed("\x1b[?7l" + "x" * 12 + "中")
+    assert screen.lines[0].text() == "x" * 8 + "中"
+
+
+ALPHABET = ["a", "hello ", "中", "é", "\r", "\n", "\x08", "\t", "\x1b[", "1", ";", "H", "J", "K", "m", "3",
+            "\x1b[?1049h", "\x1b[?1049l", "\x1b[2;5r", "\x1b[r", "\x1bM", "\x1b7", "\x1b8", "\x1b[L", "\x1b[M",
+            "\x1b[S", "\x1b[T", "\x1b[4@", "\x1b[2P", "\x1b[?7l", "\x1b[?7h", "\x1b[31;1m", "\x1b[7m", "\x1b[0m",
+            "\x1b]0;title\x07", "\x1b(B", "\x1b"]
+
+
+def random_stream(seed, length=600):
+    rnd = random.Random(seed)
+    return "".join(rnd.choice(ALPHABET) for _ in range(length))
+
+
+def test_fuzz_render_matches_model():
+    for seed in range(200):
+        check(random_stream(seed), seed=seed)
+
+
+def test_fuzz_fast_draw_matches_per_character():
+    for seed in range(300):
+        data = random_stream(seed, 400)
+        fast, slow = Screen(8, 17), Screen(8, 17)
+        slow.fast_draw = False
+        rnd = random.Random(seed)
+        i = 0
+        while i < len(data):
+            n = rnd.randint(1, 40)
+            fast.feed(data[i:i + n])
+            slow.feed(data[i:i + n])
+            i += n
+        assert (fast.x, fast.y, fast.wrap_pending) == (slow.x, slow.y, slow.wrap_pending)
+        for a, b in zip(fast.lines, slow.lines):
+            assert a.chars == b.chars and a.attrs == b.attrs
+        assert [l.text for l in fast.take_scrolled()[0]] == [l.text for l in slow.take_scrolled()[0]]
+
+
+def test_scrollback_is_bounded():
+    stream = "".join(f"\x1b[3{i % 8}mline {i}\x1b[0m\r\n" for i in range(3000))
+    for scrollback in (1, 20, 100):
+        for max_chunk in (5, 5000):
+            widget = check(stream, scrollback=scrollback, max_chunk=max_chunk)
+            assert len(widget.history) <= scrollback
+
+
+def test_background_feed_then_render():
+    widget = FakeText(10, 20, 50)
+    for i in range(500):
+        widget.feed(f"line {i}\r\n")
+    widget.render()
+    top = widget.screen_top - 1
+    assert top == 50
+    assert widget.text(top - 1) == "line 490"
+    assert widget.text(top + 8) == "line 499"
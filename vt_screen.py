@@ -0,0 +1,567 @@
+"""VT100/xterm screen model for the terminal widget.
+
+Screen parses the shell's output into a fixed rows x cols grid. Each Line keeps
+its characters in a list and its attributes in an array, plus a dirty flag;
+lines that scroll off the top (main screen, no scroll region) are frozen into
+compact FrozenLine records and handed to the renderer through
+take_scrolled(). At most `scrollback` of them are kept between renders, so a
+tab nobody looks at can be fed indefinitely. AnsiColorText (terminal.py) then only
+rewrites dirty lines of the Tk Text widget, one insert per run of equal
+attributes, instead of editing the widget per character.
+
+Cursor addressing (CUP, VPA, ...) is relative to the top of the screen, not
+to the start of the scrollback. Double-width characters take two cells; the
+right cell holds "" so joining a line's characters gives the text as shown.
+"""
+import re
+import unicodedata
+from array import array
+from collections import deque
+
+DEFAULT_ROWS = 40
+DEFAULT_COLS = 120
+DEFAULT_SCROLLBACK = 10000
+TAB_WIDTH = 8
+MAX_HELD = 4096     # an unterminated escape sequence longer than this is dropped
+
+# Attribute word: fg SGR code (30-37, 90-97; 0 = default) | bg code (40-47, 100-107) << 8 | flags
+FG_MASK = 0xff
+BG_MASK = 0xff00
+BOLD = 1 << 16
+REVERSE = 1 << 17
+
+SEQUENCE = re.compile(
+    r'(\x1b\[[?>=!]?[0-9;:]*[ -/]*[@-~]'     # CSI
+    r'|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)'     # OSC (window title, ...), ignored
+    r'|\x1b[()*+][ -~]'                       # character set designation, ignored
+    r'|\x1b[ -/]*[0-Z\\^-~]'                  # other ESC sequences
+    r'|[\x00-\x1a\x1c-\x1f\x7f])'             # C0 controls except ESC
+)
+CSI = re.compile(r'\x1b\[([?>=!]?)([0-9;:]*)[ -/]*([@-~])')
+NARROW_RUN = re.compile('[\x00-\u02ff]+')    # one cell per character, no combining marks (see char_width)
+
+
+def char_width(ch):
+    if ord(ch) < 0x300:
+        return 1
+    if unicodedata.combining(ch):
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+
+
+class Line:
+    __slots__ = ('chars', 'attrs', 'dirty', 'rendered')
+
+    def __init__(self, cols, attr=0):
+        self.chars = [' '] * cols
+        self.attrs = array('I', [attr]) * cols
+        self.dirty = True
+        self.rendered = 0       # widget chars the renderer last wrote for this line
+
+    def erase(self, start, end, attr=0):
+        n = end - start
+        if n <= 0:
+            return
+        self.chars[start:end] = [' '] * n
+        self.attrs[start:end] = array('I', [attr]) * n
+        self.dirty = True
+
+    def content_length(self):
+        """Cells up to the last one that shows something (trailing blanks are not rendered)"""
+        chars, attrs = self.chars, self.attrs
+        i = len(chars)
+        while i and chars[i - 1] == ' ' and not attrs[i - 1] & (BG_MASK | REVERSE):
+            i -= 1
+        return i
+
+    def text(self):
+        return "".join(self.chars[:self.content_length()])
+
+
+class FrozenLine:
+    """A scrolled-off line: its text plus (end, attr) pairs per attribute run, ~10x smaller than a Line"""
+    __slots__ = ('text', 'runs', 'dirty')
+
+    def __init__(self, line):
+        chars, attrs = line.chars, line.attrs
+        length = line.content_length()
+        self.text = "".join(chars[:length])
+        self.runs = runs = array('I')
+        self.dirty = line.dirty
+        if not length:
+            return
+        pos = 0
+        attr = attrs[0]
+        for i in range(length):
+            if attrs[i] != attr:
+                runs.append(pos)
+                runs.append(attr)
+                attr = attrs[i]
+            pos += len(chars[i])
+        runs.append(pos)
+        runs.append(attr)
+
+    def insert_args(self):
+        args = []
+        text, runs = self.text, self.runs
+        start = 0
+        for i in range(0, len(runs), 2):
+            end = runs[i]
+            args.append(text[start:end])
+            args.append(attr_tags(runs[i + 1]))
+            start = end
+        return args
+
+
+class Screen:
+    fast_draw = True    # False: every character goes through put() (bench_terminal.py compares the two)
+
+    def __init__(self, rows=DEFAULT_ROWS, cols=DEFAULT_COLS, scrollback=DEFAULT_SCROLLBACK):
+        self.rows = rows
+        self.cols = cols
+        self.scrollback = scrollback
+        self.reset()
+
+    def reset(self):
+        self.lines = [Line(self.cols) for _ in range(self.rows)]
+        self.x = 0
+        self.y = 0
+        self.attr = 0
+        self.wrap_pending = False   # cursor sits past the last column until the next printable char
+        self.autowrap = True
+        self.cursor_visible = True
+        self.top = 0
+        self.bottom = self.rows - 1
+        self.saved = (0, 0, 0)
+        self.main = None            # (lines, x, y) of the main screen while the alternate one is up
+        # FrozenLines that left the top since the last take_scrolled(); the renderer keeps
+        # `scrollback` lines above the screen, older ones would only be trimmed again
+        self.scrolled = deque(maxlen=self.scrollback + self.rows)
+        self.scrolled_count = 0
+        self.held = ""              # incomplete escape sequence from the previous feed()
+
+    # --- input ---
+
+    def feed(self, text):
+        if self.held:
+            text = self.held + text
+            self.held = ""
+        parts = SEQUENCE.split(text)
+        last = len(parts) - 1
+        for i, part in enumerate(parts):
+            if not part:
+                continue
+            if i % 2:
+                self.control(part)
+                continue
+            esc = part.find('\x1b')
+            if esc >= 0:
+                if i == last and len(part) - esc < MAX_HELD:
+                    # Sequence split across reads: finish it with the next chunk
+                    self.held = part[esc:]
+                    part = part[:esc]
+                else:
+                    part = part.replace('\x1b', '')
+            if part:
+                self.draw(part)
+
+    def draw(self, text):
+        if not self.fast_draw:
+            for ch in text:
+                self.put(ch)
+            return
+        # Runs of single-width characters are copied into the line a slice at a time;
+        # wide characters and combining marks take the per-character path
+        pos, n = 0, len(text)
+        while pos < n:
+            m = NARROW_RUN.match(text, pos)
+            if m is None:
+                self.put(text[pos])
+                pos += 1
+                continue
+            end = m.end()
+            while pos < end:
+                pos = self.put_run(text, pos, end)
+
+    def put_run(self, text, pos, end):
+        """put() for text[pos:end], all single-width, up to the end of the line; returns where it stopped"""
+        if self.wrap_pending:
+            self.wrap_pending = False
+            if self.autowrap:
+                self.x = 0
+                self.index()
+        line = self.lines[self.y]
+        x = self.x
+        n = min(end - pos, self.cols - x)
+        stop = x + n
+        chars = line.chars
+        if chars[x] == '' and x > 0:
+            chars[x - 1] = ' '
+        if stop < self.cols and chars[stop] == '':
+            chars[stop] = ' '
+        chars[x:stop] = text[pos:pos + n]
+        line.attrs[x:stop] = array('I', [self.attr]) * n
+        line.dirty = True
+        if stop >= self.cols:
+            self.x = self.cols - 1
+            self.wrap_pending = True
+        else:
+            self.x = stop
+        return pos + n
+
+    def put(self, ch):
+        w = char_width(ch)
+        if w == 0:
+            # Combining mark: belongs to the previous cell
+            x = self.x if self.wrap_pending else self.x - 1
+            line = self.lines[self.y]
+            while x > 0 and line.chars[x] == '':
+                x -= 1
+            if x >= 0:
+                line.chars[x] += ch
+                line.dirty = True
+            return
+        if self.wrap_pending or (w == 2 and self.x == self.cols - 1):
+            self.wrap_pending = False
+            if self.autowrap:
+                self.x = 0
+                self.index()
+            elif w == 2:
+                self.x = self.cols - 2  # no wrap and no room: the last two cells
+        line = self.lines[self.y]
+        x = self.x
+        chars = line.chars
+        # Overwriting half of a double-width character blanks the other half
+        if chars[x] == '' and x > 0:
+            chars[x - 1] = ' '
+        end = x + w
+        if end < self.cols and chars[end] == '':
+            chars[end] = ' '
+        chars[x] = ch
+        line.attrs[x] = self.attr
+        if w == 2:
+            chars[x + 1] = ''
+            line.attrs[x + 1] = self.attr
+        line.dirty = True
+        if end >= self.cols:
+            self.x = self.cols - 1
+            self.wrap_pending = True
+        else:
+            self.x = end
+
+    def control(self, seq):
+        c = seq[0]
+        if c != '\x1b':
+            if c == '\r':
+                self.x = 0
+                self.wrap_pending = False
+            elif c in '\n\x0b\x0c':
+                self.index()
+            elif c == '\x08':
+                if self.wrap_pending:
+                    self.wrap_pending = False
+                elif self.x > 0:
+                    self.x -= 1
+            elif c == '\t':
+                self.x = min(self.cols - 1, (self.x // TAB_WIDTH + 1) * TAB_WIDTH)
+            return
+        kind = seq[1]
+        if kind == '[':
+            m = CSI.match(seq)
+            if m:
+                self.csi(m.group(1), m.group(2), m.group(3))
+        elif kind == '7':
+            self.saved = (self.x, self.y, self.attr)
+        elif kind == '8':
+            self.x, self.y, self.attr = self.saved
+            self.wrap_pending = False
+        elif kind == 'D':
+            self.index()
+        elif kind == 'E':
+            self.x = 0
+            self.index()
+        elif kind == 'M':
+            self.reverse_index()
+        elif kind == 'c':
+            self.reset()
+        # OSC, charsets, keypad modes: nothing to draw
+
+    # --- cursor and scrolling ---
+
+    def move_to(self, x, y):
+        self.x = max(0, min(self.cols - 1, x))
+        self.y = max(0, min(self.rows - 1, y))
+        self.wrap_pending = False
+
+    def index(self):
+        """Line feed: down one line, scrolling the region at its bottom margin"""
+        if self.y == self.bottom:
+            self.scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def reverse_index(self):
+        if self.y == self.top:
+            self.scroll_down(1)
+        elif self.y > 0:
+            self.y -= 1
+
+    def blank_line(self):
+        return Line(self.cols, self.attr & BG_MASK)
+
+    def scroll_up(self, n, top=None):
+        top = self.top if top is None else top
+        bottom = self.bottom
+        n = min(n, bottom - top + 1)
+        history = top == 0 and bottom == self.rows - 1 and self.main is None
+        lines = self.lines
+        for _ in range(n):
+            line = lines.pop(top)
+            lines.insert(bottom, self.blank_line())
+            if history:
+                self.scrolled.append(FrozenLine(line))
+                self.scrolled_count += 1
+        if not history:
+            # Lines moved inside a region: the widget copy no longer lines up with them
+            self.mark_dirty(top, bottom + 1)
+
+    def scroll_down(self, n, top=None):
+        top = self.top if top is None else top
+        bottom = self.bottom
+        n = min(n, bottom - top + 1)
+        for _ in range(n):
+            del self.lines[bottom]
+            self.lines.insert(top, self.blank_line())
+        self.mark_dirty(top, bottom + 1)
+
+    def mark_dirty(self, start=0, end=None):
+        for line in self.lines[start:end]:
+            line.dirty = True
+
+    def take_scrolled(self):
+        """(FrozenLines still held, how many scrolled off in total) since the last call"""
+        scrolled, count = list(self.scrolled), self.scrolled_count
+        self.scrolled.clear()
+        self.scrolled_count = 0
+        return scrolled, count
+
+    # --- CSI ---
+
+    def csi(self, private, params, final):
+        args = [int(p) if p.isdigit() else 0 for p in params.replace(':', ';').split(';')] if params else []
+        n = args[0] if args and args[0] else 1
+        if private == '?':
+            if final in 'hl':
+                self.set_modes(args, final == 'h')
+            return
+        if private:
+            return
+        if final == 'm':
+            self.sgr(args)
+        elif final in 'Hf':
+            row = args[0] if args and args[0] else 1
+            col = args[1] if len(args) > 1 and args[1] else 1
+            self.move_to(col - 1, row - 1)
+        elif final == 'A':
+            self.move_to(self.x, max(self.y - n, self.top if self.y >= self.top else 0))
+        elif final == 'B':
+            self.move_to(self.x, min(self.y + n, self.bottom if self.y <= self.bottom else self.rows - 1))
+        elif final in 'Ca':
+            self.move_to(self.x + n, self.y)
+        elif final == 'D':
+            self.move_to(self.x - n, self.y)
+        elif final == 'E':
+            self.move_to(0, self.y + n)
+        elif final == 'F':
+            self.move_to(0, self.y - n)
+        elif final in 'G`':
+            self.move_to(n - 1, self.y)
+        elif final == 'd':
+            self.move_to(self.x, n - 1)
+        elif final == 'K':
+            self.erase_line(args[0] if args else 0)
+        elif final == 'J':
+            self.erase_display(args[0] if args else 0)
+        elif final == 'X':
+            self.lines[self.y].erase(self.x, min(self.cols, self.x + n), self.attr & BG_MASK)
+        elif final == 'P':
+            self.delete_chars(n)
+        elif final == '@':
+            self.insert_chars(n)
+        elif final == 'L':
+            if self.top <= self.y <= self.bottom:
+                self.scroll_down(n, self.y)
+                self.x = 0
+        elif final == 'M':
+            if self.top <= self.y <= self.bottom:
+                self.scroll_up(n, self.y)
+                self.x = 0
+        elif final == 'S':
+            self.scroll_up(n)
+        elif final == 'T':
+            self.scroll_down(n)
+        elif final == 'r':
+            top = (args[0] if args and args[0] else 1) - 1
+            bottom = (args[1] if len(args) > 1 and args[1] else self.rows) - 1
+            if 0 <= top < bottom < self.rows:
+                self.top, self.bottom = top, bottom
+                self.move_to(0, 0)
+        elif final == 's':
+            self.saved = (self.x, self.y, self.attr)
+        elif final == 'u':
+            self.x, self.y, self.attr = self.saved
+            self.wrap_pending = False
+
+    def set_modes(self, modes, on):
+        for mode in modes:
+            if mode == 7:
+                self.autowrap = on
+            elif mode == 25:
+                self.cursor_visible = on
+            elif mode in (47, 1047, 1049):
+                self.alternate_screen(on)
+
+    def alternate_screen(self, on):
+        if on and self.main is None:
+            self.main = (self.lines, self.x, self.y)
+            self.lines = [Line(self.cols) for _ in range(self.rows)]
+        elif not on and self.main is not None:
+            self.lines, self.x, self.y = self.main
+            self.main = None
+            self.mark_dirty()
+        self.wrap_pending = False
+
+    def erase_line(self, mode):
+        line = self.lines[self.y]
+        bg = self.attr & BG_MASK
+        if mode == 0:
+            line.erase(self.x, self.cols, bg)
+        elif mode == 1:
+            line.erase(0, self.x + 1, bg)
+        elif mode == 2:
+            line.erase(0, self.cols, bg)
+
+    def erase_display(self, mode):
+        bg = self.attr & BG_MASK
+        if mode == 0:
+            self.erase_line(0)
+            rows = range(self.y + 1, self.rows)
+        elif mode == 1:
+            self.erase_line(1)
+            rows = range(0, self.y)
+        elif mode == 2:
+            rows = range(self.rows)
+        else:
+            return      # 3 = scrollback; the widget keeps it
+        for y in rows:
+            self.lines[y].erase(0, self.cols, bg)
+
+    def delete_chars(self, n):
+        line = self.lines[self.y]
+        n = min(n, self.cols - self.x)
+        del line.chars[self.x:self.x + n]
+        del line.attrs[self.x:self.x + n]
+        line.chars.extend([' '] * n)
+        line.attrs.extend(array('I', [self.attr & BG_MASK]) * n)
+        line.dirty = True
+
+    def insert_chars(self, n):
+        line = self.lines[self.y]
+        n = min(n, self.cols - self.x)
+        line.chars[self.x:self.x] = [' '] * n
+        line.attrs[self.x:self.x] = array('I', [self.attr & BG_MASK]) * n
+        del line.chars[self.cols:]
+        del line.attrs[self.cols:]
+        line.dirty = True
+
+    def sgr(self, args):
+        if not args:
+            args = [0]
+        attr = self.attr
+        i = 0
+        while i < len(args):
+            p = args[i]
+            if p == 0:
+                attr = 0
+            elif p == 1:
+                attr |= BOLD
+            elif p == 22:
+                attr &= ~BOLD
+            elif p == 7:
+                attr |= REVERSE
+            elif p == 27:
+                attr &= ~REVERSE
+            elif 30 <= p <= 37 or 90 <= p <= 97:
+                attr = (attr & ~FG_MASK) | p
+            elif p == 39:
+                attr &= ~FG_MASK
+            elif 40 <= p <= 47 or 100 <= p <= 107:
+                attr = (attr & ~BG_MASK) | p << 8
+            elif p == 49:
+                attr &= ~BG_MASK
+            elif p in (38, 48):
+                # 256-colour / truecolour: the 16 basic colours map onto our tags, the rest is dropped
+                if i + 1 < len(args) and args[i + 1] == 5:
+                    if i + 2 < len(args) and args[i + 2] < 16:
+                        c = args[i + 2]
+                        code = (30 + c) if c < 8 else (90 + c - 8)
+                        if p == 38:
+                            attr = (attr & ~FG_MASK) | code
+                        else:
+                            attr = (attr & ~BG_MASK) | (code + 10) << 8
+                    i += 2
+                elif i + 1 < len(args) and args[i + 1] == 2:
+                    i += 4
+            i += 1
+        self.attr = attr
+
+    # --- renderer helpers ---
+
+    def cursor_column(self):
+        """Cursor position in widget characters (double-width cells count once)"""
+        return self.x - self.lines[self.y].chars[:self.x].count('')
+
+    def text(self):
+        return "\n".join(line.text() for line in self.lines)
+
+
+_tag_cache = {}
+
+
+def attr_tags(attr):
+    """Tk tag names for an attribute word (tags are configured by AnsiColorText)"""
+    tags = _tag_cache.get(attr)
+    if tags is None:
+        fg, bg = attr & FG_MASK, (attr & BG_MASK) >> 8
+        tags = []
+        if attr & REVERSE:
+            fg, bg = (bg - 10 if bg else 0), (fg + 10 if fg else 0)
+            tags += [] if fg else ["rev_fg"]
+            tags += [] if bg else ["rev_bg"]
+        if attr & BOLD:
+            tags.append("bold")
+        if fg:
+            tags.append(f"fg_{fg}")
+        if bg:
+            tags.append(f"bg_{bg}")
+        tags = _tag_cache[attr] = tuple(tags)
+    return tags
+
+
+def line_runs(line, length):
+    """Text.insert arguments for the first `length` cells: text, tags, text, tags, ..."""
+    chars, attrs = line.chars, line.attrs
+    args = []
+    if not length:
+        return args
+    start = 0
+    attr = attrs[0]
+    for i in range(1, length):
+        if attrs[i] != attr:
+            args.append("".join(chars[start:i]))
+            args.append(attr_tags(attr))
+            start = i
+            attr = attrs[i]
+    args.append("".join(chars[start:length]))
+    args.append(attr_tags(attr))
+    return args